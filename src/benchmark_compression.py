@@ -0,0 +1,71 @@
+import argparse
+import logging
+import os
+import time
+from message.message import DATA_MAX_SIZE
+from utils.compression import CODECS, ChunkCodec
+from utils.misc import CustomHelpFormatter
+from utils.logger import logger
+
+# Tamaño de cada muestra sintética (bytes)
+SAMPLE_BYTES = 4 * 1024 * 1024
+
+
+def synthetic_samples():
+    """Genera muestras compresible (CSV/log), incompresible (aleatoria) y
+    de ceros"""
+    row = b"2025-10-01T12:00:00,host-07,GET /api/files,200,1532\n"
+    return {
+        'csv': (row * (SAMPLE_BYTES // len(row) + 1))[:SAMPLE_BYTES],
+        'random': os.urandom(SAMPLE_BYTES),
+        'zeros': bytes(SAMPLE_BYTES),
+    }
+
+
+def benchmark(data, compression):
+    """Codifica y decodifica los datos en bloques de DATA_MAX_SIZE como en
+    una transferencia. Devuelve la relación de tamaño y el throughput de
+    codificación y decodificación en MB/s"""
+    codec = ChunkCodec(compression)
+    chunks = [data[i:i + DATA_MAX_SIZE]
+              for i in range(0, len(data), DATA_MAX_SIZE)]
+
+    start = time.perf_counter()
+    payloads = [codec.encode(chunk) for chunk in chunks]
+    encode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decoded = b"".join(codec.decode(payload) for payload in payloads)
+    decode_time = time.perf_counter() - start
+
+    assert decoded == data
+    ratio = sum(len(payload) for payload in payloads) / len(data)
+    megabytes = len(data) / 1024 ** 2
+    return ratio, megabytes / encode_time, megabytes / decode_time
+
+
+def main():
+    """Mide cada compresión sobre muestras sintéticas y archivos dados"""
+    parser = argparse.ArgumentParser(description="Compression benchmark",
+                                     formatter_class=CustomHelpFormatter)
+    parser.add_argument("files", metavar="FILEPATH", nargs="*",
+                        help="extra files to measure")
+    args = parser.parse_args()
+    logger.setLevel(logging.ERROR)
+
+    samples = synthetic_samples()
+    for filename in args.files:
+        with open(filename, 'rb') as file:
+            samples[os.path.basename(filename)] = file.read()
+
+    print(f"{'muestra':<16}{'codec':<8}{'tamaño':>8}"
+          f"{'cod MB/s':>12}{'dec MB/s':>12}")
+    for name, data in samples.items():
+        for compression in CODECS:
+            ratio, encode_rate, decode_rate = benchmark(data, compression)
+            print(f"{name:<16}{compression:<8}{ratio:>8.1%}"
+                  f"{encode_rate:>12.1f}{decode_rate:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+from message.message import Message, MessageType
+from message.utils import send_message
+from utils.logger import logger
+
+# Espera de la respuesta antes de repetir el pedido (segundos)
+REQUEST_TIMEOUT = 0.5
+MAX_ATTEMPTS = 10
+
+
+def catalog_request(mux, session, message):
+    """Envía un LIST o STAT por la sesión y espera su respuesta,
+    repitiéndolo si se pierde. Debe llamarse desde el thread que atiende el
+    socket del mux. Devuelve el CATALOG con el mismo número de secuencia, un
+    ERROR o None si el servidor no responde"""
+    for _ in range(MAX_ATTEMPTS):
+        send_message(message, session.sock, session.sock.address,
+                     REQUEST_TIMEOUT)
+        while not message.is_timeout():
+            mux.poll(REQUEST_TIMEOUT)
+            while not session.messages_queue.empty():
+                response = session.messages_queue.get()
+                if response.get_type() == MessageType.ERROR:
+                    return response
+                if (response.get_type() == MessageType.CATALOG and
+                        response.get_seq_number() ==
+                        message.get_seq_number()):
+                    return response
+                # Respuesta repetida de un pedido anterior
+                logger.debug(f"Respuesta descartada: {response}")
+    return None
+
+
+def list_catalog(mux, server_address):
+    """Pide todas las páginas del catálogo del servidor. Devuelve la lista
+    de entradas (nombre, tamaño, mtime, digest) o None si el servidor no
+    responde"""
+    session = mux.open_session(server_address)
+    entries = []
+    cursor = ""
+    page = 0
+    try:
+        while True:
+            response = catalog_request(mux, session,
+                                       Message.list(cursor, page))
+            if not response or response.get_type() != MessageType.CATALOG:
+                return None
+            entries.extend(response.get_catalog_entries())
+            cursor = response.get_next_cursor()
+            page += 1
+            if not cursor:
+                return entries
+    finally:
+        mux.close_session(session)
+
+
+def stat_file(mux, server_address, name):
+    """Pide la información de un archivo, con su digest. Devuelve la
+    respuesta del servidor (CATALOG o ERROR) o None si no responde"""
+    session = mux.open_session(server_address)
+    try:
+        return catalog_request(mux, session, Message.stat(name))
+    finally:
+        mux.close_session(session)
@@ -0,0 +1,197 @@
+import math
+import os
+import random
+import select
+import socket
+import struct
+import time
+from client.transfers import IDLE_TIMEOUT
+from message.message import DATA_MAX_SIZE, Message, MessageType
+from message.session import SessionSocket
+from message.utils import recv_message, send_message
+from utils.digest import file_md5
+from utils.files import create_temp_beside
+from utils.logger import logger
+
+# Cada cuánto se piden los bloques faltantes: se suma una fracción al azar
+# para que los receptores no manden sus NAKs a la vez
+NAK_INTERVAL = 0.2
+NAK_JITTER = 0.5
+# Segundos que se espera el anuncio del archivo antes de abandonar
+ANNOUNCE_WAIT = 60
+# Copias del aviso de descarga completa: si se pierden todas el emisor
+# termina igual cuando dejan de llegar NAKs
+ACK_END_COPIES = 3
+
+
+def open_group_socket(group, interface=None):
+    """Crea un socket suscripto al grupo multicast. Varios receptores de la
+    misma máquina pueden escuchar el mismo grupo"""
+    host, port = group
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(('', port))
+    membership = struct.pack("4s4s", socket.inet_aton(host),
+                             socket.inet_aton(interface or '0.0.0.0'))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+    return sock
+
+
+def missing_ranges(received, limit):
+    """Rangos (primero, último) de bloques, numerados desde 1, que faltan
+    entre los primeros limit"""
+    ranges = []
+    position = received.find(0, 0, limit)
+    while position != -1:
+        end = received.find(1, position, limit)
+        end = limit if end == -1 else end
+        ranges.append((position + 1, end))
+        position = received.find(0, end, limit)
+    return ranges
+
+
+class MulticastReceiver:
+    """Recepción de un archivo distribuido por multicast. Los bloques
+    llegan por el grupo; los que faltan se piden al emisor con NAKs y
+    pueden volver por el grupo o solo a este receptor. Los NAKs, los
+    reenvíos unicast y el aviso final usan un socket propio, así que varios
+    receptores pueden compartir máquina. El archivo se verifica con su MD5 y
+    reemplaza al destino recién al completarse"""
+    def __init__(self, filename, name, group, interface=None):
+        """
+        Inicializa la recepción
+
+        Args:
+            filename: Ruta del archivo local de destino
+            name: Nombre del archivo distribuido
+            group: Dirección (host, port) del grupo multicast
+            interface: Dirección IP local por la que se recibe el grupo
+        """
+        self.filename = filename
+        self.name = name
+        self.group_sock = open_group_socket(group, interface)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Socket de la sesión con el emisor (None hasta el anuncio)
+        self.session = None
+        self.size = 0
+        self.digest = ""
+        self.fd = None
+        self.path = None
+        # Un byte por bloque: 1 si ya llegó
+        self.received = bytearray()
+        self.remaining = 0
+        # Bloques que el emisor envió hasta ahora
+        self.sent = 0
+        self.last_activity = time.monotonic()
+
+    def run(self):
+        """Recibe el archivo. Devuelve si quedó descargado y verificado"""
+        try:
+            return self.receive()
+        finally:
+            if self.fd is not None:
+                os.close(self.fd)
+            if self.path and os.path.exists(self.path):
+                os.remove(self.path)
+            self.group_sock.close()
+            self.sock.close()
+
+    def receive(self):
+        deadline = time.monotonic() + ANNOUNCE_WAIT
+        next_nak = 0
+        while not self.session or self.remaining:
+            now = time.monotonic()
+            if not self.session and now > deadline:
+                logger.error(f"No se recibió el anuncio de {self.name}.")
+                return False
+            if self.session and now - self.last_activity > IDLE_TIMEOUT:
+                logger.error("El emisor dejó de responder.")
+                return False
+            if self.session and now >= next_nak:
+                self.send_nak()
+                next_nak = now + NAK_INTERVAL * (
+                    1 + random.random() * NAK_JITTER)
+            ready, _, _ = select.select([self.group_sock, self.sock], [], [],
+                                        NAK_INTERVAL)
+            for sock in ready:
+                self.drain(sock)
+        return self.finish()
+
+    def drain(self, sock):
+        """Procesa los mensajes que ya llegaron al socket"""
+        while True:
+            try:
+                message, address = recv_message(sock, 0)
+            except (BlockingIOError, ConnectionRefusedError):
+                return
+            if message:
+                self.handle(message, address)
+
+    def handle(self, message, address):
+        """Procesa un anuncio o un bloque de datos"""
+        if message.get_type() == MessageType.ANNOUNCE:
+            announce = message.get_announce()
+            if not announce:
+                return
+            if not self.session and announce[0] == self.name:
+                self.start(message.get_session_id(), address, *announce[1:])
+            if (self.session and
+                    message.get_session_id() == self.session.session_id):
+                self.sent = max(self.sent, announce[3])
+                self.last_activity = time.monotonic()
+        elif (message.get_type() == MessageType.DATA and self.session and
+              message.get_session_id() == self.session.session_id):
+            self.last_activity = time.monotonic()
+            self.store(message.get_seq_number(), message.get_data())
+
+    def start(self, session_id, address, size, digest, sent):
+        """Prepara la recepción al recibir el primer anuncio"""
+        logger.info(f"Recibiendo {self.name} ({size} bytes) de {address}")
+        self.session = SessionSocket(self.sock, session_id, address)
+        self.size = size
+        self.digest = digest
+        chunks = math.ceil(size / DATA_MAX_SIZE)
+        self.received = bytearray(chunks)
+        self.remaining = chunks
+        self.sent = sent
+        self.fd, self.path = create_temp_beside(self.filename)
+        os.ftruncate(self.fd, size)
+
+    def store(self, seq, data):
+        """Escribe un bloque en su lugar si todavía faltaba"""
+        index = seq - 1
+        if not 0 <= index < len(self.received) or self.received[index]:
+            return
+        expected = min(DATA_MAX_SIZE, self.size - index * DATA_MAX_SIZE)
+        if len(data) != expected:
+            logger.debug(f"Bloque {seq} de tamaño inválido: {len(data)}")
+            return
+        os.pwrite(self.fd, data, index * DATA_MAX_SIZE)
+        self.received[index] = 1
+        self.remaining -= 1
+        self.sent = max(self.sent, seq)
+
+    def send_nak(self):
+        """Pide al emisor los bloques faltantes entre los ya enviados"""
+        ranges = missing_ranges(self.received,
+                                min(self.sent, len(self.received)))
+        if ranges:
+            logger.debug(f"NAK de {len(ranges)} rangos")
+            send_message(Message.nak(ranges), self.session,
+                         self.session.address)
+
+    def finish(self):
+        """Verifica el archivo, lo mueve a su lugar y avisa al emisor"""
+        os.close(self.fd)
+        self.fd = None
+        if file_md5(self.path) != self.digest:
+            logger.error(f"Error en la integridad de {self.name}.")
+            return False
+        os.replace(self.path, self.filename)
+        for _ in range(ACK_END_COPIES):
+            send_message(Message.ack_end(), self.session,
+                         self.session.address)
+        logger.info(f"Archivo {self.filename} descargado y verificado.")
+        return True
@@ -0,0 +1,85 @@
+import queue
+import threading
+import time
+from message.message import MessageType
+from message.session import SessionSocket, new_session_id
+from message.utils import recv_message
+from utils.logger import logger
+
+
+class ClientSession:
+    """Estado de una transferencia multiplexada sobre el socket del cliente"""
+    def __init__(self, session_id, sock, address):
+        """
+        Inicializa la sesión
+
+        Args:
+            session_id: Id de la sesión
+            sock: Socket UDP compartido
+            address: Tupla (host, port) del servidor
+        """
+        self.session_id = session_id
+        self.sock = SessionSocket(sock, session_id, address)
+        self.messages_queue = queue.Queue()
+        self.last_activity = time.time()
+        # Bytes de DATA recibidos (comprimidos si hay compresión), para
+        # estimar el avance de la transferencia
+        self.received_bytes = 0
+
+    def add_message(self, message, address):
+        """Añade un mensaje a la cola de la sesión, siguiendo al servidor si
+        cambió de dirección"""
+        if address != self.sock.address:
+            logger.debug(f"La sesión {self.session_id:08x} cambió de "
+                         f"dirección: {self.sock.address} -> {address}")
+            self.sock.update_address(address)
+        if message.get_type() == MessageType.DATA:
+            self.received_bytes += len(message.get_data())
+        self.messages_queue.put(message)
+        self.last_activity = time.time()
+
+    def idle_time(self):
+        """Segundos transcurridos desde el último mensaje recibido"""
+        return time.time() - self.last_activity
+
+
+class SessionMux:
+    """Multiplexa varias transferencias concurrentes sobre un único socket
+    UDP, despachando cada mensaje recibido según su id de sesión"""
+    def __init__(self, sock):
+        """
+        Inicializa el multiplexor
+
+        Args:
+            sock: Socket UDP del cliente
+        """
+        self.sock = sock
+        self.sessions = dict[int, ClientSession]()
+        self.lock = threading.Lock()
+
+    def open_session(self, address):
+        """Crea una nueva sesión hacia el servidor indicado"""
+        with self.lock:
+            session_id = new_session_id(self.sessions)
+            session = ClientSession(session_id, self.sock, address)
+            self.sessions[session_id] = session
+        return session
+
+    def close_session(self, session):
+        """Elimina la sesión: sus mensajes tardíos se descartan"""
+        with self.lock:
+            self.sessions.pop(session.session_id, None)
+
+    def poll(self, timeout):
+        """Recibe a lo sumo un mensaje y lo despacha a su sesión. Devuelve
+        la sesión que lo recibió, o None"""
+        message, address = recv_message(self.sock, timeout)
+        if not message:
+            return None
+        with self.lock:
+            session = self.sessions.get(message.get_session_id())
+        if not session:
+            logger.debug(f"Mensaje para una sesión desconocida: {message}")
+            return None
+        session.add_message(message, address)
+        return session
@@ -0,0 +1,363 @@
+import os
+import threading
+import time
+from collections import Counter
+from client.catalog_client import stat_file
+from client.transfers import DownloadJob
+from message.message import MessageType
+from utils.digest import file_md5
+from utils.files import create_temp_beside
+from utils.logger import logger
+
+# Tamaño de los rangos que se piden a cada servidor: se ajusta a su
+# velocidad para que cada pedido dure alrededor de PIECE_TARGET_TIME
+MIN_PIECE_SIZE = 256 * 1024
+MAX_PIECE_SIZE = 16 * 1024 * 1024
+PIECE_TARGET_TIME = 2
+# Peso de la última medición en la velocidad estimada de un servidor
+RATE_SMOOTHING = 0.5
+# Segundos sin respuesta tras los que se abandona un rango
+PIECE_IDLE_TIMEOUT = 5
+# Fallos seguidos tras los que un servidor deja de recibir pedidos
+MAX_SOURCE_FAILURES = 3
+# Espera, por cada fallo seguido, antes de volver a pedirle a un servidor:
+# mientras tanto otro retoma el rango que falló
+RETRY_DELAY = 2
+# Cada cuánto se revisan los rangos en curso
+WATCHDOG_INTERVAL = 0.1
+
+
+class Source:
+    """Servidor del que se descargan rangos, con su velocidad estimada"""
+    def __init__(self, address):
+        self.address = address
+        # Bytes por segundo (0: todavía sin medir)
+        self.rate = 0
+        self.failures = 0
+        self.retry_at = 0
+        self.dropped = False
+        self.bytes = 0
+        self.pieces = 0
+
+    def record(self, size, elapsed):
+        """Actualiza la velocidad con un rango descargado"""
+        rate = size / max(elapsed, 1e-3)
+        self.rate = rate if not self.rate else (
+            RATE_SMOOTHING * rate + (1 - RATE_SMOOTHING) * self.rate)
+        self.bytes += size
+        self.pieces += 1
+        self.failures = 0
+
+    def piece_size(self):
+        """Tamaño del próximo rango a pedirle"""
+        if not self.rate:
+            return MIN_PIECE_SIZE
+        return int(min(MAX_PIECE_SIZE, max(MIN_PIECE_SIZE,
+                                           self.rate * PIECE_TARGET_TIME)))
+
+    def expected_time(self, size):
+        """Segundos que tardaría en descargar size bytes (None si no se
+        midió)"""
+        return size / self.rate if self.rate else None
+
+    def __str__(self):
+        return f"{self.address[0]}:{self.address[1]}"
+
+
+class Piece:
+    """Rango del archivo y los pedidos en curso que lo descargan"""
+    def __init__(self, start, length):
+        self.start = start
+        self.length = length
+        self.attempts = []
+        self.done = False
+
+
+class Attempt:
+    """Pedido de un rango a un servidor"""
+    def __init__(self, piece, source, job, path):
+        self.piece = piece
+        self.source = source
+        self.job = job
+        self.path = path
+        self.stop_event = threading.Event()
+        self.started = time.monotonic()
+        # Cancelado porque otro servidor completó el rango primero
+        self.cancelled = False
+
+
+class StripedDownloadJob:
+    """Descarga de un archivo repartida entre varios servidores con el
+    mismo contenido. Cada servidor descarga rangos a medida que termina los
+    anteriores, de un tamaño acorde a su velocidad: los lentos o con
+    pérdidas reciben menos. Al final, si solo quedan rangos en curso, los
+    servidores libres repiten los de los más lentos y se usa el primero que
+    llega. El archivo completo se verifica con su MD5 y reemplaza al
+    destino recién al terminar"""
+    def __init__(self, filename, name, protocol, compression, sources, size,
+                 md5_digest):
+        """
+        Inicializa la descarga
+
+        Args:
+            filename: Ruta del archivo local de destino
+            name: Nombre del archivo en los servidores
+            protocol: Protocolo de recuperación de errores
+            compression: Compresión ofrecida a los servidores
+            sources: Direcciones (host, port) de los servidores
+            size: Tamaño del archivo
+            md5_digest: MD5 del archivo completo
+        """
+        self.filename = filename
+        self.name = name
+        self.protocol = protocol
+        self.compression = compression
+        self.sources = [Source(address) for address in sources]
+        self.size = size
+        self.md5_digest = md5_digest
+        # run_transfers no vigila esta transferencia: cada rango tiene su
+        # propio control de inactividad
+        self.session = None
+        self.failed = False
+        # Intervalos (inicio, longitud) que nadie está descargando
+        self.unassigned = [(0, size)] if size else []
+        self.pieces = []
+        self.output = None
+        self.condition = threading.Condition()
+        self.duplicates = 0
+
+    def __str__(self):
+        return f"descarga repartida de {self.name}"
+
+    def run(self, mux, server_address, stop_event):
+        """Realiza la descarga desde todos los servidores"""
+        fd, path = create_temp_beside(self.filename)
+        os.ftruncate(fd, self.size)
+        self.output = fd
+        start_time = time.monotonic()
+        workers = [threading.Thread(target=self.serve,
+                                    args=(mux, source, stop_event))
+                   for source in self.sources]
+        try:
+            for worker in workers:
+                worker.start()
+            while any(worker.is_alive() for worker in workers):
+                self.watch(stop_event)
+                time.sleep(WATCHDOG_INTERVAL)
+        finally:
+            os.close(fd)
+        self.log_stats(time.monotonic() - start_time)
+
+        if stop_event.is_set() or self.unassigned or not all(
+                piece.done for piece in self.pieces):
+            logger.error(f"No se pudo completar la descarga de {self.name} "
+                         f"desde ningún servidor.")
+            self.failed = True
+            os.remove(path)
+            return
+        if file_md5(path) != self.md5_digest:
+            logger.error(f"Error en la integridad de {self.name}: los "
+                         f"servidores no tienen el mismo contenido.")
+            self.failed = True
+            os.remove(path)
+            return
+        os.replace(path, self.filename)
+        logger.info(f"Archivo {self.filename} descargado y verificado.")
+
+    def serve(self, mux, source, stop_event):
+        """Loop de un servidor: descarga rangos hasta que no quede nada
+        que pedirle"""
+        while True:
+            attempt = self.next_attempt(source, stop_event)
+            if not attempt:
+                return
+            try:
+                attempt.job.run(mux, source.address, attempt.stop_event)
+            except Exception as e:
+                logger.error(f"Falló el rango de {source}: {e}")
+                attempt.job.failed = True
+            finally:
+                self.finish(attempt)
+
+    def next_attempt(self, source, stop_event):
+        """Asigna al servidor el próximo rango: uno nuevo si queda sin
+        asignar o, al final, uno que otro servidor más lento todavía está
+        descargando. Espera mientras no haya nada que darle y devuelve None
+        cuando terminó la descarga o el servidor quedó descartado"""
+        with self.condition:
+            while True:
+                if stop_event.is_set() or source.dropped:
+                    return None
+                if time.monotonic() < source.retry_at:
+                    self.condition.wait(WATCHDOG_INTERVAL)
+                    continue
+                if self.unassigned:
+                    return self.assign(self.carve(source), source)
+                in_progress = [piece for piece in self.pieces
+                               if not piece.done]
+                if not in_progress:
+                    return None
+                piece = self.slowest_piece(source, in_progress)
+                if piece:
+                    self.duplicates += 1
+                    logger.debug(f"{source} repite el rango "
+                                 f"{piece.start}+{piece.length}")
+                    return self.assign(piece, source)
+                self.condition.wait(WATCHDOG_INTERVAL)
+
+    def carve(self, source):
+        """Separa del primer intervalo sin asignar un rango del tamaño que
+        le corresponde al servidor. Debe llamarse con el lock tomado"""
+        start, length = self.unassigned[0]
+        size = source.piece_size()
+        # No dejar un resto chico que requiera otro pedido
+        if length <= size + MIN_PIECE_SIZE // 2:
+            size = length
+            self.unassigned.pop(0)
+        else:
+            self.unassigned[0] = (start + size, length - size)
+        piece = Piece(start, size)
+        self.pieces.append(piece)
+        return piece
+
+    def slowest_piece(self, source, pieces):
+        """Elige un rango en curso que el servidor terminaría antes que
+        quien lo descarga, o None. Debe llamarse con el lock tomado"""
+        best, best_gain = None, 0
+        for piece in pieces:
+            if len(piece.attempts) != 1:
+                continue
+            holder = piece.attempts[0]
+            if holder.source is source:
+                continue
+            own = source.expected_time(piece.length)
+            if own is None:
+                continue
+            remaining = self.remaining_time(holder)
+            if remaining - own > best_gain:
+                best, best_gain = piece, remaining - own
+        return best
+
+    def remaining_time(self, attempt):
+        """Segundos que le faltan a un pedido en curso: según la velocidad
+        estimada de su servidor mientras no se pase de ella y, si ya se
+        pasó, según lo que lleva recibido. Un pedido vencido que no recibió
+        nada nunca termina"""
+        piece = attempt.piece
+        elapsed = time.monotonic() - attempt.started
+        expected = attempt.source.expected_time(piece.length)
+        if expected is None:
+            expected = PIECE_TARGET_TIME
+        if elapsed <= expected:
+            return expected - elapsed
+        session = attempt.job.session
+        received = min(session.received_bytes if session else 0,
+                       piece.length)
+        if not received:
+            return float("inf")
+        return elapsed * (piece.length - received) / received
+
+    def assign(self, piece, source):
+        """Crea el pedido del rango al servidor. Debe llamarse con el lock
+        tomado"""
+        fd, path = create_temp_beside(self.filename, suffix=".piece")
+        os.close(fd)
+        job = DownloadJob(path, self.name, self.protocol, self.compression,
+                          byte_range=(piece.start, piece.length))
+        attempt = Attempt(piece, source, job, path)
+        piece.attempts.append(attempt)
+        return attempt
+
+    def finish(self, attempt):
+        """Incorpora el resultado de un pedido: copia el rango al archivo
+        si llegó íntegro o lo devuelve a los pendientes si falló"""
+        piece, source = attempt.piece, attempt.source
+        elapsed = time.monotonic() - attempt.started
+        with self.condition:
+            piece.attempts.remove(attempt)
+            received = (not attempt.stop_event.is_set() and
+                        not attempt.job.failed and
+                        os.path.getsize(attempt.path) == piece.length)
+            if received and not piece.done:
+                with open(attempt.path, "rb") as file:
+                    os.pwrite(self.output, file.read(), piece.start)
+                piece.done = True
+                source.record(piece.length, elapsed)
+                for other in piece.attempts:
+                    other.cancelled = True
+                    other.stop_event.set()
+            elif not received and not attempt.cancelled:
+                self.fail(attempt)
+            if os.path.exists(attempt.path):
+                os.remove(attempt.path)
+            self.condition.notify_all()
+
+    def fail(self, attempt):
+        """Cuenta el fallo del servidor y devuelve el rango a los
+        pendientes si nadie más lo descarga. Debe llamarse con el lock
+        tomado"""
+        piece, source = attempt.piece, attempt.source
+        source.failures += 1
+        logger.info(f"Falló el rango {piece.start}+{piece.length} de "
+                    f"{source} ({source.failures} seguidos)")
+        if source.failures >= MAX_SOURCE_FAILURES:
+            logger.error(f"Se deja de usar el servidor {source}.")
+            source.dropped = True
+        source.retry_at = time.monotonic() + RETRY_DELAY * source.failures
+        if piece.done or piece.attempts:
+            return
+        self.pieces.remove(piece)
+        self.unassigned.append((piece.start, piece.length))
+        self.unassigned.sort()
+
+    def watch(self, stop_event):
+        """Abandona los pedidos cuyo servidor dejó de responder"""
+        with self.condition:
+            for piece in self.pieces:
+                for attempt in piece.attempts:
+                    session = attempt.job.session
+                    if stop_event.is_set() or (
+                            session and not attempt.stop_event.is_set() and
+                            session.idle_time() > PIECE_IDLE_TIMEOUT):
+                        attempt.stop_event.set()
+
+    def log_stats(self, elapsed):
+        for source in self.sources:
+            logger.info(f"{source}: {source.bytes} bytes en "
+                        f"{source.pieces} rangos"
+                        f"{' (descartado)' if source.dropped else ''}")
+        logger.info(f"{len(self.pieces)} rangos, {self.duplicates} repetidos, "
+                    f"{self.size / max(elapsed, 1e-3) / 1024:.0f} KiB/s")
+
+
+def plan_striped_download(mux, sources, filename, name, protocol,
+                          compression):
+    """Consulta el archivo en cada servidor y arma la descarga repartida
+    entre los que tienen el mismo contenido (el que reporta la mayoría).
+    Devuelve la transferencia o None si ningún servidor lo tiene. Debe
+    llamarse desde el thread que atiende el socket del mux"""
+    versions = {}
+    for address in sources:
+        response = stat_file(mux, address, name)
+        if not response or response.get_type() != MessageType.CATALOG:
+            logger.error(f"El servidor {address[0]}:{address[1]} no tiene "
+                         f"el archivo {name}.")
+            continue
+        entries = response.get_catalog_entries()
+        if not entries or not entries[0][3]:
+            continue
+        _, size, _, digest = entries[0]
+        versions[address] = (int(size), digest)
+    if not versions:
+        return None
+    version, _ = Counter(versions.values()).most_common(1)[0]
+    chosen = [address for address in sources
+              if versions.get(address) == version]
+    for address, other in versions.items():
+        if other != version:
+            logger.warning(f"El servidor {address[0]}:{address[1]} tiene "
+                           f"otra versión de {name}; no se usa.")
+    logger.info(f"Descarga de {name} ({version[0]} bytes) desde "
+                f"{len(chosen)} servidores")
+    return StripedDownloadJob(filename, name, protocol, compression, chosen,
+                              *version)
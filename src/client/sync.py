@@ -0,0 +1,157 @@
+import os
+from client.catalog_client import list_catalog, stat_file
+from client.transfers import (
+    DownloadBundleJob, DownloadJob, UploadBundleJob, UploadJob
+)
+from message.message import MessageType
+from utils.bundle import BUNDLE_FILE_MAX_SIZE, bundle_batches
+from utils.digest import file_md5
+from utils.logger import logger
+
+# Caracteres que el protocolo usa como separadores y no pueden ir en un
+# nombre de archivo
+RESERVED_CHARACTERS = ('|', '\0', '\n')
+
+
+def valid_name(name):
+    """Indica si el archivo puede sincronizarse: los nombres con punto son
+    temporales y datos internos del servidor"""
+    return not name.startswith('.') and not any(
+        character in name for character in RESERVED_CHARACTERS)
+
+
+def local_files(directory):
+    """Devuelve {nombre: tamaño} de los archivos regulares del directorio"""
+    files = {}
+    with os.scandir(directory) as entries:
+        for item in entries:
+            if item.is_file() and valid_name(item.name):
+                files[item.name] = item.stat().st_size
+    return files
+
+
+def remote_files(mux, server_address):
+    """Devuelve {nombre: (tamaño, digest)} del catálogo del servidor, o None
+    si no responde. El digest es "" si el servidor aún no lo calculó"""
+    entries = list_catalog(mux, server_address)
+    if entries is None:
+        return None
+    return {name: (size, digest) for name, size, _, digest in entries}
+
+
+def remote_digest(mux, server_address, name, digest):
+    """Devuelve el digest de un archivo del servidor, pidiéndolo con un STAT
+    si el LIST no lo traía. None si no se pudo obtener"""
+    if digest:
+        return digest
+    response = stat_file(mux, server_address, name)
+    if not response or response.get_type() != MessageType.CATALOG:
+        return None
+    entries = response.get_catalog_entries()
+    return entries[0][3] if entries else None
+
+
+def changed(mux, server_address, filename, local_size, remote):
+    """Compara un archivo local con su copia del servidor: por tamaño y, si
+    coincide, por digest"""
+    remote_size, digest = remote
+    if local_size != remote_size:
+        return True
+    return file_md5(filename) != remote_digest(mux, server_address,
+                                               os.path.basename(filename),
+                                               digest)
+
+
+def plan_upload_sync(mux, server_address, directory, protocol,
+                     compression, bundle=True):
+    """Arma las subidas que dejan al servidor con los archivos del
+    directorio: los nuevos se suben completos y los modificados como delta.
+    Con bundle los archivos nuevos chicos se agrupan en bundles. Devuelve la
+    lista de transferencias o None si el servidor no responde. Debe
+    llamarse desde el thread que atiende el socket del mux"""
+    remote = remote_files(mux, server_address)
+    if remote is None:
+        return None
+    jobs = []
+    small = []
+    for name, size in sorted(local_files(directory).items()):
+        filename = os.path.join(directory, name)
+        if name not in remote:
+            logger.debug(f"Nuevo: {name}")
+            if bundle and size <= BUNDLE_FILE_MAX_SIZE:
+                small.append((name, size))
+            else:
+                jobs.append(UploadJob(filename, name, protocol, compression))
+        elif changed(mux, server_address, filename, size, remote[name]):
+            logger.debug(f"Modificado: {name}")
+            jobs.append(UploadJob(filename, name, protocol, compression,
+                                  delta=True))
+    logger.info(f"Archivos a subir: {len(small) + len(jobs)}")
+    return bundle_jobs(small, jobs, lambda names: UploadBundleJob(
+        directory, names, protocol, compression), lambda name: UploadJob(
+        os.path.join(directory, name), name, protocol, compression))
+
+
+def plan_download_sync(mux, server_address, directory, protocol,
+                       compression, bundle=True):
+    """Arma las descargas que dejan al directorio con los archivos del
+    servidor que faltan o cambiaron. Cada una reemplaza al archivo local
+    recién al completarse. Con bundle los archivos chicos se agrupan en
+    bundles. Devuelve la lista de transferencias o None si el servidor no
+    responde"""
+    remote = remote_files(mux, server_address)
+    if remote is None:
+        return None
+    local = local_files(directory)
+    jobs = []
+    small = []
+    for name in sorted(remote):
+        if not valid_name(name):
+            logger.warning(f"Se ignora el archivo remoto {name!r}")
+            continue
+        filename = os.path.join(directory, name)
+        if name in local and not changed(mux, server_address, filename,
+                                         local[name], remote[name]):
+            continue
+        logger.debug(f"{'Modificado' if name in local else 'Nuevo'}: {name}")
+        size = remote[name][0]
+        if bundle and size <= BUNDLE_FILE_MAX_SIZE:
+            small.append((name, size))
+        else:
+            jobs.append(DownloadJob(filename, name, protocol, compression))
+    logger.info(f"Archivos a descargar: {len(small) + len(jobs)}")
+    return bundle_jobs(small, jobs, lambda names: DownloadBundleJob(
+        directory, names, protocol, compression), lambda name: DownloadJob(
+        os.path.join(directory, name), name, protocol, compression))
+
+
+def bundle_jobs(small, jobs, bundle_job, single_job):
+    """Agrupa los archivos chicos en bundles, que van antes que el resto de
+    las transferencias. Un grupo de un solo archivo se transfiere solo"""
+    bundles = [bundle_job(names) if len(names) > 1 else single_job(names[0])
+               for names in bundle_batches(small)]
+    logger.debug(f"{len(small)} archivos chicos en {len(bundles)} "
+                 f"transferencias")
+    return bundles + jobs
+
+
+def verify_bundle_uploads(mux, server_address, jobs):
+    """Comprueba con el catálogo del servidor que cada archivo de las
+    subidas agrupadas quedó guardado con su digest. Devuelve los nombres de
+    los que no, o None si el servidor no responde"""
+    expected = {}
+    for job in jobs:
+        if isinstance(job, UploadBundleJob):
+            expected.update(job.digests)
+    if not expected:
+        return []
+    remote = remote_files(mux, server_address)
+    if remote is None:
+        return None
+    failed = []
+    for name, digest in sorted(expected.items()):
+        if name not in remote or remote_digest(
+                mux, server_address, name, remote[name][1]) != digest:
+            logger.error(f"El archivo {name} no se ha subido correctamente.")
+            failed.append(name)
+    return failed
@@ -0,0 +1,404 @@
+import hashlib
+import io
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from client.udp_stop_and_wait.upload import upload_saw_client
+from client.udp_selective_repeat.upload import upload_sr_client
+from client.udp_stop_and_wait.download import download_saw_client
+from client.udp_selective_repeat.download import download_sr_client
+from message.message import BUNDLE_REQUEST, DATA_MAX_SIZE, Message
+from utils.compression import (
+    chunk_codec, choose_compression, is_supported, sample_file
+)
+from utils.bundle import read_bundle, write_bundle
+from utils.delta import compute_delta
+from utils.digest import file_md5
+from utils.files import create_temp_beside
+from utils.logger import logger
+from utils.prefetch import PrefetchReader
+
+UPLOAD_PROTOCOLS = {'udp_saw': upload_saw_client,
+                    'udp_sr': upload_sr_client}
+DOWNLOAD_PROTOCOLS = {'udp_saw': download_saw_client,
+                      'udp_sr': download_sr_client}
+
+# Intervalo de sondeo del socket: acota cuánto tarda el cliente en salir
+# una vez que terminan las transferencias
+POLL_INTERVAL = 0.05
+# Segundos sin respuesta del servidor tras los que se abandona una
+# transferencia
+IDLE_TIMEOUT = 15
+
+
+class UploadJob:
+    """Subida de un archivo, completa o en modo delta. Se ejecuta en un
+    thread propio mientras otro atiende el socket compartido"""
+    def __init__(self, filename, name, protocol, compression, delta=False):
+        """
+        Inicializa la subida
+
+        Args:
+            filename: Ruta del archivo local
+            name: Nombre con el que se guarda en el servidor
+            protocol: Protocolo de recuperación de errores
+            compression: Compresión pedida
+            delta: Si se envían solo los cambios respecto de la copia del
+                servidor
+        """
+        self.filename = filename
+        self.name = name
+        self.protocol = protocol
+        self.compression = compression
+        self.delta = delta
+        # Sesión en curso: el loop principal vigila su actividad
+        self.session = None
+        # Si la subida terminó sin la confirmación del servidor
+        self.failed = False
+
+    def __str__(self):
+        return f"subida de {self.name}"
+
+    def receive_signature(self, mux, server_address, stop_event):
+        """Descarga la firma por bloques de la copia del servidor. Devuelve
+        la firma, b'' si el servidor no tiene el archivo o None si la
+        descarga falló"""
+        self.session = mux.open_session(server_address)
+        fd, path = tempfile.mkstemp(suffix=".signature")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                DOWNLOAD_PROTOCOLS[self.protocol](
+                    Message.download(self.name, signature=True),
+                    self.session.sock, server_address,
+                    self.session.messages_queue, file, path, stop_event)
+        finally:
+            mux.close_session(self.session)
+        # Si la firma llegó dañada el worker ya borró el archivo
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as signature_file:
+            signature = signature_file.read()
+        os.remove(path)
+        return None if stop_event.is_set() else signature
+
+    def run(self, mux, server_address, stop_event):
+        """Realiza la subida"""
+        md5_digest = file_md5(self.filename)
+        logger.info(f"Digest de {self.name}: {md5_digest}")
+
+        if self.delta:
+            # Pedir la firma de la copia del servidor y subir solo lo que
+            # cambió respecto de ella
+            signature = self.receive_signature(mux, server_address,
+                                               stop_event)
+            if signature is None:
+                logger.error(f"No se pudo obtener la firma de {self.name} "
+                             f"del servidor.")
+                self.failed = True
+                return
+            if signature:
+                # El delta se arma en un temporal a medida que se recorre el
+                # archivo, sin tener ninguno de los dos entero en memoria
+                with open(self.filename, 'rb') as file, \
+                        tempfile.TemporaryFile() as delta:
+                    reused, delta_digest = compute_delta(file, signature,
+                                                         delta)
+                    logger.info(f"Delta de {self.name} de {delta.tell()} "
+                                f"bytes: se reutilizan {reused} de "
+                                f"{file.tell()} bytes de la copia del "
+                                f"servidor")
+                    delta.seek(0)
+                    self.send(mux, server_address, delta, delta_digest,
+                              stop_event, md5_digest)
+                return
+            logger.info(f"El servidor no tiene {self.name}, se sube "
+                        f"completo.")
+
+        # Un thread lee del disco por delante del envío, que no se bloquea
+        # leyendo entre ACKs
+        file = PrefetchReader(open(self.filename, 'rb'))
+        try:
+            self.send(mux, server_address, file, md5_digest, stop_event)
+        finally:
+            file.close()
+        logger.debug(f"Lectura anticipada de {self.name}: {file.stats}")
+
+    def send(self, mux, server_address, file, md5_digest, stop_event,
+             delta_digest=None, bundle=False):
+        """Sube el contenido de file en una sesión nueva"""
+        # Comprimir solo si una muestra del archivo se achica lo suficiente
+        compression = choose_compression(sample_file(file), self.compression)
+        codec = chunk_codec(compression)
+
+        # El primer bloque viaja adjunto al UPLOAD
+        early_data = codec.encode(file.read(DATA_MAX_SIZE))
+        file_size = file.seek(0, os.SEEK_END)
+        file.seek(0)
+        upload_message = Message.upload(
+            file_size, self.name, md5_digest, early_data,
+            compression if is_supported(compression) else None,
+            delta_digest, bundle)
+
+        self.session = mux.open_session(server_address)
+        try:
+            self.failed = not UPLOAD_PROTOCOLS[self.protocol](
+                upload_message, self.session.sock, server_address,
+                self.session.messages_queue, file, stop_event)
+        finally:
+            mux.close_session(self.session)
+
+
+class UploadBundleJob(UploadJob):
+    """Subida de varios archivos chicos agrupados en un bundle: un solo
+    handshake y un solo cierre para todos"""
+    def __init__(self, directory, names, protocol, compression):
+        """
+        Inicializa la subida agrupada
+
+        Args:
+            directory: Directorio local de los archivos
+            names: Nombres de los archivos, que se mantienen en el servidor
+            protocol: Protocolo de recuperación de errores
+            compression: Compresión pedida
+        """
+        super().__init__(None, BUNDLE_REQUEST, protocol, compression)
+        self.directory = directory
+        self.names = names
+        # MD5 de cada archivo, para verificar después lo que quedó guardado
+        self.digests = {}
+
+    def __str__(self):
+        return f"subida agrupada de {len(self.names)} archivos"
+
+    def run(self, mux, server_address, stop_event):
+        """Arma el bundle y lo sube"""
+        members = []
+        for name in self.names:
+            with open(os.path.join(self.directory, name), 'rb') as file:
+                data = file.read()
+            self.digests[name] = hashlib.md5(data).hexdigest()
+            members.append((name, data))
+        file = io.BytesIO()
+        md5_digest = write_bundle(members, file)
+        file.seek(0)
+        logger.info(f"Bundle de {len(members)} archivos: "
+                    f"{file.getbuffer().nbytes} bytes")
+        self.send(mux, server_address, file, md5_digest, stop_event,
+                  bundle=True)
+
+
+class DownloadJob:
+    """Descarga de un archivo. Se descarga a un temporal que reemplaza al
+    destino solo si la descarga se completó: un error no pisa el archivo
+    local"""
+    def __init__(self, filename, name, protocol, compression,
+                 byte_range=None):
+        """
+        Inicializa la descarga
+
+        Args:
+            filename: Ruta del archivo local de destino
+            name: Nombre del archivo en el servidor
+            protocol: Protocolo de recuperación de errores
+            compression: Compresión ofrecida al servidor
+            byte_range: (offset, longitud) para descargar solo ese rango
+        """
+        self.filename = filename
+        self.name = name
+        self.protocol = protocol
+        self.compression = compression
+        self.byte_range = byte_range
+        self.session = None
+        # Si el archivo no llegó completo y verificado
+        self.failed = False
+
+    def __str__(self):
+        return f"descarga de {self.name}"
+
+    def run(self, mux, server_address, stop_event):
+        """Realiza la descarga"""
+        fd, path = create_temp_beside(self.filename)
+        file = os.fdopen(fd, "wb")
+
+        # El servidor decide si usa la compresión según lo compresible que
+        # sea el archivo
+        download_message = Message.download(
+            self.name,
+            self.compression if is_supported(self.compression) else None,
+            byte_range=self.byte_range)
+        self.session = mux.open_session(server_address)
+        try:
+            self.failed = not DOWNLOAD_PROTOCOLS[self.protocol](
+                download_message, self.session.sock, server_address,
+                self.session.messages_queue, file, path, stop_event)
+        finally:
+            file.close()
+            mux.close_session(self.session)
+
+        # Si el digest no coincidió el worker ya borró el temporal
+        if self.failed or stop_event.is_set():
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.replace(path, self.filename)
+
+
+class DownloadBundleJob:
+    """Descarga de varios archivos chicos agrupados en un bundle. Cada
+    archivo se verifica con su MD5 y reemplaza al local recién al final"""
+    def __init__(self, directory, names, protocol, compression):
+        """
+        Inicializa la descarga agrupada
+
+        Args:
+            directory: Directorio local de destino
+            names: Nombres de los archivos en el servidor
+            protocol: Protocolo de recuperación de errores
+            compression: Compresión ofrecida al servidor
+        """
+        self.directory = directory
+        self.names = names
+        self.protocol = protocol
+        self.compression = compression
+        self.bundle_session = None
+        # Descarga por separado en curso de un archivo que el servidor no
+        # incluyó en el bundle
+        self.fallback = None
+        # Archivos pedidos que no llegaron o llegaron dañados
+        self.failed = []
+
+    def __str__(self):
+        return f"descarga agrupada de {len(self.names)} archivos"
+
+    @property
+    def session(self):
+        """Sesión en curso, que el loop principal vigila"""
+        if self.fallback:
+            return self.fallback.session
+        return self.bundle_session
+
+    def run(self, mux, server_address, stop_event):
+        """Descarga el bundle y extrae sus archivos"""
+        fd, path = tempfile.mkstemp(prefix=".bundle.", suffix=".part",
+                                    dir=self.directory)
+        download_message = Message.download(
+            BUNDLE_REQUEST,
+            self.compression if is_supported(self.compression) else None,
+            bundle_names=self.names)
+        self.bundle_session = mux.open_session(server_address)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                received = DOWNLOAD_PROTOCOLS[self.protocol](
+                    download_message, self.bundle_session.sock,
+                    server_address, self.bundle_session.messages_queue,
+                    file, path, stop_event)
+        finally:
+            mux.close_session(self.bundle_session)
+
+        # Si el bundle no coincidió con su digest el worker ya lo borró
+        if not received:
+            self.failed = list(self.names)
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        try:
+            if stop_event.is_set():
+                self.failed = list(self.names)
+                return
+            received, listed = self.extract(path)
+        finally:
+            os.remove(path)
+        # El servidor omite los archivos que crecieron y ya no entran en un
+        # bundle: se piden por separado
+        for name in self.names:
+            if name in listed or stop_event.is_set():
+                continue
+            logger.info(f"El archivo {name} no vino en el bundle, se "
+                        f"descarga por separado.")
+            self.fallback = DownloadJob(os.path.join(self.directory, name),
+                                        name, self.protocol,
+                                        self.compression)
+            self.fallback.run(mux, server_address, stop_event)
+            if not self.fallback.failed:
+                received.add(name)
+        self.fallback = None
+        self.failed = [name for name in self.names if name not in received]
+        for name in self.failed:
+            logger.error(f"El archivo {name} no se ha podido descargar.")
+
+    def extract(self, path):
+        """Reemplaza cada archivo local por el recibido en el bundle.
+        Devuelve los nombres guardados y los que figuraban en el
+        manifiesto"""
+        received = set()
+        listed = set()
+        try:
+            with open(path, 'rb') as bundle:
+                for name, data, digest in read_bundle(bundle):
+                    listed.add(name)
+                    if name not in self.names or not digest:
+                        logger.error(f"Archivo del bundle descartado: "
+                                     f"{name!r}")
+                        continue
+                    filename = os.path.join(self.directory, name)
+                    fd, part_path = create_temp_beside(filename)
+                    with os.fdopen(fd, "wb") as file:
+                        file.write(data)
+                    os.replace(part_path, filename)
+                    received.add(name)
+        except ValueError as e:
+            logger.error(f"Bundle inválido: {e}")
+            # No se sabe qué omitió el servidor: no se reintenta nada
+            listed = set(self.names)
+        return received, listed
+
+
+def run_transfers(mux, server_address, jobs, concurrency=1,
+                  stop_event=None):
+    """Ejecuta las transferencias, hasta concurrency a la vez, sobre el
+    socket del mux. Este thread atiende el socket y reparte los mensajes a
+    las sesiones; cada transferencia corre en un thread del pool. Si se
+    activa stop_event se detienen las que están en curso y no se inician
+    más. Devuelve cuántas fallaron: las que lanzaron una excepción, las
+    que terminaron con failed y las que se abandonaron porque el servidor
+    dejó de responder"""
+    pending = list(jobs)
+    active = {}
+    failures = 0
+    with ThreadPoolExecutor(max(1, concurrency)) as executor:
+        try:
+            while pending or active:
+                if stop_event and stop_event.is_set():
+                    pending.clear()
+                    for _, job_stop_event in active.values():
+                        job_stop_event.set()
+                while pending and len(active) < max(1, concurrency):
+                    job = pending.pop(0)
+                    job_stop_event = Event()
+                    future = executor.submit(job.run, mux, server_address,
+                                             job_stop_event)
+                    active[future] = (job, job_stop_event)
+
+                mux.poll(POLL_INTERVAL)
+
+                for future, (job, job_stop_event) in list(active.items()):
+                    if future.done():
+                        del active[future]
+                        if future.exception():
+                            logger.error(f"Falló la {job}: "
+                                         f"{future.exception()}")
+                            failures += 1
+                        elif job.failed:
+                            # Las abandonadas terminan también con failed
+                            failures += 1
+                    elif (job.session and not job_stop_event.is_set() and
+                          job.session.idle_time() > IDLE_TIMEOUT):
+                        logger.error(f"No se ha recibido respuesta del "
+                                     f"servidor en la {job}.")
+                        job_stop_event.set()
+        except KeyboardInterrupt:
+            for _, job_stop_event in active.values():
+                job_stop_event.set()
+            raise
+    return failures
@@ -3,8 +3,9 @@ import hashlib
 import os
 
 from message.message import TOTAL_BYTES_LENGTH, Message, MessageType
-from message.utils import send_ack, show_info
+from message.utils import send_ack, show_info, get_message_from_queue
 from utils.protocol_utils import (
+    abort_on_invalid_data,
     send_first_ack_message,
     send_first_download_message,
     init_window,
@@ -13,6 +14,7 @@ from utils.protocol_utils import (
     end_recv_protocol,
     recv_data_message,
 )
+from utils.compression import chunk_codec
 from utils.logger import logger
 
 
@@ -43,13 +45,12 @@ def download_sr_client(initial_message: Message, socket, address,
     received_messages = [False] * package_to_receive_size
     received_data = [''] * package_to_receive_size
     received_packages = 0
+    # Compresión negociada en el UPLOAD o elegida en el ACK_DOWNLOAD
+    codec = chunk_codec(initial_message.get_compression())
     logger.debug(f"Window_base {window_base} and window_top {window_top}")
 
-    if first_message_recv.get_type() == MessageType.DATA:
-        window_base, window_top, received_packages = recv_data_message(
-            first_message_recv, socket, address, received_messages,
-            received_data, package_to_receive_size, window_base, window_top,
-            received_packages, file)
+    # La respuesta al inicio se procesa como los mensajes que siguen
+    pending_message = first_message_recv
 
     next_update = datetime.now() + timedelta(seconds=1)
     while True:
@@ -60,14 +61,25 @@ def download_sr_client(initial_message: Message, socket, address,
             os.unlink(filename)
             return
 
-        message = (message_queue.get(False) if not message_queue.empty()
-                   else None)
+        message = pending_message or get_message_from_queue(message_queue)
+        pending_message = None
         if message:
             if message.get_type() == MessageType.DATA:
-                window_base, window_top, received_packages = recv_data_message(
-                    message, socket, address, received_messages, received_data,
-                    package_to_receive_size, window_base, window_top,
-                    received_packages, file)
+                try:
+                    window_base, window_top, received_packages = \
+                        recv_data_message(
+                            message, socket, address, received_messages,
+                            received_data, package_to_receive_size,
+                            window_base, window_top, received_packages, file,
+                            codec)
+                except ValueError as e:
+                    abort_on_invalid_data(e, socket, address, message_queue,
+                                          stop_event)
+                    os.unlink(filename)
+                    return False
+            elif message.get_type() == MessageType.ACK_DOWNLOAD:
+                # Reenvío del ACK_DOWNLOAD con el bloque 0 en línea
+                send_ack(0, socket, address)
             elif message.get_type() == MessageType.END:
                 md5_digest = message.get_data_as_string()
 
@@ -85,7 +97,7 @@ def download_sr_client(initial_message: Message, socket, address,
 
                 end_recv_protocol(message_queue, message, socket, address,
                                   stop_event)
-                return
+                return final_md5_digest == md5_digest
             elif message.get_type() == MessageType.ERROR:
                 logger.error(f"Error en la descarga -- {message.getErrorCode}")
                 send_ack(message.get_seq_number(), socket, address)
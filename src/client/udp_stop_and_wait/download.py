@@ -4,28 +4,58 @@ from client.udp_stop_and_wait.finalizar_cliente import (
 )
 from message.message import Message, MessageType, ErrorCode
 from datetime import datetime, timedelta
-from message.utils import send_message, get_message_from_queue, show_info
+from message.utils import (
+    send_message, get_message_from_queue, show_info, defer_on_busy
+)
+from utils.compression import chunk_codec
+from utils.flow_control import advertised_window
 from utils.logger import logger
+from utils.protocol_utils import abort_on_invalid_data
 
 
 def inicio_download_client(client_socket, server_address,
-                           first_message: Message, msg_queue, stop_event):
+                           first_message: Message, msg_queue, stop_event,
+                           file):
+    """Envía el DOWNLOAD y espera el ACK_DOWNLOAD. Si la respuesta trae el
+    primer bloque del archivo lo escribe y devuelve cuántos bytes eran,
+    junto con el codec de la compresión que eligió el servidor."""
     err = False
     tamanio_del_archivo = 0
+    datos_en_linea = 0
+    codec = chunk_codec(None)
     recibi_ack_o_error = False
     while not recibi_ack_o_error:
         if stop_event.is_set():
-            return True, tamanio_del_archivo
+            return True, tamanio_del_archivo, datos_en_linea, codec
         if first_message.is_timeout():
             send_message(first_message, client_socket, server_address)
 
         message = get_message_from_queue(msg_queue)
+        if defer_on_busy(message, first_message):
+            continue
         if message and message.get_type() == MessageType.ACK_DOWNLOAD:
             recibi_ack_o_error = True
             tamanio_del_archivo = message.get_file_size()
+            codec = chunk_codec(message.get_compression())
+            datos = message.get_early_data()
+            if datos:
+                logger.debug("El ACK_DOWNLOAD trajo el primer bloque.")
+                try:
+                    datos = codec.decode(datos)
+                except ValueError as e:
+                    abort_on_invalid_data(e, client_socket, server_address,
+                                          msg_queue, stop_event)
+                    return True, tamanio_del_archivo, 0, codec
+                file.write(datos)
+                datos_en_linea = len(datos)
         elif (message and message.get_type() == MessageType.ERROR and
-              message.get_error_code() == ErrorCode.FILE_NOT_FOUND):
-            logger.error('El archivo que solicite no existe en el servidor')
+              message.get_error_code() in [ErrorCode.FILE_NOT_FOUND,
+                                           ErrorCode.INVALID_RANGE]):
+            if message.get_error_code() == ErrorCode.INVALID_RANGE:
+                logger.error('El rango pedido está fuera del archivo')
+            else:
+                logger.error('El archivo que solicite no existe en el '
+                             'servidor')
             recibi_ack_o_error = True
             err = True
             logger.info('Termino el inicio del DOWNLOAD')
@@ -35,22 +65,27 @@ def inicio_download_client(client_socket, server_address,
                               stop_event)
             logger.info('Termino fin del download')
 
-    return err, tamanio_del_archivo
+    return err, tamanio_del_archivo, datos_en_linea, codec
 
 
 def download_saw_client(first_message, client_socket, server_address,
                         msg_queue, file, filename, stop_event):
+    """Descarga un archivo con Stop-and-Wait. Devuelve si llegó completo y
+    verificado"""
     start_time = datetime.now()
-    err, tamanio_del_archivo = inicio_download_client(
-        client_socket, server_address, first_message, msg_queue, stop_event)
+    err, tamanio_del_archivo, datos_en_linea, codec = inicio_download_client(
+        client_socket, server_address, first_message, msg_queue, stop_event,
+        file)
 
     if err:
         return
 
-    datos_recibidos = 0
-    ultimo_paquete_recibido = 0  # Empezamos en 0, esperando el paquete 1
+    datos_recibidos = datos_en_linea
+    # Empezamos en 0, esperando el paquete 1, salvo que haya llegado en línea
+    ultimo_paquete_recibido = 1 if datos_en_linea else 0
     next_update = datetime.now() + timedelta(seconds=1)
-    ack_message = Message.ack(ultimo_paquete_recibido)
+    ack_message = Message.ack(
+        ultimo_paquete_recibido, advertised_window(0, file))
 
     while datos_recibidos < tamanio_del_archivo:
         next_update = show_info(
@@ -72,23 +107,31 @@ def download_saw_client(first_message, client_socket, server_address,
                 message.get_seq_number() < ultimo_paquete_recibido + 1):
             logger.debug(f"Recibi paquete duplicado "
                          f"{message.get_seq_number()}, reenvio ACK")
-            ack_message = Message.ack(message.get_seq_number())
+            ack_message = Message.ack(
+                message.get_seq_number(), advertised_window(0, file))
             send_message(ack_message, client_socket, server_address)
 
         # Caso de recepción del paquete esperado
         elif (message and message.get_type() == MessageType.DATA and
               message.get_seq_number() == ultimo_paquete_recibido + 1):
             logger.debug(f'Recibo el paquete {message.get_seq_number()}')
-            datos = message.get_data()
+            try:
+                datos = codec.decode(message.get_data())
+            except ValueError as e:
+                abort_on_invalid_data(e, client_socket, server_address,
+                                      msg_queue, stop_event)
+                return False
             file.write(datos)
             datos_recibidos = datos_recibidos + len(datos)
             ultimo_paquete_recibido = ultimo_paquete_recibido + 1
-            ack_message = Message.ack(ultimo_paquete_recibido)
+            ack_message = Message.ack(
+                ultimo_paquete_recibido, advertised_window(0, file))
             send_message(ack_message, client_socket, server_address)
 
     # envio el ultimo ack del paquete recibido
     envie_ultimo_ack_del_paquete = False
-    ack_message = Message.ack(ultimo_paquete_recibido)
+    ack_message = Message.ack(
+        ultimo_paquete_recibido, advertised_window(0, file))
 
     while not envie_ultimo_ack_del_paquete:
         if stop_event.is_set():
@@ -110,6 +153,6 @@ def download_saw_client(first_message, client_socket, server_address,
             final_md5_digest = hashlib.md5(file_read_for_digest).hexdigest()
 
             # fin
-            finalizar_cliente_download_saw(
+            return finalizar_cliente_download_saw(
                 client_socket, server_address, msg_queue, stop_event,
                 final_md5_digest, filename)
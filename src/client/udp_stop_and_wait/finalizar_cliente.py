@@ -2,36 +2,54 @@ import os
 from message.message import Message, MessageType
 from message.utils import send_message, send_ack, get_message_from_queue
 from utils.logger import logger
+from utils.rtt import MAX_END_PROBES, RttEstimator, TailLossProbe
 
 
-def finalizar_cliente(sock, server_addr, msg_queue, stop_event):
+def finalizar_cliente(sock, server_addr, msg_queue, stop_event, rtt=None):
     """
     Finaliza la conexión con el servidor enviando un mensaje de fin y esperando
-    un ACK.
+    un ACK. Devuelve si el servidor confirmó haber recibido el archivo
+    íntegro.
     """
     end_msg = Message.end()
+    tlp = TailLossProbe(rtt or RttEstimator(), MAX_END_PROBES)
     while not stop_event.is_set():
         if end_msg.is_timeout():
-            send_message(end_msg, sock, server_addr)
+            if tlp.exhausted():
+                logger.warning("No se ha recibido la confirmacion del fin de "
+                               "conexion.")
+                break
+            if end_msg.transmissions:
+                tlp.probe_sent()
+            send_message(end_msg, sock, server_addr, tlp.timeout())
         response = get_message_from_queue(msg_queue)
         if response and response.get_type() == MessageType.ACK:
             if (response.get_seq_number() == 1):
                 logger.error("El archivo no se ha subido integramente. Por "
                              "favor intente nuevamente")
             send_ack(response.get_seq_number(), sock, server_addr)
-            break
+            return response.get_seq_number() != 1
+    return False
 
 
 def finalizar_cliente_download_saw(sock, server_addr, msg_queue, stop_event,
-                                   final_md5_digest, filename):
+                                   final_md5_digest, filename, rtt=None):
     """
     Finaliza la conexión con el servidor enviando un mensaje de fin y esperando
-    un ACK.
+    un ACK. Devuelve si el archivo recibido coincide con el digest del
+    servidor.
     """
     end_msg = Message.end()
+    tlp = TailLossProbe(rtt or RttEstimator(), MAX_END_PROBES)
     while not stop_event.is_set():
         if end_msg.is_timeout():
-            send_message(end_msg, sock, server_addr)
+            if tlp.exhausted():
+                logger.warning("No se ha recibido la confirmacion del fin de "
+                               "conexion.")
+                break
+            if end_msg.transmissions:
+                tlp.probe_sent()
+            send_message(end_msg, sock, server_addr, tlp.timeout())
         response = get_message_from_queue(msg_queue)
         if response and response.get_type() == MessageType.ACK:
             md5_digest = response.get_data_as_string()
@@ -40,4 +58,5 @@ def finalizar_cliente_download_saw(sock, server_addr, msg_queue, stop_event,
                              "descarguelo nuevamente.")
                 os.unlink(filename)
             send_ack(response.get_seq_number(), sock, server_addr)
-            break
+            return final_md5_digest == md5_digest
+    return False
@@ -3,25 +3,31 @@ from client.udp_stop_and_wait.finalizar_cliente import finalizar_cliente
 from message.message import DATA_MAX_SIZE, Message, MessageType, ErrorCode
 from datetime import datetime, timedelta
 from message.utils import (
-    send_message, send_ack, get_message_from_queue, show_info
+    send_message, send_ack, get_message_from_queue, show_info, defer_on_busy
 )
+from utils.compression import chunk_codec
+from utils.flow_control import PeerWindow
 from utils.logger import logger
+from utils.rtt import RttEstimator
 
 
 def inicio_upload_client(client_socket, server_address,
                          mensaje_inicial: Message, msg_queue, stop_event):
     """Inicia el protocolo de subida enviando el mensaje inicial y
-    manejando errores."""
+    manejando errores. Devuelve si hubo error y la cantidad de bytes del
+    archivo que viajaron adjuntos al UPLOAD y el servidor aceptó (0-RTT)."""
     ack_o_error_recibido = False
 
     while not ack_o_error_recibido:
         if stop_event.is_set():
-            return True
+            return True, 0
         if mensaje_inicial.is_timeout():
             logger.debug("Reenviando mensaje de inicio de upload.")
             send_message(mensaje_inicial, client_socket, server_address)
 
         respuesta = get_message_from_queue(msg_queue)
+        if defer_on_busy(respuesta, mensaje_inicial):
+            continue
         if respuesta:
             # Manejo de errores
             if respuesta.get_type() == MessageType.ERROR:
@@ -36,7 +42,20 @@ def inicio_upload_client(client_socket, server_address,
                             "error.")
                 finalizar_cliente(client_socket, server_address, msg_queue,
                                   stop_event)
-                return True
+                return True, 0
+
+            # Caso de archivo que el servidor ya tenía: no se envían datos
+            if respuesta.is_upload_complete():
+                logger.info("El servidor ya tiene el archivo, no se envían "
+                            "datos.")
+                return False, mensaje_inicial.get_file_size()
+
+            # Caso de bloque adjunto aceptado: el primer DATA hace de ACK
+            if (respuesta.get_type() == MessageType.ACK_UPLOAD and
+                    respuesta.get_seq_number() == 1):
+                logger.debug("El servidor aceptó el primer bloque adjunto.")
+                return False, min(DATA_MAX_SIZE,
+                                  mensaje_inicial.get_file_size())
 
             # Caso de ACK recibido
             if (respuesta.get_type() == MessageType.ACK and
@@ -45,22 +64,31 @@ def inicio_upload_client(client_socket, server_address,
                          server_address)
                 ack_o_error_recibido = True
 
-    return False
+    return False, 0
 
 
 def upload_saw_client(mensaje_inicial: Message, client_socket, server_address,
                       msg_queue, archivo, stop_event):
-    """Implementa el protocolo Stop-and-Wait para la subida de archivos."""
+    """Implementa el protocolo Stop-and-Wait para la subida de archivos.
+    Devuelve si el servidor confirmó haber recibido el archivo íntegro."""
     inicio = datetime.now()
-    error_detectado = inicio_upload_client(
+    error_detectado, bytes_adelantados = inicio_upload_client(
         client_socket, server_address, mensaje_inicial, msg_queue, stop_event)
 
     if error_detectado:
         return
 
     siguiente_actualizacion = inicio + timedelta(seconds=1)
+    rtt = RttEstimator()
+    peer_window = PeerWindow(rtt)
+    codec = chunk_codec(mensaje_inicial.get_compression())
     secuencia = 1
     bytes_enviados = 0
+    if bytes_adelantados:
+        # El primer bloque ya fue confirmado junto con el UPLOAD
+        archivo.seek(bytes_adelantados)
+        secuencia = 2
+        bytes_enviados = bytes_adelantados
 
     while datos := archivo.read(DATA_MAX_SIZE):
         siguiente_actualizacion = show_info(
@@ -71,7 +99,13 @@ def upload_saw_client(mensaje_inicial: Message, client_socket, server_address,
         if stop_event.is_set():
             return
 
-        paquete = Message.data(secuencia, datos)
+        # Esperar a que el servidor tenga lugar para el paquete
+        while not peer_window.can_send():
+            if stop_event.is_set():
+                return
+            time.sleep(0.001)
+
+        paquete = Message.data(secuencia, codec.encode(datos))
         logger.debug(f"Enviando paquete {secuencia}.")
         send_message(paquete, client_socket, server_address)
         while not ack_recibido:
@@ -85,10 +119,16 @@ def upload_saw_client(mensaje_inicial: Message, client_socket, server_address,
             if (respuesta and respuesta.get_type() == MessageType.ACK and
                     respuesta.get_seq_number() == secuencia):
                 logger.debug(f"ACK recibido para el paquete {secuencia}.")
+                rtt.on_ack(paquete)
+                peer_window.update(respuesta)
                 bytes_enviados += len(datos)
                 secuencia += 1
                 ack_recibido = True
+            elif respuesta and respuesta.get_type() == MessageType.ERROR:
+                logger.error("El servidor cortó la subida.")
+                return False
             elif not respuesta:
                 time.sleep(0.001)
 
-    finalizar_cliente(client_socket, server_address, msg_queue, stop_event)
+    return finalizar_cliente(client_socket, server_address, msg_queue,
+                             stop_event, rtt)
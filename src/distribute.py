@@ -0,0 +1,109 @@
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime
+from server.multicast import (
+    DEFAULT_LINGER, DEFAULT_MULTICAST_RATE, DEFAULT_MULTICAST_TTL,
+    DEFAULT_REPAIR_MODE, REPAIR_MODES, MulticastSender
+)
+from server.storage import Storage
+from utils.misc import CustomHelpFormatter
+from utils.logger import logger
+from utils.rate_limit import parse_rate
+
+# Enable console colors on Windows
+if os.name == 'nt':
+    os.system('color')
+
+
+def parse_arguments():
+    """Parsea los argumentos de línea de comandos"""
+    parser = argparse.ArgumentParser(description="Multicast distribution",
+                                     formatter_class=CustomHelpFormatter)
+
+    # Verbosity options
+    verbosity_group = parser.add_mutually_exclusive_group()
+    verbosity_group.add_argument("-v", "--verbose", action="store_true",
+                                 help="increase output verbosity")
+    verbosity_group.add_argument("-q", "--quiet", action="store_true",
+                                 help="decrease output verbosity")
+
+    # Required parameters
+    parser.add_argument("-H", "--host", metavar="ADDR", type=str,
+                        required=True, help="multicast group address")
+    parser.add_argument("-p", "--port", metavar="PORT", type=int,
+                        required=True, help="multicast group port")
+    parser.add_argument("-s", "--storage", metavar="DIRPATH", type=str,
+                        required=True, help="server storage dir path")
+    parser.add_argument("-n", "--name", metavar="FILENAME", type=str,
+                        required=True, help="file to distribute")
+
+    parser.add_argument("--shard-depth", metavar="N", type=int,
+                        help="levels of hashed subdirectories of the "
+                             "storage (as given to the server)", default=0)
+    parser.add_argument("--rate", metavar="RATE", type=parse_rate,
+                        help="send rate in bytes/s, data and repairs "
+                             "(e.g. 512K, 10M)",
+                        default=DEFAULT_MULTICAST_RATE)
+    parser.add_argument("--repair", metavar="MODE", type=str,
+                        help="how missing chunks are resent: multicast, "
+                             "unicast, or auto (multicast when several "
+                             "receivers miss them)",
+                        default=DEFAULT_REPAIR_MODE, choices=REPAIR_MODES)
+    parser.add_argument("--receivers", metavar="N", type=int, default=0,
+                        help="stop once N receivers have the file (0 = stop "
+                             "when NAKs cease)")
+    parser.add_argument("--linger", metavar="SECONDS", type=float,
+                        help="stop after this long without NAKs once "
+                             "everything was sent", default=DEFAULT_LINGER)
+    parser.add_argument("--interface", metavar="ADDR", type=str,
+                        help="local address of the interface to send on")
+    parser.add_argument("--ttl", metavar="N", type=int,
+                        help="multicast TTL", default=DEFAULT_MULTICAST_TTL)
+
+    parser.usage = parser.format_usage()
+    for a in parser._actions:
+        a.metavar = '\b'
+
+    return parser.parse_args()
+
+
+def start():
+    """Distribuye un archivo del servidor a un grupo multicast"""
+    args = parse_arguments()
+
+    # Configuración del nivel de logging
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+    elif args.quiet:
+        logger.setLevel(logging.ERROR)
+    else:
+        logger.setLevel(logging.INFO)
+
+    storage = Storage(args.storage, max(0, args.shard_depth))
+    if not storage.exists(args.name):
+        logger.error(f"El archivo {args.name} no existe.")
+        return -1
+    storage.start()
+    sender = MulticastSender(storage, args.name, (args.host, args.port),
+                             args.rate, args.repair, max(0, args.receivers),
+                             args.linger, args.interface, args.ttl)
+    start_time = datetime.now()
+    try:
+        completed = sender.run()
+    except KeyboardInterrupt:
+        logger.info("Se ha interrumpido la distribución.")
+        return -1
+    finally:
+        storage.stop()
+
+    logger.info(f"\033[34mTiempo de distribución: "
+                f"{datetime.now() - start_time}\033[0m")
+    if args.receivers and completed < args.receivers:
+        return -1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(start())
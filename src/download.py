@@ -1,19 +1,21 @@
 import argparse
-from datetime import datetime, timedelta
+from datetime import datetime
 import logging
-import queue
 import socket
 import sys
-from threading import Event, Thread
-from client.udp_stop_and_wait.download import download_saw_client
-from client.udp_selective_repeat.download import download_sr_client
-from message.message import Message, MessageType
-from message.utils import recv_message
-from utils.misc import CustomHelpFormatter
+from client.session_mux import SessionMux
+from client.multicast import MulticastReceiver
+from client.striped import plan_striped_download
+from client.sync import plan_download_sync
+from client.transfers import DownloadJob, run_transfers
+from utils.compression import COMPRESSION_CHOICES, NO_COMPRESSION
+from utils.misc import CustomHelpFormatter, parse_address
 from utils.logger import logger
+from utils.rate_limit import RateLimitedSocket, parse_rate
 import os
 
 DEFAULT_PROTOCOL = 'udp_saw'
+DEFAULT_JOBS = 4
 
 # Enable console colors on Windows
 if os.name == 'nt':
@@ -40,12 +42,44 @@ def parse_arguments():
     parser.add_argument("-d", "--dst", metavar="FILEPATH", type=str,
                         required=True, help="destination file path")
     parser.add_argument("-n", "--name", metavar="FILENAME", type=str,
-                        required=True, help="file name")
+                        help="file name (required unless --sync)")
 
     parser.add_argument("-r", "--protocol", metavar="protocol", type=str,
                         help="error recovery protocol",
                         default=DEFAULT_PROTOCOL,
                         choices=["udp_saw", "udp_sr"])
+    parser.add_argument("-c", "--compression", metavar="compression",
+                        type=str, help="payload compression",
+                        default=NO_COMPRESSION, choices=COMPRESSION_CHOICES)
+    parser.add_argument("-S", "--sync", action="store_true",
+                        help="download every new or changed server file "
+                             "into FILEPATH")
+    parser.add_argument("-j", "--jobs", metavar="JOBS", type=int,
+                        default=DEFAULT_JOBS,
+                        help="concurrent transfers in sync mode")
+    parser.add_argument("--no-bundle", action="store_true",
+                        help="in sync mode, transfer small files one by one "
+                             "instead of grouped in bundles")
+    parser.add_argument("--rate", metavar="RATE", type=parse_rate,
+                        help="rate cap in bytes/s for the whole client "
+                             "(e.g. 512K, 10M)")
+    parser.add_argument("--offset", metavar="BYTES", type=int,
+                        help="download only from this offset (negative: "
+                             "from the end of the file)")
+    parser.add_argument("--length", metavar="BYTES", type=int,
+                        help="download at most this many bytes")
+    parser.add_argument("--source", metavar="HOST:PORT", action="append",
+                        type=parse_address, default=[],
+                        help="another server with a replica of the file; "
+                             "the download is striped across every server "
+                             "(repeatable)")
+    parser.add_argument("-M", "--multicast", action="store_true",
+                        help="receive the file from a multicast "
+                             "distribution; -H and -p are the group address "
+                             "and port")
+    parser.add_argument("--interface", metavar="ADDR", type=str,
+                        help="with --multicast, local address of the "
+                             "interface to join the group on")
 
     parser.usage = parser.format_usage()
     for a in parser._actions:
@@ -54,8 +88,28 @@ def parse_arguments():
     return parser, parser.parse_args()
 
 
+def receive_multicast(args, group, path):
+    """Recibe el archivo de una distribución multicast"""
+    filename = os.path.join(path, args.name)
+    logger.info(f"Esperando la distribución de {args.name} en "
+                f"{group[0]}:{group[1]}")
+    start_time = datetime.now()
+    try:
+        received = MulticastReceiver(filename, args.name, group,
+                                     args.interface).run()
+    except KeyboardInterrupt:
+        logger.info("Se ha interrumpido la transferencia.")
+        return -1
+    if not received:
+        return -1
+    logger.info(f"\033[34mTiempo de transferencia: "
+                f"{datetime.now() - start_time}\033[0m")
+    return 0
+
+
 def start():
-    """Inicia el cliente para descargar un archivo"""
+    """Inicia el cliente para descargar un archivo, o todos los archivos
+    nuevos o modificados del servidor con --sync"""
     parser, args = parse_arguments()
 
     # Configuración del nivel de logging
@@ -66,7 +120,20 @@ def start():
     else:
         logger.setLevel(logging.INFO)
 
-    if not args.host or not args.port or not args.dst or not args.name:
+    if (not args.host or not args.port or not args.dst or
+            not (args.name or args.sync)):
+        parser.print_help(sys.stderr)
+        return -1
+    byte_range = None
+    if args.offset is not None or args.length is not None:
+        if args.sync or (args.length is not None and args.length < 0):
+            parser.print_help(sys.stderr)
+            return -1
+        byte_range = (args.offset or 0, args.length)
+    if args.source and (args.sync or byte_range):
+        parser.print_help(sys.stderr)
+        return -1
+    if args.multicast and (args.sync or byte_range or args.source):
         parser.print_help(sys.stderr)
         return -1
 
@@ -74,7 +141,6 @@ def start():
     host = args.host
     port = args.port
     path = args.dst
-    download_file_name = args.name
     protocol = args.protocol
 
     # Validar y preparar el directorio de destino
@@ -82,74 +148,59 @@ def start():
         os.makedirs(path)
         logger.info(f"Directorio de destino creado: {path}")
 
-    filename = os.path.join(path, download_file_name)
-    file = open(filename, "wb")
+    if args.multicast:
+        return receive_multicast(args, (host, port), path)
 
     logger.info("\033[32m+---------------------------------------+")
     logger.info(f"\033[32m| Conectando al servidor {host}:{port} |")
     logger.info("\033[32m+---------------------------------------+")
     logger.info(f"Protocolo seleccionado: {protocol}")
-    logger.info(f"Archivo de destino: {filename}")
 
-    # Crear socket UDP
+    # Crear socket UDP; cada transferencia usa su propia sesión
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if args.rate:
+        sock = RateLimitedSocket(sock, args.rate)
     server_address = (host, port)
-
-    # Crear cola de mensajes
-    message_queue = queue.Queue()
-
-    # Enviar mensaje de descarga
-    download_message = Message.download(args.name)
+    mux = SessionMux(sock)
     start_time = datetime.now()
-    logger.info(f"Empiezo proceso de descarga para el archivo: {filename}")
-    stop_event = Event()
-
-    # Seleccionar protocolo de recepción
-    recv_protocol = (download_sr_client if protocol == "udp_sr"
-                     else download_saw_client)
-
-    recv_worker = Thread(target=recv_protocol,
-                         args=(download_message, sock, server_address,
-                               message_queue, file, filename, stop_event))
-    recv_worker.start()
-
-    # Manejo de timeout
-    timeout = datetime.now() + timedelta(seconds=15)
-    timeout_exit = True
-    while datetime.now() < timeout:
-        try:
-            message, _ = recv_message(sock)
-            if not recv_worker.is_alive():
-                timeout_exit = False
-                break
-            if message:
-                if message.get_type() in [MessageType.DATA, MessageType.ACK,
-                                          MessageType.ACK_DOWNLOAD,
-                                          MessageType.ERROR, MessageType.END]:
-                    message_queue.put(message)
-                    timeout = datetime.now() + timedelta(seconds=15)
-                else:
-                    logger.error("Mensaje no reconocido.")
-                    return -1
-        except KeyboardInterrupt:
-            stop_event.set()
-            logger.info("Se ha interrumpido la transferencia.")
-            if file:
-                file.close()
-            sock.close()
-            return -1
 
-    if timeout_exit:
-        stop_event.set()
-        logger.error("No se ha recibido respuesta del servidor.")
-    else:
-        logger.info(f"\033[34mTiempo de transferencia: "
-                    f"{datetime.now() - start_time}\033[0m")
-    if file:
-        file.close()
-    sock.close()
+    try:
+        if args.sync:
+            jobs = plan_download_sync(mux, server_address, path, protocol,
+                                      args.compression, not args.no_bundle)
+            if jobs is None:
+                logger.error("No se ha recibido respuesta del servidor.")
+                return -1
+        elif args.source:
+            filename = os.path.join(path, args.name)
+            sources = [server_address] + [
+                address for address in args.source
+                if address != server_address]
+            job = plan_striped_download(mux, sources, filename, args.name,
+                                        protocol, args.compression)
+            if not job:
+                logger.error("Ningún servidor tiene el archivo.")
+                return -1
+            jobs = [job]
+        else:
+            filename = os.path.join(path, args.name)
+            logger.info(f"Empiezo proceso de descarga para el archivo: "
+                        f"{filename}")
+            jobs = [DownloadJob(filename, args.name, protocol,
+                                args.compression, byte_range=byte_range)]
+        failures = run_transfers(mux, server_address, jobs, args.jobs)
+    except KeyboardInterrupt:
+        logger.info("Se ha interrumpido la transferencia.")
+        return -1
+    finally:
+        sock.close()
+
+    if failures:
+        return -1
+    logger.info(f"\033[34mTiempo de transferencia: "
+                f"{datetime.now() - start_time}\033[0m")
     return 0
 
 
 if __name__ == "__main__":
-    start()
+    sys.exit(start())
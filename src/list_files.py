@@ -0,0 +1,97 @@
+import argparse
+import logging
+import os
+import socket
+import sys
+from datetime import datetime
+from client.catalog_client import list_catalog, stat_file
+from client.session_mux import SessionMux
+from message.message import ErrorCode, MessageType
+from utils.misc import CustomHelpFormatter
+from utils.logger import logger
+
+# Enable console colors on Windows
+if os.name == 'nt':
+    os.system('color')
+
+
+def parse_arguments():
+    """Parsea los argumentos de línea de comandos"""
+    parser = argparse.ArgumentParser(description="List Client",
+                                     formatter_class=CustomHelpFormatter)
+
+    # Verbosity options
+    verbosity_group = parser.add_mutually_exclusive_group()
+    verbosity_group.add_argument("-v", "--verbose", action="store_true",
+                                 help="increase output verbosity")
+    verbosity_group.add_argument("-q", "--quiet", action="store_true",
+                                 help="decrease output verbosity")
+
+    # Required parameters
+    parser.add_argument("-H", "--host", metavar="ADDR", type=str,
+                        required=True, help="server IP address")
+    parser.add_argument("-p", "--port", metavar="PORT", type=int,
+                        required=True, help="server port")
+
+    parser.add_argument("-n", "--name", metavar="FILENAME", type=str,
+                        help="show only this file, with its digest")
+
+    parser.usage = parser.format_usage()
+    for a in parser._actions:
+        a.metavar = '\b'
+
+    return parser.parse_args()
+
+
+def print_entries(entries):
+    """Muestra las entradas del catálogo"""
+    for name, size, mtime, digest in entries:
+        modified = datetime.fromtimestamp(mtime).isoformat(' ')
+        print(f"{size:>12}  {modified}  {digest or '-':<32}  {name}")
+
+
+def start():
+    """Inicia el cliente para listar los archivos del servidor"""
+    args = parse_arguments()
+
+    # Configuración del nivel de logging
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+    elif args.quiet:
+        logger.setLevel(logging.ERROR)
+    else:
+        logger.setLevel(logging.INFO)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server_address = (args.host, args.port)
+    mux = SessionMux(sock)
+
+    try:
+        if args.name:
+            response = stat_file(mux, server_address, args.name)
+            if not response:
+                logger.error("No se ha recibido respuesta del servidor.")
+                return -1
+            if response.get_type() == MessageType.ERROR:
+                if response.get_error_code() == ErrorCode.FILE_NOT_FOUND:
+                    logger.error(f"El archivo {args.name} no existe en el "
+                                 f"servidor.")
+                return -1
+            print_entries(response.get_catalog_entries())
+            return 0
+
+        entries = list_catalog(mux, server_address)
+        if entries is None:
+            logger.error("No se ha recibido respuesta del servidor.")
+            return -1
+        print_entries(entries)
+        logger.info(f"{len(entries)} archivos")
+        return 0
+    except KeyboardInterrupt:
+        return -1
+    finally:
+        sock.close()
+
+
+if __name__ == "__main__":
+    sys.exit(start())
@@ -2,10 +2,41 @@ from enum import Enum
 from datetime import datetime, timedelta
 from utils.logger import logger
 
+SESSION_ID_BYTES = 4
 SEQUENCE_NUMBER_BYTES = 4
+WINDOW_BYTES = 2
+HEADER_LENGTH = 1 + SESSION_ID_BYTES + SEQUENCE_NUMBER_BYTES + WINDOW_BYTES
+# Ventana de recepción no anunciada (el receptor no impone límite)
+NO_WINDOW = 2 ** (WINDOW_BYTES * 8) - 1
 DATA_MAX_SIZE = 2947
-
-TOTAL_BYTES_LENGTH = 1 + SEQUENCE_NUMBER_BYTES + DATA_MAX_SIZE
+# Byte de codificación que precede al bloque cuando la transferencia
+# negoció compresión
+DATA_ENCODING_BYTES = 1
+# Marca de un DOWNLOAD que pide la firma del archivo
+SIGNATURE_REQUEST = 'signature'
+# Marca de un UPLOAD/DOWNLOAD que transfiere varios archivos agrupados en un
+# bundle. El DOWNLOAD lleva los nombres pedidos después de la cabecera
+BUNDLE_REQUEST = 'bundle'
+BUNDLE_NAMES_SEPARATOR = "\n"
+# Marca de un DOWNLOAD que pide solo un rango del archivo: le siguen el
+# offset (negativo: desde el final) y la longitud (vacía: hasta el final)
+RANGE_REQUEST = 'range'
+# Separador de las entradas de un CATALOG; la primera línea es el cursor de
+# la página siguiente
+CATALOG_SEPARATOR = "\n"
+# Separadores de los rangos de bloques (primero-último) que pide un NAK
+NAK_RANGE_SEPARATOR = ","
+NAK_RANGE_BOUNDS_SEPARATOR = "-"
+# Marca de un ACK_UPLOAD cuyo contenido el servidor ya tenía almacenado
+UPLOAD_COMPLETE = 'complete'
+# Espacio extra para la cabecera textual de UPLOAD/ACK_DOWNLOAD cuando
+# viajan junto a un bloque de datos (0-RTT)
+CONTROL_HEADER_MAX_SIZE = 512
+MAX_PAYLOAD_SIZE = DATA_MAX_SIZE + CONTROL_HEADER_MAX_SIZE
+# Separa la cabecera textual de los datos adjuntos al mensaje de control
+EARLY_DATA_SEPARATOR = b'\0'
+
+TOTAL_BYTES_LENGTH = HEADER_LENGTH + MAX_PAYLOAD_SIZE
 
 
 class MessageType(Enum):
@@ -17,6 +48,13 @@ class MessageType(Enum):
     ACK_END = 5
     ERROR = 6
     END = 7
+    ACK_UPLOAD = 8
+    BUSY = 9
+    LIST = 10
+    STAT = 11
+    CATALOG = 12
+    ANNOUNCE = 13
+    NAK = 14
 
 
 class ErrorCode(Enum):
@@ -24,10 +62,26 @@ class ErrorCode(Enum):
     FILE_TOO_BIG = 1
     FILE_ALREADY_EXISTS = 2
     FILE_WRITE_ERROR = 3
+    INVALID_RANGE = 4
+    INVALID_REQUEST = 5
+
+
+def catalog_entry_line(entry):
+    """Serializa una entrada del catálogo"""
+    name, size, mtime, digest = entry
+    return f"{name}|{size}|{int(mtime)}|{digest or ''}"
+
+
+def set_session_id(raw_message, session_id):
+    """Reemplaza el id de sesión en un mensaje ya serializado"""
+    return (raw_message[:1] +
+            session_id.to_bytes(SESSION_ID_BYTES, 'big') +
+            raw_message[1 + SESSION_ID_BYTES:])
 
 
 class Message:
-    def __init__(self, msg_type, seq_number=0, data=None, timeout=0):
+    def __init__(self, msg_type, seq_number=0, data=None, timeout=0,
+                 session_id=0, window=NO_WINDOW):
         """
         Inicializa un mensaje
 
@@ -36,37 +90,72 @@ class Message:
             seq_number: Número de secuencia (para DATA/ACK)
             data: Datos del mensaje
             timeout: Tiempo en segundos hasta que el mensaje expira
+            session_id: Id de la sesión (transferencia) a la que pertenece
+            window: Paquetes que el emisor del mensaje puede recibir todavía
+                (control de flujo, se anuncia en los ACK)
         """
         self.type = msg_type
         self.seq_number = seq_number
+        self.session_id = session_id
+        self.window = min(max(window, 0), NO_WINDOW)
         self.data = data if data is not None else b''
 
         # Verificar tamaño máximo de datos
-        if self.data and len(self.data) > DATA_MAX_SIZE:
+        max_size = (DATA_MAX_SIZE + DATA_ENCODING_BYTES
+                    if msg_type == MessageType.DATA else MAX_PAYLOAD_SIZE)
+        if self.data and len(self.data) > max_size:
             logger.error(
-                f"Tamaño máximo de datos es {DATA_MAX_SIZE} bytes, "
+                f"Tamaño máximo de datos es {max_size} bytes, "
                 f"recibido: {len(self.data)}"
             )
             raise ValueError(
-                f"Tamaño máximo de datos es {DATA_MAX_SIZE} bytes"
+                f"Tamaño máximo de datos es {max_size} bytes"
             )
 
         # Tiempo de expiración para el mensaje
         self.timeout_time = datetime.now() + timedelta(seconds=timeout)
 
+        # Momento del último envío y cantidad de envíos (para medir el RTT)
+        self.sent_time = None
+        self.transmissions = 0
+
     def __repr__(self):
         """Representación textual del mensaje"""
         basic = f"Message(type={self.type.name}, seq_number={self.seq_number}"
+        if self.session_id:
+            basic += f", session_id={self.session_id:08x}"
+        if self.window != NO_WINDOW:
+            basic += f", window={self.window}"
 
         if self.type == MessageType.ERROR:
             basic += f", error_code={self.get_error_code().name}"
         elif self.type == MessageType.UPLOAD:
-            file_size, file_name, hash = self.get_data_as_string().split("|")
-            basic += f", file_size={file_size}, file_name={file_name}, "
-            basic += f"file_hash={hash}"
-            logger.debug(f"hash del archivo: {hash}.")
+            basic += f", file_size={self.get_file_size()}, "
+            basic += f"file_name={self.get_file_name()}, "
+            basic += f"file_hash={self.get_file_digest()}"
+            basic += f", early_data={len(self.get_early_data())}"
+            basic += f", compression={self.get_compression()}"
+            basic += f", delta={self.get_delta_digest()}"
+            basic += f", bundle={self.is_bundle()}"
         elif self.type == MessageType.DOWNLOAD:
             basic += f", file_name={self.get_file_name()}"
+            basic += f", compression={self.get_compression()}"
+            basic += f", signature={self.is_signature_request()}"
+            basic += f", bundle={len(self.get_bundle_names())}"
+        elif self.type == MessageType.ACK_DOWNLOAD:
+            basic += f", file_size={self.get_file_size()}"
+            basic += f", inline_data={len(self.get_early_data())}"
+            basic += f", compression={self.get_compression()}"
+        elif self.type == MessageType.BUSY:
+            basic += f", retry_after={self.get_retry_after()}"
+            basic += f", queue_position={self.get_queue_position()}"
+        elif self.type in [MessageType.LIST, MessageType.STAT]:
+            basic += f", name={self.get_data_as_string()!r}"
+        elif self.type == MessageType.CATALOG:
+            basic += f", entries={len(self.get_catalog_entries())}"
+            basic += f", next={self.get_next_cursor()!r}"
+        elif self.type == MessageType.ANNOUNCE:
+            basic += f", announce={self.get_announce()}"
         elif self.data:
             if len(self.data) > 20:
                 data_preview = self.data[:20]
@@ -81,9 +170,15 @@ class Message:
         # Crear un bytearray con el tipo de mensaje (1 byte)
         result = bytearray(self.type.value.to_bytes(1, 'big'))
 
+        # Añadir el id de sesión (4 bytes)
+        result.extend(self.session_id.to_bytes(SESSION_ID_BYTES, 'big'))
+
         # Añadir el número de secuencia (4 bytes)
         result.extend(self.seq_number.to_bytes(SEQUENCE_NUMBER_BYTES, 'big'))
 
+        # Añadir la ventana de recepción anunciada (2 bytes)
+        result.extend(self.window.to_bytes(WINDOW_BYTES, 'big'))
+
         # Añadir los datos
         if self.data:
             result.extend(self.data)
@@ -96,16 +191,26 @@ class Message:
         # El primer byte es el tipo de mensaje
         msg_type = MessageType(data[0])
 
+        # Los siguientes 4 bytes son el id de sesión
+        session_id = int.from_bytes(data[1:SESSION_ID_BYTES + 1], 'big')
+
         # Los siguientes 4 bytes son el número de secuencia
-        seq_number = int.from_bytes(data[1:SEQUENCE_NUMBER_BYTES + 1], 'big')
+        seq_start = SESSION_ID_BYTES + 1
+        seq_number = int.from_bytes(
+            data[seq_start:seq_start + SEQUENCE_NUMBER_BYTES], 'big')
+
+        # Los siguientes 2 bytes son la ventana de recepción anunciada
+        window = int.from_bytes(
+            data[seq_start + SEQUENCE_NUMBER_BYTES:HEADER_LENGTH], 'big')
 
         # El resto son los datos
-        if len(data) > SEQUENCE_NUMBER_BYTES + 1:
-            msg_data = data[SEQUENCE_NUMBER_BYTES + 1:]
+        if len(data) > HEADER_LENGTH:
+            msg_data = data[HEADER_LENGTH:]
         else:
             msg_data = b''
 
-        return cls(msg_type, seq_number, msg_data)
+        return cls(msg_type, seq_number, msg_data, session_id=session_id,
+                   window=window)
 
     # Métodos de acceso simplificados
 
@@ -117,6 +222,14 @@ class Message:
         """Devuelve el número de secuencia"""
         return self.seq_number
 
+    def get_session_id(self):
+        """Devuelve el id de sesión"""
+        return self.session_id
+
+    def get_window(self):
+        """Devuelve la ventana de recepción anunciada"""
+        return self.window
+
     def get_data(self):
         """Devuelve los datos del mensaje"""
         return self.data
@@ -127,12 +240,29 @@ class Message:
             return ""
         return self.data.decode('utf-8')
 
+    def get_header_fields(self):
+        """Devuelve los campos de la cabecera textual, sin los datos
+        adjuntos"""
+        header = self.data.split(EARLY_DATA_SEPARATOR, 1)[0]
+        if not header:
+            return []
+        return header.decode('utf-8').split("|")
+
+    def get_early_data(self):
+        """Devuelve el bloque de datos adjunto a un UPLOAD o ACK_DOWNLOAD"""
+        if self.type not in [MessageType.UPLOAD, MessageType.ACK_DOWNLOAD]:
+            return b''
+        parts = self.data.split(EARLY_DATA_SEPARATOR, 1)
+        return parts[1] if len(parts) > 1 else b''
+
     def get_file_name(self):
         """Extrae el nombre del archivo del mensaje"""
         if self.type == MessageType.DOWNLOAD:
-            return self.get_data_as_string()
+            parts = self.get_header_fields()
+            if parts:
+                return parts[0]
         elif self.type == MessageType.UPLOAD:
-            parts = self.get_data_as_string().split("|")
+            parts = self.get_header_fields()
             if len(parts) >= 2:
                 return parts[1]
         return None
@@ -140,19 +270,87 @@ class Message:
     def get_file_digest(self):
         """Extrae el digest del archivo del mensaje"""
         if self.type == MessageType.UPLOAD:
-            parts = self.get_data_as_string().split("|")
-            if len(parts) >= 2:
+            parts = self.get_header_fields()
+            if len(parts) >= 3:
                 return parts[2]
         return None
 
     def get_file_size(self):
         """Extrae el tamaño del archivo del mensaje"""
         if self.type in [MessageType.UPLOAD, MessageType.ACK_DOWNLOAD]:
-            parts = self.get_data_as_string().split("|")
+            parts = self.get_header_fields()
             if parts and parts[0].isdigit():
                 return int(parts[0])
         return None
 
+    def get_compression(self):
+        """Extrae la compresión de la transferencia: la que ofrece el
+        cliente en UPLOAD/DOWNLOAD o la elegida por el servidor en el
+        ACK_DOWNLOAD. None si no se negoció"""
+        position = {MessageType.UPLOAD: 3, MessageType.DOWNLOAD: 1,
+                    MessageType.ACK_DOWNLOAD: 1}.get(self.type)
+        if position is None:
+            return None
+        parts = self.get_header_fields()
+        if len(parts) > position and parts[position]:
+            return parts[position]
+        return None
+
+    def get_delta_digest(self):
+        """Extrae el MD5 del archivo que debe quedar tras aplicar el delta
+        de un UPLOAD en modo delta. None si la subida es completa"""
+        if self.type == MessageType.UPLOAD:
+            parts = self.get_header_fields()
+            if len(parts) > 4 and parts[4]:
+                return parts[4]
+        return None
+
+    def is_upload_complete(self):
+        """Indica si un ACK_UPLOAD avisa que el servidor ya tiene el
+        archivo entero"""
+        return (self.type == MessageType.ACK_UPLOAD and
+                self.get_data_as_string() == UPLOAD_COMPLETE)
+
+    def is_signature_request(self):
+        """Indica si un DOWNLOAD pide la firma del archivo en lugar de su
+        contenido"""
+        if self.type == MessageType.DOWNLOAD:
+            parts = self.get_header_fields()
+            return len(parts) > 2 and parts[2] == SIGNATURE_REQUEST
+        return False
+
+    def is_bundle(self):
+        """Indica si un UPLOAD o DOWNLOAD transfiere un bundle de archivos"""
+        position = {MessageType.UPLOAD: 5,
+                    MessageType.DOWNLOAD: 2}.get(self.type)
+        if position is None:
+            return False
+        parts = self.get_header_fields()
+        return len(parts) > position and parts[position] == BUNDLE_REQUEST
+
+    def get_bundle_names(self):
+        """Extrae los nombres de los archivos pedidos en un DOWNLOAD
+        agrupado"""
+        if self.type != MessageType.DOWNLOAD or not self.is_bundle():
+            return []
+        parts = self.data.split(EARLY_DATA_SEPARATOR, 1)
+        if len(parts) < 2 or not parts[1]:
+            return []
+        return parts[1].decode('utf-8').split(BUNDLE_NAMES_SEPARATOR)
+
+    def get_byte_range(self):
+        """Extrae el rango (offset, longitud) pedido en un DOWNLOAD, con
+        longitud None si es hasta el final. None si se pide el archivo
+        entero. Lanza ValueError si el rango está mal formado"""
+        if self.type != MessageType.DOWNLOAD:
+            return None
+        parts = self.get_header_fields()
+        if len(parts) < 3 or parts[2] != RANGE_REQUEST:
+            return None
+        if len(parts) < 5:
+            raise ValueError("Rango incompleto")
+        return int(parts[3]), int(parts[4]) if parts[4] else None
+
     def get_error_code(self):
         """Extrae el código de error del mensaje"""
         if self.type == MessageType.ERROR and self.data:
@@ -160,6 +358,65 @@ class Message:
             return ErrorCode(error_value)
         return None
 
+    def get_retry_after(self):
+        """Extrae de un BUSY los segundos a esperar antes de reintentar"""
+        if self.type == MessageType.BUSY:
+            parts = self.get_header_fields()
+            if parts and parts[0].isdigit():
+                return int(parts[0]) / 1000
+        return None
+
+    def get_queue_position(self):
+        """Extrae de un BUSY la posición en la cola de espera (0 si el
+        pedido no pudo encolarse)"""
+        if self.type == MessageType.BUSY:
+            parts = self.get_header_fields()
+            if len(parts) >= 2 and parts[1].isdigit():
+                return int(parts[1])
+        return None
+
+    def get_catalog_entries(self):
+        """Extrae de un CATALOG las entradas como tuplas (nombre, tamaño,
+        mtime, digest); el digest es "" si el servidor no lo tiene
+        calculado"""
+        if self.type != MessageType.CATALOG:
+            return []
+        lines = self.get_data_as_string().split(CATALOG_SEPARATOR)[1:]
+        entries = []
+        for line in lines:
+            name, size, mtime, digest = line.rsplit("|", 3)
+            entries.append((name, int(size), int(mtime), digest))
+        return entries
+
+    def get_next_cursor(self):
+        """Extrae de un CATALOG el nombre desde el que sigue el listado, o
+        "" si fue la última página"""
+        if self.type != MessageType.CATALOG:
+            return ""
+        return self.get_data_as_string().split(CATALOG_SEPARATOR, 1)[0]
+
+    def get_announce(self):
+        """Extrae de un ANNOUNCE (nombre, tamaño, digest, bloques enviados)
+        o None si está mal formado"""
+        if self.type != MessageType.ANNOUNCE:
+            return None
+        parts = self.get_data_as_string().rsplit("|", 3)
+        if (len(parts) != 4 or not parts[1].isdigit() or
+                not parts[3].isdigit()):
+            return None
+        return parts[0], int(parts[1]), parts[2], int(parts[3])
+
+    def get_nak_ranges(self):
+        """Extrae de un NAK los rangos (primero, último) de bloques
+        faltantes. Lanza ValueError si están mal formados"""
+        if self.type != MessageType.NAK or not self.data:
+            return []
+        ranges = []
+        for item in self.get_data_as_string().split(NAK_RANGE_SEPARATOR):
+            first, last = item.split(NAK_RANGE_BOUNDS_SEPARATOR)
+            ranges.append((int(first), int(last)))
+        return ranges
+
     def is_timeout(self):
         """Comprueba si el mensaje ha expirado"""
         return datetime.now() > self.timeout_time
@@ -168,18 +425,58 @@ class Message:
         """Establece un nuevo tiempo de expiración"""
         self.timeout_time = datetime.now() + timedelta(seconds=timeout)
 
+    def mark_sent(self):
+        """Registra un envío del mensaje"""
+        self.sent_time = datetime.now()
+        self.transmissions += 1
+
     # Métodos de fábrica estáticos para crear mensajes específicos
 
     @staticmethod
-    def upload(file_size, file_name, md5_digest):
-        """Crea un mensaje de subida de archivo"""
-        data = f"{file_size}|{file_name}|{md5_digest}".encode('utf-8')
+    def upload(file_size, file_name, md5_digest, early_data=b'',
+               compression=None, delta_digest=None, bundle=False):
+        """Crea un mensaje de subida de archivo. Si se indica early_data, el
+        primer bloque del archivo viaja junto al pedido (0-RTT). Si se indica
+        compression, los bloques viajan comprimidos con ella. Si se indica
+        delta_digest, lo que se sube es un delta contra la copia del
+        servidor y delta_digest es el MD5 del archivo resultante. Con bundle
+        lo que se sube es un bundle de varios archivos"""
+        header = f"{file_size}|{file_name}|{md5_digest}"
+        if compression or delta_digest or bundle:
+            header += f"|{compression or ''}"
+        if delta_digest or bundle:
+            header += f"|{delta_digest or ''}"
+        if bundle:
+            header += f"|{BUNDLE_REQUEST}"
+        data = header.encode('utf-8')
+        if early_data and len(data) < CONTROL_HEADER_MAX_SIZE:
+            data += EARLY_DATA_SEPARATOR + early_data
         return Message(MessageType.UPLOAD, 0, data)
 
     @staticmethod
-    def download(file_name):
-        """Crea un mensaje de descarga de archivo"""
-        data = file_name.encode('utf-8')
+    def download(file_name, compression=None, signature=False,
+                 bundle_names=None, byte_range=None):
+        """Crea un mensaje de descarga de archivo, ofreciendo opcionalmente
+        una compresión que el servidor puede aceptar. Con signature se pide
+        la firma por bloques del archivo (subida en modo delta). Con
+        bundle_names se piden esos archivos agrupados en un bundle, y
+        file_name solo identifica el pedido. Con byte_range (offset,
+        longitud) se pide solo ese rango del archivo"""
+        header = file_name
+        if compression or signature or bundle_names or byte_range:
+            header += f"|{compression or ''}"
+        if signature:
+            header += f"|{SIGNATURE_REQUEST}"
+        elif bundle_names:
+            header += f"|{BUNDLE_REQUEST}"
+        elif byte_range:
+            offset, length = byte_range
+            header += (f"|{RANGE_REQUEST}|{offset}|"
+                       f"{'' if length is None else length}")
+        data = header.encode('utf-8')
+        if bundle_names:
+            data += EARLY_DATA_SEPARATOR + BUNDLE_NAMES_SEPARATOR.join(
+                bundle_names).encode('utf-8')
         return Message(MessageType.DOWNLOAD, 0, data)
 
     @staticmethod
@@ -188,9 +485,10 @@ class Message:
         return Message(MessageType.DATA, seq_number, data)
 
     @staticmethod
-    def ack(seq_number):
-        """Crea un mensaje de confirmación"""
-        return Message(MessageType.ACK, seq_number)
+    def ack(seq_number, window=NO_WINDOW):
+        """Crea un mensaje de confirmación, anunciando opcionalmente la
+        ventana de recepción"""
+        return Message(MessageType.ACK, seq_number, window=window)
 
     @staticmethod
     def ack_end_download_saw(seq_number, md5_digest):
@@ -200,11 +498,32 @@ class Message:
         return Message(MessageType.ACK, seq_number, data)
 
     @staticmethod
-    def ack_download(file_size):
-        """Crea un mensaje de confirmación de descarga"""
-        data = str(file_size).encode('utf-8')
+    def ack_download(file_size, inline_data=b'', compression=None):
+        """Crea un mensaje de confirmación de descarga. Si se indica
+        inline_data, el primer bloque del archivo viaja en la respuesta. Si
+        se indica compression, es la que el servidor eligió para los
+        bloques"""
+        header = str(file_size)
+        if compression:
+            header += f"|{compression}"
+        data = header.encode('utf-8')
+        if inline_data:
+            data += EARLY_DATA_SEPARATOR + inline_data
         return Message(MessageType.ACK_DOWNLOAD, 0, data)
 
+    @staticmethod
+    def ack_download_confirmation():
+        """Crea el mensaje con el que el cliente confirma el ACK_DOWNLOAD"""
+        return Message(MessageType.ACK_DOWNLOAD, 0)
+
+    @staticmethod
+    def ack_upload(seq_number, complete=False):
+        """Crea un mensaje de confirmación de subida que indica que el
+        bloque adjunto al UPLOAD fue aceptado. Con complete indica que el
+        servidor ya tiene el archivo entero y no hace falta enviar datos"""
+        data = UPLOAD_COMPLETE.encode('utf-8') if complete else None
+        return Message(MessageType.ACK_UPLOAD, seq_number, data)
+
     @staticmethod
     def ack_end(seq_number=0):
         """Crea un mensaje de confirmación de finalización"""
@@ -216,6 +535,56 @@ class Message:
         data = error_code.value.to_bytes(1, 'big')
         return Message(MessageType.ERROR, 0, data)
 
+    @staticmethod
+    def list(cursor, seq_number=0):
+        """Crea un pedido de una página del catálogo, con los archivos que
+        siguen a cursor en orden alfabético ("" para la primera)"""
+        return Message(MessageType.LIST, seq_number, cursor.encode('utf-8'))
+
+    @staticmethod
+    def announce(file_name, file_size, md5_digest, sent):
+        """Crea el anuncio periódico de una distribución multicast: el
+        archivo y cuántos bloques se enviaron hasta ahora"""
+        data = f"{file_name}|{file_size}|{md5_digest}|{sent}"
+        return Message(MessageType.ANNOUNCE, 0, data.encode('utf-8'))
+
+    @staticmethod
+    def nak(ranges):
+        """Crea el pedido de reenvío de los rangos (primero, último) de
+        bloques faltantes de una distribución multicast. Se incluyen los
+        que entran en un mensaje"""
+        data = b''
+        for first, last in ranges:
+            item = f"{first}{NAK_RANGE_BOUNDS_SEPARATOR}{last}".encode()
+            if len(data) + len(item) + 1 > MAX_PAYLOAD_SIZE:
+                break
+            if data:
+                data += NAK_RANGE_SEPARATOR.encode()
+            data += item
+        return Message(MessageType.NAK, 0, data)
+
+    @staticmethod
+    def stat(file_name, seq_number=0):
+        """Crea un pedido de la información de un archivo"""
+        return Message(MessageType.STAT, seq_number,
+                       file_name.encode('utf-8'))
+
+    @staticmethod
+    def catalog(seq_number, entries, next_cursor=""):
+        """Crea la respuesta a un LIST o STAT con el mismo número de
+        secuencia. entries son tuplas (nombre, tamaño, mtime, digest)"""
+        lines = [next_cursor] + [catalog_entry_line(entry)
+                                 for entry in entries]
+        data = CATALOG_SEPARATOR.join(lines).encode('utf-8')
+        return Message(MessageType.CATALOG, seq_number, data)
+
+    @staticmethod
+    def busy(retry_after, queue_position=0):
+        """Crea un mensaje que indica que el servidor no puede atender el
+        pedido todavía y en cuántos segundos conviene reintentarlo"""
+        data = f"{int(retry_after * 1000)}|{queue_position}".encode('utf-8')
+        return Message(MessageType.BUSY, 0, data)
+
     @staticmethod
     def end():
         """Crea un mensaje de finalización"""
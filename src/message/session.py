@@ -0,0 +1,46 @@
+from random import getrandbits
+from message.message import SESSION_ID_BYTES, set_session_id
+
+
+def new_session_id(used_ids=()):
+    """Genera un id de sesión aleatorio, distinto de 0 (reservado para los
+    clientes sin sesión) y de los ids ya usados"""
+    while True:
+        session_id = getrandbits(SESSION_ID_BYTES * 8)
+        if session_id and session_id not in used_ids:
+            return session_id
+
+
+def session_key(message, address):
+    """Clave con la que se demultiplexa un mensaje: el id de sesión si lo
+    tiene, o la dirección de origen para los clientes sin sesión"""
+    session_id = message.get_session_id()
+    return session_id if session_id else address
+
+
+class SessionSocket:
+    """Socket de una sesión: marca cada mensaje saliente con el id de sesión
+    y lo envía a la dirección actual del otro extremo"""
+    def __init__(self, sock, session_id, address):
+        """
+        Inicializa el socket de la sesión
+
+        Args:
+            sock: Socket UDP compartido por todas las sesiones
+            session_id: Id de la sesión
+            address: Tupla (host, port) actual del otro extremo
+        """
+        self.sock = sock
+        self.session_id = session_id
+        self.address = address
+
+    def sendto(self, data, address=None):
+        """Envía el mensaje serializado. La dirección recibida se ignora:
+        la sesión sigue al otro extremo aunque cambie de dirección (por
+        ejemplo, tras un rebinding de NAT)"""
+        return self.sock.sendto(set_session_id(data, self.session_id),
+                                self.address)
+
+    def update_address(self, address):
+        """Actualiza la dirección del otro extremo"""
+        self.address = address
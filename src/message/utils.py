@@ -1,9 +1,15 @@
 from datetime import datetime, timedelta
 from random import randint
+import queue
 import threading
-from message.message import TOTAL_BYTES_LENGTH, Message
+from message.message import (
+    NO_WINDOW, TOTAL_BYTES_LENGTH, Message, MessageType
+)
 from utils.logger import logger
 
+# Espera máxima de un worker por un mensaje antes de revisar sus timers
+QUEUE_POLL_INTERVAL = 0.001
+
 
 def recv_message(socket, timeout=1):
     socket.settimeout(timeout)
@@ -17,6 +23,7 @@ def recv_message(socket, timeout=1):
 
 def send_message(message, socket, address, timeout=0.1):
     message.set_timeout(timeout)
+    message.mark_sent()
     if not lost_message():
         bytes_to_send = message.to_bytes()
         socket.sendto(bytes_to_send, address)
@@ -27,13 +34,30 @@ def lost_message():
     return random_number < 0
 
 
-def send_ack(secNumber, socket, address):
-    ack_message = Message.ack(secNumber)
+def send_ack(secNumber, socket, address, window=NO_WINDOW):
+    ack_message = Message.ack(secNumber, window)
     send_message(ack_message, socket, address)
 
 
+def defer_on_busy(response, request):
+    """Si la respuesta es un BUSY, posterga el reenvío del pedido el tiempo
+    que indica el servidor. Devuelve si lo era"""
+    if not response or response.get_type() != MessageType.BUSY:
+        return False
+    logger.info(f"Servidor ocupado (posición en la cola: "
+                f"{response.get_queue_position()}), reintentando en "
+                f"{response.get_retry_after():.1f} s")
+    request.set_timeout(response.get_retry_after())
+    return True
+
+
 def get_message_from_queue(message_queue) -> Message | None:
-    return message_queue.get(False) if not message_queue.empty() else None
+    # Espera brevemente en vez de girar en vacío: libera el GIL para el
+    # loop principal y el thread de salida del servidor
+    try:
+        return message_queue.get(timeout=QUEUE_POLL_INTERVAL)
+    except queue.Empty:
+        return None
 
 
 def show_info(total_size, current_size, start_time, next_update):
@@ -55,8 +79,7 @@ def send_message_and_retry(message, socket, address, message_queue, stop_event,
     while True:
         if stop_event.is_set():
             return None
-        recv_message = (message_queue.get(False) if not message_queue.empty()
-                        else None)
+        recv_message = get_message_from_queue(message_queue)
         if recv_message:
             if recv_message.get_type() in waited_messages:
                 return recv_message
@@ -72,7 +95,8 @@ def send_message_and_wait(message, socket, address, message_queue, stop_event,
             return None
         if message.is_timeout():
             send_message(message, socket, address)
-        recv_message = (message_queue.get(False) if not message_queue.empty()
-                        else None)
+        recv_message = get_message_from_queue(message_queue)
+        if defer_on_busy(recv_message, message):
+            continue
         if recv_message and recv_message.get_type() in waited_messages:
             return recv_message
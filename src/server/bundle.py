@@ -0,0 +1,107 @@
+import io
+import os
+from utils.bundle import (
+    BUNDLE_FILE_MAX_SIZE, BUNDLE_MAX_FILES, BUNDLE_MAX_SIZE, read_bundle,
+    write_bundle
+)
+from utils.logger import logger
+
+
+def is_storage_name(name):
+    """Indica si el nombre corresponde a un archivo del almacenamiento: sin
+    rutas y sin punto inicial (temporales y datos internos)"""
+    return bool(name) and os.path.basename(name) == name and \
+        not name.startswith('.')
+
+
+def unpack_bundle(storage, bundle_path, register):
+    """Extrae los archivos de un bundle recibido íntegro. Cada archivo se
+    crea como en una subida individual: si ya existe o llegó dañado se
+    descarta sin afectar al resto. register(filename, digest) se llama por
+    cada archivo guardado. Devuelve si el bundle se pudo leer"""
+    files = {}
+    try:
+        with open(bundle_path, "rb") as bundle:
+            for name, data, digest in read_bundle(bundle):
+                if not is_storage_name(name) or not digest:
+                    logger.error(f"Archivo del bundle descartado: {name!r}")
+                    continue
+                file = create_member(storage, name, data)
+                if file:
+                    files[file] = digest
+    except (ValueError, UnicodeDecodeError) as e:
+        logger.error(f"Bundle inválido: {e}")
+        for file in files:
+            discard(file)
+        return False
+    # Todos los archivos comparten la espera de durabilidad
+    published = storage.publish(list(files))
+    for file, digest in files.items():
+        if file in published:
+            file.close()
+            register(file.path, digest)
+        else:
+            discard(file)
+    os.remove(bundle_path)
+    logger.info(f"Bundle extraído: {len(published)} archivos guardados.")
+    return True
+
+
+def create_member(storage, name, data):
+    """Crea un archivo del bundle como una subida individual y encola sus
+    datos. Devuelve el archivo, o None si no se pudo crear"""
+    try:
+        file = storage.create_upload(name, len(data))
+    except FileExistsError:
+        logger.error(f"El archivo {name} ya existe en el servidor.")
+        return None
+    except OSError as e:
+        logger.error(f"No se pudo crear {name}: {e}")
+        return None
+    try:
+        file.write(data)
+    except OSError as e:
+        logger.error(f"No se pudo escribir {name}: {e}")
+        discard(file)
+        return None
+    return file
+
+
+def discard(file):
+    """Descarta un archivo que no llegó a publicarse"""
+    file.close()
+    os.remove(file.path)
+
+
+def pack_bundle(storage, names):
+    """Arma en memoria el bundle de los archivos pedidos. Los que no
+    existen, se están subiendo o no entran en los límites de un bundle se
+    omiten: el cliente los ve faltar en el manifiesto y los pide por
+    separado. Devuelve el bundle y su MD5"""
+    members = []
+    total = 0
+    # Sin repetidos: cada nombre se lee una sola vez
+    for name in list(dict.fromkeys(names))[:BUNDLE_MAX_FILES]:
+        file = None
+        if is_storage_name(name):
+            file = storage.open(name)
+        if not file:
+            logger.info(f"Archivo del bundle no disponible: {name!r}")
+            continue
+        with file:
+            # Un byte de más para detectar los que exceden el límite sin
+            # leerlos enteros
+            data = file.read(BUNDLE_FILE_MAX_SIZE + 1)
+        if (len(data) > BUNDLE_FILE_MAX_SIZE or
+                total + len(data) > BUNDLE_MAX_SIZE):
+            logger.info(f"Archivo del bundle demasiado grande, se omite: "
+                        f"{name!r}")
+            continue
+        members.append((name, data))
+        total += len(data)
+    bundle = io.BytesIO()
+    md5_digest = write_bundle(members, bundle)
+    bundle.seek(0)
+    logger.info(f"Bundle de {len(members)} archivos armado: "
+                f"{bundle.getbuffer().nbytes} bytes")
+    return bundle, md5_digest
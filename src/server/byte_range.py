@@ -0,0 +1,66 @@
+import hashlib
+import os
+from concurrent.futures import Future
+from server.packfile import PackedFile
+from utils.files import RandomAccessFile
+from utils.digest import range_md5, submit_digest
+
+
+def resolve_range(size, offset, length):
+    """Convierte un rango pedido en (inicio, longitud) dentro de un archivo
+    de size bytes. Un offset negativo cuenta desde el final y la longitud
+    None o que excede el archivo llega hasta el final. Devuelve None si el
+    rango no es válido"""
+    if offset < 0:
+        offset = max(0, size + offset)
+    if offset > size or (length is not None and length < 0):
+        return None
+    if length is None:
+        return offset, size - offset
+    return offset, min(length, size - offset)
+
+
+class RangeFile(RandomAccessFile):
+    """Vista de solo lectura de un rango de un archivo: los workers de
+    descarga la usan como a un archivo que empieza en el inicio del rango"""
+    def __init__(self, file, start, length):
+        """
+        Inicializa la vista
+
+        Args:
+            file: Archivo abierto (se cierra junto con la vista)
+            start: Offset del rango en el archivo
+            length: Longitud del rango
+        """
+        super().__init__(length)
+        self.file = file
+        self.start = start
+
+    def _read_at(self, offset, size):
+        self.file.seek(self.start + offset)
+        return self.file.read(size)
+
+    def close(self):
+        if not self.closed:
+            self.file.close()
+        super().close()
+
+
+def open_range(storage, name, file, byte_range):
+    """Limita una descarga al rango pedido. Devuelve la vista del rango y
+    un Future con el MD5 del rango, o (None, "") si el rango no es válido
+    (y cierra el archivo)"""
+    resolved = resolve_range(file.seek(0, os.SEEK_END), *byte_range)
+    if not resolved:
+        file.close()
+        return None, ""
+    start, length = resolved
+    ranged = RangeFile(file, start, length)
+    if not isinstance(file, PackedFile):
+        return ranged, submit_digest(range_md5, storage.path(name), start,
+                                     length)
+    # Los archivos empaquetados son chicos y ya están en memoria
+    digest = Future()
+    digest.set_result(hashlib.md5(ranged.read()).hexdigest())
+    ranged.seek(0)
+    return ranged, digest
@@ -0,0 +1,161 @@
+import bisect
+import threading
+import time
+from concurrent.futures import Future
+from message.message import (
+    CATALOG_SEPARATOR, MAX_PAYLOAD_SIZE, catalog_entry_line
+)
+from utils.logger import logger
+
+
+class CatalogEntry:
+    """Información de un archivo del almacenamiento. El digest se conserva
+    mientras el tamaño y el mtime no cambien"""
+    def __init__(self, size, mtime_ns, digest=None):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        # MD5 conocido, Future si se está calculando o None
+        self.digest = digest
+
+    def matches(self, stat):
+        """Indica si la entrada corresponde al estado actual del archivo"""
+        return (self.size == stat.st_size and
+                self.mtime_ns == stat.st_mtime_ns)
+
+    def known_digest(self):
+        """Devuelve el digest si ya está calculado, o "" si no"""
+        if isinstance(self.digest, Future):
+            if not self.digest.done():
+                return ""
+            if self.digest.exception():
+                # Se vuelve a intentar en el próximo pedido
+                self.digest = None
+                return ""
+            self.digest = self.digest.result()
+        return self.digest or ""
+
+
+class Catalog:
+    """Catálogo en memoria del almacenamiento, ordenado por nombre para
+    paginar los LIST. Se arma con un recorrido del almacenamiento y después
+    se actualiza cuando terminan las subidas. Con varios procesos sirviendo
+    el mismo directorio (shared) cada uno tiene su catálogo: un LIST vuelve
+    a recorrer el almacenamiento si el directorio cambió desde el último
+    recorrido, o cada cierto tiempo si está particionado en subdirectorios"""
+    def __init__(self, storage, shared=False):
+        """
+        Inicializa el catálogo recorriendo el almacenamiento
+
+        Args:
+            storage: Storage del servidor
+            shared: Si otros procesos pueden modificar el almacenamiento
+        """
+        self.storage = storage
+        self.shared = shared
+        self.entries = dict[str, CatalogEntry]()
+        self.names = []
+        self.scanned_version = None
+        self.scanned_at = 0
+        self.lock = threading.Lock()
+        self.scan()
+
+    def scan(self):
+        """Recorre el almacenamiento y reconstruye el catálogo, conservando
+        los digests de los archivos que no cambiaron"""
+        scanned_version = self.storage.version()
+        scanned_at = time.monotonic()
+        entries = {}
+        for name, stat, digest in self.storage.entries():
+            entry = self.entries.get(name)
+            if not entry or not entry.matches(stat):
+                entry = CatalogEntry(stat.st_size, stat.st_mtime_ns, digest)
+            entries[name] = entry
+        with self.lock:
+            self.entries = entries
+            self.names = sorted(entries)
+            self.scanned_version = scanned_version
+            self.scanned_at = scanned_at
+        logger.debug(f"Catálogo: {len(entries)} archivos")
+
+    def refresh_if_changed(self):
+        """Vuelve a recorrer el almacenamiento si otro proceso pudo
+        cambiarlo"""
+        if not self.shared:
+            return
+        interval = self.storage.rescan_interval()
+        if interval:
+            # Los archivos nuevos no cambian el mtime de la raíz
+            if time.monotonic() - self.scanned_at >= interval:
+                self.scan()
+        elif self.storage.version() != self.scanned_version:
+            self.scan()
+
+    def update(self, name, digest=None):
+        """Actualiza la entrada de un archivo tras una subida, con su digest
+        si ya se conoce. Si el archivo no existe se quita del catálogo"""
+        try:
+            stat = self.storage.stat(name)
+        except FileNotFoundError:
+            stat = None
+        with self.lock:
+            if not stat:
+                if self.entries.pop(name, None):
+                    self.names.remove(name)
+                return None
+            entry = self.entries.get(name)
+            if not entry:
+                bisect.insort(self.names, name)
+            if not entry or not entry.matches(stat):
+                entry = CatalogEntry(stat.st_size, stat.st_mtime_ns,
+                                     self.storage.known_digest(name))
+                self.entries[name] = entry
+            if digest:
+                entry.digest = digest
+            return entry
+
+    def stat(self, name):
+        """Devuelve la entrada actual de un archivo, o None si no existe.
+        Siempre consulta el disco: es barato y cubre los cambios hechos por
+        otros procesos"""
+        return self.update(name)
+
+    def digest(self, name, entry):
+        """Devuelve un Future con el MD5 del archivo, calculándolo en el pool
+        de digests solo si no está en caché"""
+        with self.lock:
+            entry.known_digest()  # Descarta un cálculo que falló
+            if not entry.digest:
+                entry.digest = self.storage.digest(name)
+            digest = entry.digest
+        if isinstance(digest, Future):
+            return digest
+        future = Future()
+        future.set_result(digest)
+        return future
+
+    def list_page(self, cursor):
+        """Devuelve las entradas que siguen a cursor, tantas como entren en
+        un mensaje, y el cursor de la página siguiente ("" si no hay)"""
+        self.refresh_if_changed()
+        used = 0
+        page = []
+        with self.lock:
+            start = bisect.bisect_right(self.names, cursor) if cursor else 0
+            for index in range(start, len(self.names)):
+                name = self.names[index]
+                entry = self.entries[name]
+                line = (name, entry.size, entry.mtime_ns // 10 ** 9,
+                        entry.known_digest())
+                size = len(catalog_entry_line(line).encode('utf-8')) + len(
+                    CATALOG_SEPARATOR)
+                # La primera línea es el cursor siguiente: a lo sumo este
+                # mismo nombre
+                if used + size + len(name.encode('utf-8')) > MAX_PAYLOAD_SIZE:
+                    if not page:
+                        logger.error(f"Entrada de catálogo demasiado larga: "
+                                     f"{name}")
+                        continue
+                    return page, page[-1][0]
+                used += size
+                page.append(line)
+        return page, ""
@@ -0,0 +1,133 @@
+import os
+import threading
+from collections import OrderedDict
+from message.message import DATA_MAX_SIZE
+from utils.files import RandomAccessFile
+
+# Los bloques del caché coinciden con los de DATA: cada lectura de un
+# worker de descarga es a lo sumo un bloque
+CHUNK_SIZE = DATA_MAX_SIZE
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+
+class ChunkCacheStats:
+    """Contadores del caché de bloques"""
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.entries = 0
+        self.bytes = 0
+
+    def hit_ratio(self):
+        """Proporción de lecturas servidas desde memoria"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0
+
+    def snapshot(self):
+        """Copia de los contadores como diccionario"""
+        return dict(vars(self))
+
+    def __repr__(self):
+        return (f"ChunkCacheStats(hits={self.hits}, misses={self.misses}, "
+                f"hit_ratio={self.hit_ratio():.2f}, "
+                f"evictions={self.evictions}, entries={self.entries}, "
+                f"bytes={self.bytes})")
+
+
+class ChunkCache:
+    """Caché LRU de bloques de archivos compartido por todas las descargas
+    del proceso. Las claves son (identidad del archivo, índice del bloque):
+    la identidad incluye inodo, tamaño y mtime, así que un archivo
+    reemplazado (por ejemplo por una subida delta) no reutiliza bloques de
+    la versión anterior, que envejecen hasta desalojarse"""
+    def __init__(self, max_bytes=DEFAULT_CACHE_SIZE):
+        """
+        Inicializa el caché vacío
+
+        Args:
+            max_bytes: Memoria máxima ocupada por los bloques
+        """
+        self.max_bytes = max_bytes
+        self.chunks = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = ChunkCacheStats()
+
+    def get(self, identity, index, fd):
+        """Devuelve el bloque index del archivo, leyéndolo de fd si no está
+        en el caché"""
+        key = (identity, index)
+        with self.lock:
+            chunk = self.chunks.get(key)
+            if chunk is not None:
+                self.chunks.move_to_end(key)
+                self.stats.hits += 1
+                return chunk
+            self.stats.misses += 1
+        # La lectura se hace fuera del lock; pread no mueve la posición del
+        # archivo, que puede estar compartido
+        chunk = os.pread(fd, CHUNK_SIZE, index * CHUNK_SIZE)
+        self.put(key, chunk)
+        return chunk
+
+    def put(self, key, chunk):
+        """Guarda un bloque y desaloja los menos usados hasta respetar la
+        memoria máxima"""
+        if len(chunk) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.chunks:
+                # Otra descarga lo leyó a la vez
+                return
+            self.chunks[key] = chunk
+            self.stats.entries += 1
+            self.stats.bytes += len(chunk)
+            while self.stats.bytes > self.max_bytes:
+                _, evicted = self.chunks.popitem(last=False)
+                self.stats.evictions += 1
+                self.stats.entries -= 1
+                self.stats.bytes -= len(evicted)
+
+
+def file_identity(fd):
+    """Identifica la versión de un archivo abierto"""
+    stat = os.fstat(fd)
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class CachedFile(RandomAccessFile):
+    """Archivo de solo lectura que sirve sus bloques desde el caché. Los
+    workers de descarga lo usan como al archivo original"""
+    def __init__(self, file, cache):
+        """
+        Inicializa el archivo
+
+        Args:
+            file: Archivo abierto (con su lock de descarga)
+            cache: ChunkCache compartido
+        """
+        self.fd = file.fileno()
+        self.identity = file_identity(self.fd)
+        super().__init__(self.identity[2])
+        self.file = file
+        self.cache = cache
+
+    def _read_at(self, offset, size):
+        """Arma el resultado con bloques del caché"""
+        parts = []
+        while size > 0:
+            index, start = divmod(offset, CHUNK_SIZE)
+            chunk = self.cache.get(self.identity, index, self.fd)
+            part = chunk[start:start + size]
+            if not part:
+                break
+            parts.append(part)
+            offset += len(part)
+            size -= len(part)
+        return b''.join(parts)
+
+    def close(self):
+        """Cierra el archivo original, liberando su lock"""
+        if not self.closed:
+            self.file.close()
+        super().close()
@@ -0,0 +1,95 @@
+import os
+import re
+from utils.logger import logger
+
+# Directorio, dentro del almacenamiento, donde se guardan los blobs
+OBJECTS_DIR = '.objects'
+# Forma de un digest MD5 en hexadecimal, como lo calcula el cliente
+DIGEST_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+def valid_digest(digest):
+    """Indica si el digest recibido de un cliente es un MD5 en
+    hexadecimal. Los digests terminan en rutas del almacén, así que no se
+    usa ninguno sin comprobarlo"""
+    return isinstance(digest, str) and bool(DIGEST_PATTERN.fullmatch(digest))
+
+
+def valid_content_key(digest, size):
+    """Indica si (digest, size) puede identificar un blob"""
+    return (valid_digest(digest) and isinstance(size, int) and
+            not isinstance(size, bool) and size >= 0)
+
+
+class ContentStore:
+    """Almacenamiento direccionado por contenido: cada contenido distinto se
+    guarda una sola vez como blob, identificado por su MD5 y su tamaño, y
+    los nombres de archivo son hardlinks a ese blob. Los archivos siguen
+    siendo archivos comunes para el resto del servidor; nunca se modifican
+    en el lugar (una subida delta reemplaza el nombre por un inodo nuevo),
+    así que compartir el inodo entre nombres es seguro"""
+    def __init__(self, storage_path):
+        """
+        Inicializa el almacén, creando el directorio de blobs
+
+        Args:
+            storage_path: Directorio de almacenamiento del servidor
+        """
+        self.objects_path = os.path.join(storage_path, OBJECTS_DIR)
+        os.makedirs(self.objects_path, exist_ok=True)
+
+    def blob_path(self, digest, size):
+        """Ruta del blob de un contenido. Lanza ValueError si el digest o el
+        tamaño no son válidos"""
+        if not valid_content_key(digest, size):
+            raise ValueError(f"Clave de contenido inválida: {digest!r}, "
+                             f"{size!r}")
+        path = os.path.join(self.objects_path, digest[:2],
+                            f"{digest}-{size}")
+        root = os.path.realpath(self.objects_path)
+        if os.path.commonpath([os.path.realpath(path), root]) != root:
+            raise ValueError(f"El blob {path} queda fuera del almacén")
+        return path
+
+    def link(self, filename, digest, size):
+        """Crea el nombre como referencia a un blob ya almacenado. Devuelve
+        False si el contenido no está en el almacén. Lanza FileExistsError
+        si el nombre ya existe y ValueError si la clave no es válida"""
+        try:
+            os.link(self.blob_path(digest, size), filename)
+        except FileNotFoundError:
+            return False
+        logger.info(f"Contenido de {filename} ya almacenado "
+                    f"({digest}), subida sin datos.")
+        return True
+
+    def store(self, filename, digest, size):
+        """Incorpora al almacén un archivo recién subido y verificado. Si el
+        contenido ya estaba, el nombre pasa a referenciar el blob existente
+        y se libera la copia recibida"""
+        blob = self.blob_path(digest, size)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            os.link(filename, blob)
+            return
+        except FileExistsError:
+            pass
+        # Crear el enlace con otro nombre y reemplazar: el nombre nunca
+        # deja de existir
+        temp_name = f"{filename}.{os.getpid()}.link"
+        os.link(blob, temp_name)
+        os.replace(temp_name, filename)
+        logger.info(f"Contenido de {filename} deduplicado ({digest}).")
+
+    def collect_garbage(self):
+        """Elimina los blobs que ya no referencia ningún nombre (su único
+        enlace es el del almacén). Devuelve cuántos bytes se liberaron"""
+        freed = 0
+        for directory, _, blobs in os.walk(self.objects_path):
+            for blob in blobs:
+                path = os.path.join(directory, blob)
+                stat = os.stat(path)
+                if stat.st_nlink == 1:
+                    os.remove(path)
+                    freed += stat.st_size
+        return freed
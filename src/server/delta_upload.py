@@ -0,0 +1,43 @@
+import os
+from utils.delta import apply_delta
+from utils.files import create_temp_beside
+from utils.logger import logger
+
+
+def rebuild_from_delta(storage, name, delta_path, expected_digest,
+                       max_size=None):
+    """Reconstruye el archivo aplicando el delta recibido a la copia actual
+    y lo reemplaza de forma atómica: las descargas en curso siguen leyendo
+    la versión anterior. El límite de tamaño se aplica al archivo
+    reconstruido, que puede ser mucho mayor que el delta. Devuelve si el
+    resultado tiene el MD5 esperado"""
+    filename = storage.path(name)
+    basis = storage.open(name)
+    if not basis:
+        logger.error(f"No se puede leer la copia de {filename} para "
+                     f"aplicar el delta.")
+        return False
+    fd, rebuilt_path = create_temp_beside(filename, suffix=".tmp")
+    delta_size = os.path.getsize(delta_path)
+    try:
+        with basis, open(delta_path, "rb") as delta, \
+                os.fdopen(fd, "wb") as rebuilt:
+            digest = apply_delta(basis, delta, rebuilt, max_size)
+            rebuilt.flush()
+            os.fsync(rebuilt.fileno())
+    except (ValueError, OSError) as e:
+        logger.error(f"No se pudo aplicar el delta a {filename}: {e}")
+        os.remove(rebuilt_path)
+        return False
+
+    if digest != expected_digest:
+        # La copia cambió desde que el cliente pidió la firma
+        logger.error(f"El archivo reconstruido {filename} no coincide con "
+                     f"el del cliente.")
+        os.remove(rebuilt_path)
+        return False
+    storage.replace(name, rebuilt_path)
+    os.remove(delta_path)
+    logger.info(f"Archivo {filename} actualizado con un delta de "
+                f"{delta_size} bytes.")
+    return True
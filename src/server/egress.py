@@ -0,0 +1,269 @@
+import ipaddress
+import threading
+import time
+from collections import deque
+from message.message import TOTAL_BYTES_LENGTH
+from utils.logger import logger
+from utils.rate_limit import TokenBucket, parse_rate
+
+# Bytes que cada flujo puede enviar por ronda del deficit round robin
+DRR_QUANTUM = TOTAL_BYTES_LENGTH
+# Paquetes que un flujo puede tener encolados; los que exceden se descartan
+# y los recupera la retransmisión, como en la cola de un router
+MAX_FLOW_QUEUE = 1024
+# Paquetes encolados en total entre todos los flujos
+MAX_EGRESS_QUEUE = 8192
+# Paquetes que el sender toma por vez, para no competir por el lock en cada
+# envío
+EGRESS_BATCH = 64
+# Espera máxima del scheduler cuando todos los flujos están limitados
+MAX_IDLE_SLEEP = 0.01
+
+
+def parse_quota(text):
+    """Convierte una cuota 'RED=TASA' (p. ej. '10.0.0.0/8=1M' o
+    '192.168.1.7=256K') en una tupla (red, bytes por segundo)"""
+    network, _, rate = text.partition('=')
+    if not rate:
+        raise ValueError(f"Cuota inválida: {text}")
+    return (ipaddress.ip_network(network.strip(), strict=False),
+            parse_rate(rate))
+
+
+class EgressFlow:
+    """Cola de salida de una transferencia. Se usa como socket: sendto
+    encola el paquete y el scheduler lo envía cuando le toca"""
+    def __init__(self, scheduler, buckets, sock=None, keys=()):
+        """
+        Inicializa el flujo
+
+        Args:
+            scheduler: EgressScheduler que despacha el flujo
+            buckets: TokenBuckets que limitan al flujo (cuotas que comparte
+                con otros flujos y tasa global)
+            sock: Socket propio de la transferencia, o None para usar el
+                socket principal del servidor
+            keys: Claves de los buckets compartidos que usa el flujo
+        """
+        self.scheduler = scheduler
+        self.buckets = buckets
+        self.sock = sock
+        self.keys = keys
+        self.frames = deque()
+        self.deficit = 0
+        self.active = False
+
+    def sendto(self, data, address):
+        """Encola un paquete para enviarlo a address"""
+        self.scheduler.enqueue(self, data, address)
+
+    def close(self):
+        """Avisa al scheduler que la transferencia terminó. Los paquetes
+        que queden encolados se envían igual"""
+        self.scheduler.release(self)
+
+
+class EgressStats:
+    """Contadores de la etapa de salida"""
+    def __init__(self):
+        self.depth = 0
+        self.max_depth = 0
+        self.enqueued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.send_errors = 0
+        self.batches = 0
+
+    def snapshot(self):
+        """Copia de los contadores como diccionario"""
+        return dict(vars(self))
+
+    def __repr__(self):
+        return (f"EgressStats(depth={self.depth}, "
+                f"max_depth={self.max_depth}, sent={self.sent}, "
+                f"dropped={self.dropped}, send_errors={self.send_errors}, "
+                f"batches={self.batches})")
+
+
+class EgressScheduler:
+    """Única etapa que escribe en el socket del servidor. Los workers
+    encolan los mensajes ya serializados y un thread los envía en tandas,
+    repartiendo el ancho de banda entre las transferencias activas con
+    deficit round robin y respetando la tasa global y las cuotas por cliente
+    o por subred"""
+    def __init__(self, sock, max_rate=0, client_rate=0, quotas=()):
+        """
+        Inicializa el scheduler
+
+        Args:
+            sock: Socket UDP del servidor
+            max_rate: Tasa total de salida en bytes/s (0 sin límite)
+            client_rate: Tasa por IP de cliente en bytes/s (0 sin límite)
+            quotas: Tuplas (red, bytes/s): la tasa la comparten todos los
+                clientes de la red. Gana la red más específica
+        """
+        self.sock = sock
+        self.global_bucket = TokenBucket(max_rate) if max_rate else None
+        self.client_rate = client_rate
+        self.quotas = sorted(quotas, key=lambda q: q[0].prefixlen,
+                             reverse=True)
+        # Buckets compartidos por clave (red o IP del cliente) y cuántos
+        # flujos abiertos usan cada uno: el bucket de una clave se descarta
+        # al cerrarse su último flujo
+        self.buckets = dict()
+        self.users = dict()
+        self.active = deque()
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.stats = EgressStats()
+        # Flujo de los mensajes del loop principal (p. ej. BUSY): no está
+        # sujeto a cuotas
+        self.control = EgressFlow(self, [])
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        """Inicia el thread que despacha los paquetes"""
+        self.thread.start()
+
+    def stop(self):
+        """Detiene el scheduler"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def shared_bucket(self, key, rate):
+        """Devuelve el bucket de la clave, creándolo si no existe, y cuenta
+        al flujo que lo va a usar"""
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket(rate)
+        self.users[key] = self.users.get(key, 0) + 1
+        return self.buckets[key]
+
+    def release(self, flow):
+        """Descuenta los buckets compartidos de un flujo cerrado y descarta
+        los que ya no usa ningún flujo"""
+        with self.condition:
+            for key in flow.keys:
+                self.users[key] -= 1
+                if not self.users[key]:
+                    del self.users[key]
+                    del self.buckets[key]
+            flow.keys = ()
+
+    def flow(self, address, sock=None):
+        """Crea el flujo de salida de una transferencia hacia address,
+        enviando por sock si la transferencia tiene un socket propio"""
+        ip = ipaddress.ip_address(address[0])
+        keys = []
+        for network, rate in self.quotas:
+            if ip.version == network.version and ip in network:
+                keys.append((network, rate))
+                break
+        else:
+            if self.client_rate:
+                keys.append((ip, self.client_rate))
+        with self.condition:
+            buckets = [self.shared_bucket(key, rate) for key, rate in keys]
+        if self.global_bucket:
+            buckets.append(self.global_bucket)
+        return EgressFlow(self, buckets, sock, [key for key, _ in keys])
+
+    def enqueue(self, flow, data, address):
+        """Encola un paquete del flujo y lo activa si estaba vacío"""
+        with self.condition:
+            if (len(flow.frames) >= MAX_FLOW_QUEUE or
+                    self.stats.depth >= MAX_EGRESS_QUEUE):
+                logger.debug(f"Cola de salida llena, descartando paquete "
+                             f"para {address}")
+                self.stats.dropped += 1
+                return
+            flow.frames.append((data, address))
+            self.stats.enqueued += 1
+            self.stats.depth += 1
+            self.stats.max_depth = max(self.stats.max_depth,
+                                       self.stats.depth)
+            if not flow.active:
+                flow.active = True
+                self.active.append(flow)
+                self.condition.notify()
+
+    def next_batch(self):
+        """Toma el próximo flujo de la ronda y los paquetes que le entran en
+        su déficit y sus cuotas. Devuelve los paquetes y, si el flujo quedó
+        frenado por una cuota, cuánto falta para que pueda seguir"""
+        flow = self.active.popleft()
+        flow.deficit = min(flow.deficit + DRR_QUANTUM,
+                           DRR_QUANTUM + TOTAL_BYTES_LENGTH)
+        batch = []
+        delay = 0
+        while flow.frames and len(flow.frames[0][0]) <= flow.deficit:
+            size = len(flow.frames[0][0])
+            delay = max((bucket.delay(size) for bucket in flow.buckets),
+                        default=0)
+            if delay:
+                break
+            for bucket in flow.buckets:
+                bucket.consume(size)
+            flow.deficit -= size
+            data, address = flow.frames.popleft()
+            batch.append((flow.sock, data, address))
+            self.stats.depth -= 1
+        if flow.frames:
+            self.active.append(flow)
+        else:
+            flow.deficit = 0
+            flow.active = False
+        return batch, delay
+
+    def take_batch(self):
+        """Recorre la ronda hasta juntar EGRESS_BATCH paquetes o hasta que
+        todos los flujos activos estén frenados por sus cuotas. Devuelve los
+        paquetes y la espera hasta que alguno pueda seguir"""
+        batch = []
+        min_delay = MAX_IDLE_SLEEP
+        stalled = 0
+        while self.active and len(batch) < EGRESS_BATCH:
+            flow_batch, delay = self.next_batch()
+            batch.extend(flow_batch)
+            if flow_batch:
+                stalled = 0
+                continue
+            if delay:
+                min_delay = min(min_delay, delay)
+            stalled += 1
+            if stalled > len(self.active):
+                break
+        return batch, min_delay
+
+    def run(self):
+        """Despacha los flujos activos en tandas"""
+        while True:
+            with self.condition:
+                while not self.active and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                batch, delay = self.take_batch()
+
+            # Ninguno pudo enviar: todos están frenados por sus cuotas,
+            # esperar a que se recarguen
+            if not batch:
+                time.sleep(delay)
+                continue
+
+            sent = 0
+            for sock, data, address in batch:
+                try:
+                    # El socket propio de una transferencia está conectado
+                    # al cliente: sendto con dirección falla en macOS/BSD
+                    if sock:
+                        sock.send(data)
+                    else:
+                        self.sock.sendto(data, address)
+                    sent += 1
+                except OSError as e:
+                    logger.error(f"No se pudo enviar a {address}: {e}")
+            with self.condition:
+                self.stats.sent += sent
+                self.stats.send_errors += len(batch) - sent
+                self.stats.batches += 1
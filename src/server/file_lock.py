@@ -0,0 +1,55 @@
+import os
+from utils.logger import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin locks entre procesos
+    fcntl = None
+
+
+def create_for_upload(filename):
+    """Crea el archivo de una subida de forma atómica y lo bloquea mientras
+    se escribe. Si el archivo ya existe (aunque lo haya creado otro proceso
+    del servidor en ese mismo instante) lanza FileExistsError"""
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    file = os.fdopen(fd, "ab")
+    if fcntl:
+        # Recién creado nadie más lo tiene abierto: no puede fallar
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    return file
+
+
+def open_for_download(filename):
+    """Abre un archivo para descargarlo. Devuelve None si no existe o si
+    todavía se está subiendo (en este u otro proceso del servidor)"""
+    try:
+        file = open(filename, "rb")
+    except FileNotFoundError:
+        return None
+    if fcntl:
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info(f"El archivo {filename} se está subiendo todavía.")
+            file.close()
+            return None
+    return file
+
+
+def remove_if_abandoned(filename):
+    """Borra el archivo de una subida que ya nadie escribe (por ejemplo el
+    de un servidor que se detuvo a mitad). Devuelve True si lo borró"""
+    if not fcntl:
+        return False
+    try:
+        file = open(filename, "rb")
+    except FileNotFoundError:
+        return True
+    with file:
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        logger.info(f"Se borra la subida abandonada {filename}")
+        os.unlink(filename)
+    return True
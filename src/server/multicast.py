@@ -0,0 +1,257 @@
+import math
+import select
+import socket
+import time
+from message.message import DATA_MAX_SIZE, Message, MessageType
+from message.session import SessionSocket, new_session_id
+from message.utils import recv_message, send_message
+from utils.logger import logger
+from utils.rate_limit import TokenBucket
+
+# Tasa de envío al grupo: multicast no tiene control de congestión
+DEFAULT_MULTICAST_RATE = 10 * 1024 * 1024
+DEFAULT_MULTICAST_TTL = 1
+# Cada cuánto se anuncia el archivo en el grupo (segundos)
+ANNOUNCE_INTERVAL = 0.5
+# Segundos sin NAKs, con todo enviado, tras los que termina la distribución
+DEFAULT_LINGER = 5
+# Cómo se reenvían los bloques pedidos en NAKs: 'auto' usa multicast si más
+# de un receptor pidió el bloque y unicast si lo pidió uno solo
+REPAIR_MODES = ('auto', 'multicast', 'unicast')
+DEFAULT_REPAIR_MODE = 'auto'
+# Un bloque recién reenviado no se repite por los NAKs que ya estaban en
+# camino (segundos)
+REPAIR_HOLDOFF = 0.2
+# En modo 'auto' un bloque pedido espera este tiempo (segundos) a que
+# lleguen los NAKs de los demás receptores antes de elegir entre multicast y
+# unicast: si se decidiera con el primer NAK todo se reenviaría por unicast
+REPAIR_WAIT = 0.05
+
+
+class MulticastStats:
+    """Contadores de una distribución multicast"""
+    def __init__(self):
+        self.sent = 0
+        self.multicast_repairs = 0
+        self.unicast_repairs = 0
+        self.naks = 0
+        self.completed = 0
+
+    def __repr__(self):
+        return (f"MulticastStats(sent={self.sent}, naks={self.naks}, "
+                f"multicast_repairs={self.multicast_repairs}, "
+                f"unicast_repairs={self.unicast_repairs}, "
+                f"completed={self.completed})")
+
+
+def open_multicast_socket(interface=None, ttl=DEFAULT_MULTICAST_TTL):
+    """Crea el socket que envía al grupo y recibe los NAKs. Con interface
+    (dirección IP local) el grupo se alcanza por esa interfaz"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+    if interface:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                        socket.inet_aton(interface))
+    return sock
+
+
+class MulticastSender:
+    """Distribución de un archivo a un grupo multicast: cada bloque se
+    envía una sola vez para todos los receptores, que piden con NAKs los que
+    les faltan. Periódicamente se anuncia el archivo, así que un receptor
+    puede sumarse tarde y pedir lo que se perdió"""
+    def __init__(self, storage, name, group, rate=DEFAULT_MULTICAST_RATE,
+                 repair=DEFAULT_REPAIR_MODE, receivers=0,
+                 linger=DEFAULT_LINGER, interface=None,
+                 ttl=DEFAULT_MULTICAST_TTL):
+        """
+        Inicializa la distribución
+
+        Args:
+            storage: Almacenamiento del servidor
+            name: Nombre del archivo a distribuir
+            group: Dirección (host, port) del grupo multicast
+            rate: Bytes por segundo enviados, entre datos y reenvíos
+            repair: Uno de REPAIR_MODES
+            receivers: Receptores que deben completar la descarga para
+                terminar (0: se termina cuando dejan de llegar NAKs)
+            linger: Segundos sin NAKs tras los que se termina
+            interface: Dirección IP local por la que se envía al grupo
+            ttl: Saltos que puede atravesar cada datagrama
+        """
+        self.storage = storage
+        self.name = name
+        self.group = group
+        self.repair = repair
+        self.receivers = receivers
+        self.linger = linger
+        self.bucket = TokenBucket(rate)
+        self.sock = open_multicast_socket(interface, ttl)
+        self.session_id = new_session_id()
+        self.group_sock = SessionSocket(self.sock, self.session_id, group)
+        self.stats = MulticastStats()
+        # Bloques pedidos en NAKs -> receptores que los pidieron, en el
+        # orden del primer pedido
+        self.repairs = dict[int, set]()
+        # Bloque pedido -> instante del primer NAK que lo pidió
+        self.requested_at = dict[int, float]()
+        # Último reenvío de cada bloque (por grupo o por receptor)
+        self.repaired_at = dict()
+        self.completed = set()
+        self.file = None
+        self.size = 0
+        self.digest = ""
+        self.chunks = 0
+        self.next_seq = 1
+        self.last_nak = 0
+
+    def run(self):
+        """Distribuye el archivo. Devuelve cuántos receptores lo
+        completaron"""
+        self.file = self.storage.open(self.name)
+        if not self.file:
+            logger.error(f"El archivo {self.name} no existe.")
+            return 0
+        try:
+            self.size = self.storage.stat(self.name).st_size
+            self.digest = self.storage.digest(self.name).result()
+            self.chunks = math.ceil(self.size / DATA_MAX_SIZE)
+            logger.info(f"Distribuyendo {self.name} ({self.size} bytes, "
+                        f"{self.chunks} bloques) en {self.group[0]}:"
+                        f"{self.group[1]}")
+            self.distribute()
+        finally:
+            self.file.close()
+            self.sock.close()
+        logger.info(f"Distribución terminada: {self.stats}")
+        return len(self.completed)
+
+    def distribute(self):
+        """Envía los bloques y los reenvíos pedidos hasta que terminan los
+        receptores esperados o dejan de llegar NAKs"""
+        next_announce = 0
+        self.last_nak = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now >= next_announce:
+                announce = Message.announce(self.name, self.size, self.digest,
+                                            self.next_seq - 1)
+                send_message(announce, self.group_sock, self.group)
+                next_announce = now + ANNOUNCE_INTERVAL
+            if self.receivers and len(self.completed) >= self.receivers:
+                return
+            pending = self.repairs or self.next_seq <= self.chunks
+            if not pending and now - self.last_nak > self.linger:
+                if self.receivers:
+                    logger.error(f"Solo {len(self.completed)} de "
+                                 f"{self.receivers} receptores completaron "
+                                 f"la descarga.")
+                return
+            # Hay algo para enviar ya, o reenvíos que esperan más NAKs
+            ready = (self.next_repair(now) is not None or
+                     self.next_seq <= self.chunks)
+            # Mientras no se puede enviar se atienden los NAKs
+            if ready:
+                delay = self.bucket.delay(DATA_MAX_SIZE)
+            elif self.repairs:
+                delay = self.requested_at[next(iter(self.repairs))] + \
+                    REPAIR_WAIT - now
+            else:
+                delay = ANNOUNCE_INTERVAL
+            delay = min(max(0, delay), max(0, next_announce - now))
+            # select y no el timeout del socket: este redondea a
+            # milisegundos y limitaría la tasa a un bloque por milisegundo
+            if select.select([self.sock], [], [], delay)[0]:
+                self.receive()
+            if ready and not delay:
+                self.send_next()
+
+    def receive(self):
+        """Procesa un mensaje que ya llegó al socket"""
+        try:
+            message, address = recv_message(self.sock, 0)
+        except (BlockingIOError, ConnectionRefusedError):
+            # ConnectionRefusedError: un reenvío unicast a un receptor que
+            # ya no está
+            return
+        if message:
+            self.handle(message, address)
+
+    def handle(self, message, address):
+        """Procesa un NAK o el aviso de un receptor que completó el
+        archivo"""
+        if message.get_session_id() != self.session_id:
+            return
+        if message.get_type() == MessageType.NAK:
+            try:
+                ranges = message.get_nak_ranges()
+            except ValueError:
+                logger.debug(f"NAK mal formado de {address}")
+                return
+            self.stats.naks += 1
+            self.last_nak = time.monotonic()
+            # Solo se reenvía lo que ya se envió alguna vez
+            sent = self.next_seq - 1
+            for first, last in ranges:
+                for seq in range(max(1, first), min(last, sent) + 1):
+                    self.repairs.setdefault(seq, set()).add(address)
+                    self.requested_at.setdefault(seq, self.last_nak)
+        elif message.get_type() == MessageType.ACK_END:
+            if address not in self.completed:
+                self.completed.add(address)
+                self.stats.completed += 1
+                logger.info(f"El receptor {address} completó la descarga "
+                            f"({len(self.completed)})")
+
+    def next_repair(self, now):
+        """Devuelve el bloque pedido más antiguo si ya puede reenviarse, o
+        None. En modo 'auto' cada pedido espera REPAIR_WAIT a que lo pidan
+        los demás receptores"""
+        if not self.repairs:
+            return None
+        seq = next(iter(self.repairs))
+        if (self.repair == 'auto' and
+                now - self.requested_at[seq] < REPAIR_WAIT):
+            return None
+        return seq
+
+    def send_next(self):
+        """Envía el próximo reenvío pedido o, si no hay ninguno listo, el
+        próximo bloque"""
+        seq = self.next_repair(time.monotonic())
+        if seq is None:
+            self.send_chunk(self.next_seq, self.group_sock, self.group)
+            self.next_seq += 1
+            self.stats.sent += 1
+            return
+        addresses = self.repairs.pop(seq)
+        del self.requested_at[seq]
+        if self.repair == 'multicast' or (self.repair == 'auto' and
+                                          len(addresses) > 1):
+            if self.recently_repaired(seq):
+                return
+            self.send_chunk(seq, self.group_sock, self.group)
+            self.stats.multicast_repairs += 1
+            return
+        for address in addresses:
+            if self.recently_repaired((seq, address)):
+                continue
+            self.send_chunk(seq, SessionSocket(self.sock, self.session_id,
+                                               address), address)
+            self.stats.unicast_repairs += 1
+
+    def recently_repaired(self, key):
+        """Indica si el bloque se reenvió hace menos de REPAIR_HOLDOFF, y si
+        no registra el reenvío"""
+        now = time.monotonic()
+        if now - self.repaired_at.get(key, -REPAIR_HOLDOFF) < REPAIR_HOLDOFF:
+            return True
+        self.repaired_at[key] = now
+        return False
+
+    def send_chunk(self, seq, sock, address):
+        """Lee y envía el bloque seq (el primero es 1)"""
+        self.file.seek((seq - 1) * DATA_MAX_SIZE)
+        data = self.file.read(DATA_MAX_SIZE)
+        self.bucket.consume(len(data))
+        send_message(Message.data(seq, data), sock, address)
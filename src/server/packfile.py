@@ -0,0 +1,241 @@
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from utils.files import RandomAccessFile
+from utils.logger import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: un solo proceso escribe los packs
+    fcntl = None
+
+# Directorio, dentro del almacenamiento, con los packs y su índice
+PACKS_DIR = '.packs'
+INDEX_NAME = 'index'
+PACK_NAME = 'pack-{:06d}'
+# Un pack nuevo empieza cuando el actual superaría este tamaño
+PACK_MAX_SIZE = 1024 * 1024 * 1024
+
+# Registro del índice: número de pack, offset, longitud, mtime, MD5 y largo
+# del nombre, seguido del nombre en UTF-8. El índice solo crece: el último
+# registro de un nombre es el vigente
+INDEX_RECORD = struct.Struct("<IQQQ16sH")
+
+
+class PackEntry:
+    """Ubicación de un archivo dentro de los packs. Expone st_size y
+    st_mtime_ns como un os.stat_result"""
+    __slots__ = ('pack', 'offset', 'st_size', 'st_mtime_ns', 'digest')
+
+    def __init__(self, pack, offset, size, mtime_ns, digest):
+        self.pack = pack
+        self.offset = offset
+        self.st_size = size
+        self.st_mtime_ns = mtime_ns
+        self.digest = digest
+
+
+class PackedFile(RandomAccessFile):
+    """Archivo de solo lectura sobre una porción del mmap de un pack. Los
+    workers de descarga lo usan como a un archivo común"""
+    def __init__(self, data):
+        """
+        Inicializa el archivo
+
+        Args:
+            data: memoryview con el contenido
+        """
+        super().__init__(len(data))
+        self.data = data
+
+    def _read_at(self, offset, size):
+        return bytes(self.data[offset:offset + size])
+
+    def close(self):
+        """Libera la porción del mmap"""
+        if not self.closed:
+            self.data.release()
+        super().close()
+
+
+class PackStore:
+    """Almacenamiento de archivos chicos agregados al final de archivos pack
+    grandes: un archivo no ocupa un inodo ni una entrada de directorio. El
+    índice (nombre -> pack, offset, longitud, digest) se lee con mmap y se
+    mantiene en memoria, así que ubicar un archivo no toca el disco; las
+    descargas leen porciones del mmap del pack. Varios procesos pueden
+    agregar archivos: las escrituras se serializan con un lock sobre el
+    índice y cada proceso incorpora los registros ajenos al leerlo"""
+    def __init__(self, root):
+        """
+        Inicializa el almacén leyendo el índice existente
+
+        Args:
+            root: Directorio de almacenamiento del servidor
+        """
+        self.path = os.path.join(root, PACKS_DIR)
+        os.makedirs(self.path, exist_ok=True)
+        self.index_fd = os.open(os.path.join(self.path, INDEX_NAME),
+                                os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self.entries = dict[str, PackEntry]()
+        # Bytes del índice ya incorporados
+        self.index_end = 0
+        # mmap de lectura de cada pack
+        self.maps = dict[int, mmap.mmap]()
+        # Pack al que se agregan los archivos nuevos
+        self.write_pack = max([int(name.rsplit('-', 1)[1])
+                               for name in os.listdir(self.path)
+                               if name.startswith('pack-')] or [1])
+        # Descriptores de escritura: siguen abiertos aunque el pack se
+        # complete, puede haber un fsync en curso fuera del lock
+        self.write_fds = dict[int, int]()
+        self.lock = threading.Lock()
+        with self.lock:
+            self.refresh()
+        logger.debug(f"Packs: {len(self.entries)} archivos")
+
+    def pack_path(self, pack):
+        return os.path.join(self.path, PACK_NAME.format(pack))
+
+    def index_size(self):
+        """Tamaño actual del índice: cambia cuando cualquier proceso agrega
+        un archivo"""
+        return os.fstat(self.index_fd).st_size
+
+    def refresh(self):
+        """Incorpora los registros agregados desde la última lectura (por
+        este u otro proceso). Un registro a medio escribir se lee en la
+        próxima. Debe llamarse con el lock tomado"""
+        size = self.index_size()
+        if size <= self.index_end:
+            return
+        with mmap.mmap(self.index_fd, size, access=mmap.ACCESS_READ) as index:
+            position = self.index_end
+            while position + INDEX_RECORD.size <= size:
+                pack, offset, length, mtime_ns, digest, name_length = \
+                    INDEX_RECORD.unpack_from(index, position)
+                start = position + INDEX_RECORD.size
+                if start + name_length > size:
+                    break
+                name = bytes(index[start:start + name_length])
+                self.entries[name.decode('utf-8')] = PackEntry(
+                    pack, offset, length, mtime_ns, digest.hex())
+                position = start + name_length
+            self.index_end = position
+
+    def get(self, name):
+        """Devuelve la entrada del archivo, o None si no está empaquetado"""
+        with self.lock:
+            entry = self.entries.get(name)
+            if not entry:
+                # Otro proceso pudo haberlo agregado
+                self.refresh()
+                entry = self.entries.get(name)
+            return entry
+
+    def names(self):
+        """Devuelve las entradas de todos los archivos empaquetados"""
+        with self.lock:
+            self.refresh()
+            return list(self.entries.items())
+
+    def open(self, name):
+        """Abre un archivo empaquetado, o devuelve None si no existe"""
+        entry = self.get(name)
+        if not entry:
+            return None
+        if not entry.st_size:
+            # No se puede mapear un pack vacío
+            return PackedFile(memoryview(b''))
+        end = entry.offset + entry.st_size
+        with self.lock:
+            data = self.maps.get(entry.pack)
+            if data is None or len(data) < end:
+                # El pack creció desde que se mapeó. El mmap anterior se
+                # libera cuando se cierran las descargas que lo usan
+                fd = os.open(self.pack_path(entry.pack), os.O_RDONLY)
+                try:
+                    data = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+                finally:
+                    os.close(fd)
+                self.maps[entry.pack] = data
+        return PackedFile(memoryview(data)[entry.offset:end])
+
+    @contextmanager
+    def exclusive(self):
+        """Serializa las escrituras con los demás threads y procesos"""
+        with self.lock:
+            if fcntl:
+                fcntl.flock(self.index_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(self.index_fd, fcntl.LOCK_UN)
+
+    def writable_pack(self, size):
+        """Devuelve el número de pack donde entran size bytes más, su
+        descriptor y su tamaño actual"""
+        while True:
+            fd = self.write_fds.get(self.write_pack)
+            if fd is None:
+                fd = self.write_fds[self.write_pack] = os.open(
+                    self.pack_path(self.write_pack),
+                    os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            used = os.fstat(fd).st_size
+            if not used or used + size <= PACK_MAX_SIZE:
+                return self.write_pack, fd, used
+            # Otro proceso pudo haber empezado ya el siguiente
+            self.write_pack += 1
+
+    def append(self, members, sync, replace=False):
+        """Agrega archivos (nombre, contenido) a los packs. sync(fds) lleva
+        a disco los datos antes de escribir los registros del índice, y
+        después el índice. Sin replace se omiten los nombres que ya existen.
+        Devuelve los nombres agregados"""
+        with self.exclusive():
+            self.refresh()
+            members = [(name, data) for name, data in members
+                       if replace or name not in self.entries]
+            if not members:
+                return []
+            pack, fd, offset = self.writable_pack(
+                sum(len(data) for _, data in members))
+            records = []
+            for name, data in members:
+                write_all(fd, data)
+                encoded = name.encode('utf-8')
+                records.append(INDEX_RECORD.pack(
+                    pack, offset, len(data), time.time_ns(),
+                    hashlib.md5(data).digest(), len(encoded)) + encoded)
+                offset += len(data)
+        # Los datos se llevan a disco fuera del lock: el commit agrupado
+        # junta los de varias subidas
+        sync([fd])
+        with self.exclusive():
+            self.refresh()
+            if self.index_size() > self.index_end:
+                # Registro incompleto de un proceso que se detuvo a mitad
+                logger.error("Se descarta un registro incompleto del "
+                             "índice de packs.")
+                os.ftruncate(self.index_fd, self.index_end)
+            write_all(self.index_fd, b''.join(records))
+            self.refresh()
+        sync([self.index_fd])
+        return [name for name, _ in members]
+
+    def close(self):
+        for fd in self.write_fds.values():
+            os.close(fd)
+        os.close(self.index_fd)
+
+
+def write_all(fd, data):
+    """Escribe todos los datos en el descriptor"""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
@@ -0,0 +1,247 @@
+import socket
+import tempfile
+import threading
+import time
+from client.catalog_client import stat_file
+from client.session_mux import SessionMux
+from client.transfers import UploadJob, run_transfers
+from message.message import MessageType
+from utils.compression import NO_COMPRESSION
+from utils.delta import compute_delta
+from utils.logger import logger
+
+DEFAULT_REPLICATION_JOBS = 2
+# Intentos de replicar un archivo en un par antes de darlo por fallido
+MAX_REPLICATION_ATTEMPTS = 5
+# Espera tras una ronda con fallos antes de reintentar (segundos)
+RETRY_DELAY = 2
+
+
+class ReplicationStats:
+    """Contadores de la replicación y retraso de los archivos pendientes"""
+    def __init__(self):
+        self.replicated = 0
+        # Archivos que el par ya tenía con el mismo digest
+        self.up_to_date = 0
+        self.failed = 0
+        # Segundos entre la verificación de la subida y la confirmación del
+        # par
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        # (par, nombre) -> instante en que quedó pendiente
+        self.pending = dict[tuple, float]()
+        self.lock = threading.Lock()
+
+    def queued(self, peer, name):
+        with self.lock:
+            self.pending.setdefault((peer, name), time.monotonic())
+
+    def resolved(self, peer, name, outcome):
+        """Registra el resultado de un archivo pendiente: 'replicated',
+        'up_to_date' o 'failed'"""
+        with self.lock:
+            queued_at = self.pending.pop((peer, name), None)
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            if outcome != 'failed' and queued_at is not None:
+                self.last_lag = time.monotonic() - queued_at
+                self.max_lag = max(self.max_lag, self.last_lag)
+
+    def lag(self):
+        """Antigüedad del archivo pendiente más viejo: cuánto está atrasado
+        el par más atrasado"""
+        with self.lock:
+            if not self.pending:
+                return 0.0
+            return time.monotonic() - min(self.pending.values())
+
+    def __repr__(self):
+        return (f"ReplicationStats(replicated={self.replicated}, "
+                f"up_to_date={self.up_to_date}, failed={self.failed}, "
+                f"pending={len(self.pending)}, lag={self.lag():.3f}s, "
+                f"last_lag={self.last_lag:.3f}s, "
+                f"max_lag={self.max_lag:.3f}s)")
+
+
+class ReplicaJob(UploadJob):
+    """Subida de un archivo almacenado a un par. Se lee del almacenamiento,
+    así que sirve también para los archivos empaquetados. Si el par tiene
+    otra versión se envía como delta"""
+    def __init__(self, storage, name, digest, protocol, compression,
+                 delta=False):
+        super().__init__(name, name, protocol, compression, delta)
+        self.storage = storage
+        self.digest = digest
+
+    def __str__(self):
+        return f"réplica de {self.name}"
+
+    def run(self, mux, server_address, stop_event):
+        """Sube el archivo al par"""
+        file = self.storage.open(self.name)
+        if not file:
+            self.failed = True
+            return
+        try:
+            if self.delta:
+                signature = self.receive_signature(mux, server_address,
+                                                   stop_event)
+                if signature:
+                    with tempfile.TemporaryFile() as delta:
+                        _, delta_digest = compute_delta(file, signature,
+                                                        delta)
+                        delta.seek(0)
+                        self.send(mux, server_address, delta, delta_digest,
+                                  stop_event, self.digest)
+                    return
+                if signature is None:
+                    return
+            self.send(mux, server_address, file, self.digest, stop_event)
+        finally:
+            file.close()
+
+
+class PeerLink:
+    """Replicación hacia un par: un thread con su propio socket sube los
+    archivos pendientes por tandas, hasta concurrency a la vez"""
+    def __init__(self, address, storage, protocol, concurrency, stats,
+                 stop_event):
+        self.address = address
+        self.storage = storage
+        self.protocol = protocol
+        self.concurrency = concurrency
+        self.stats = stats
+        self.stop_event = stop_event
+        # nombre -> intentos fallidos
+        self.pending = dict[str, int]()
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run)
+
+    def __str__(self):
+        return f"{self.address[0]}:{self.address[1]}"
+
+    def enqueue(self, name):
+        with self.condition:
+            self.pending.setdefault(name, 0)
+            self.stats.queued(self.address, name)
+            self.condition.notify()
+
+    def take(self):
+        """Espera archivos pendientes y los devuelve todos"""
+        with self.condition:
+            while not self.pending and not self.stop_event.is_set():
+                self.condition.wait(RETRY_DELAY)
+            batch, self.pending = self.pending, {}
+            return batch
+
+    def run(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        mux = SessionMux(sock)
+        try:
+            while not self.stop_event.is_set():
+                batch = self.take()
+                if not batch:
+                    continue
+                failed = self.replicate(mux, batch)
+                if failed:
+                    self.retry(failed, batch)
+                    self.stop_event.wait(RETRY_DELAY)
+        finally:
+            sock.close()
+
+    def retry(self, failed, batch):
+        """Vuelve a encolar los archivos que fallaron, salvo los que ya
+        agotaron sus intentos"""
+        with self.condition:
+            for name in failed:
+                attempts = batch[name] + 1
+                if attempts >= MAX_REPLICATION_ATTEMPTS:
+                    logger.error(f"No se pudo replicar {name} en {self}.")
+                    self.stats.resolved(self.address, name, 'failed')
+                elif name not in self.pending:
+                    self.pending[name] = attempts
+
+    def remote_digest(self, mux, name):
+        """Digest del archivo en el par: "" si no lo tiene, None si no
+        responde"""
+        response = stat_file(mux, self.address, name)
+        if not response:
+            return None
+        if response.get_type() != MessageType.CATALOG:
+            return ""
+        entries = response.get_catalog_entries()
+        return entries[0][3] if entries else ""
+
+    def replicate(self, mux, batch):
+        """Sube al par los archivos que no tiene o tiene con otro digest y
+        comprueba que queden guardados. Devuelve los que fallaron"""
+        jobs = []
+        for name in batch:
+            if not self.storage.exists(name):
+                # Se reemplazó o se borró antes de replicarlo
+                self.stats.resolved(self.address, name, 'up_to_date')
+                continue
+            digest = self.storage.digest(name).result()
+            remote = self.remote_digest(mux, name)
+            if remote is None:
+                logger.error(f"El par {self} no responde.")
+                return list(batch)
+            if remote == digest:
+                self.stats.resolved(self.address, name, 'up_to_date')
+                continue
+            jobs.append(ReplicaJob(self.storage, name, digest, self.protocol,
+                                   NO_COMPRESSION, delta=bool(remote)))
+        if not jobs:
+            return []
+        logger.info(f"Replicando {len(jobs)} archivos en {self}")
+        run_transfers(mux, self.address, jobs, self.concurrency,
+                      self.stop_event)
+
+        failed = []
+        for job in jobs:
+            if self.remote_digest(mux, job.name) == job.digest:
+                self.stats.resolved(self.address, job.name, 'replicated')
+            else:
+                failed.append(job.name)
+        return failed
+
+
+class Replicator:
+    """Replica en los servidores pares cada archivo subido y verificado. La
+    subida usa el mismo protocolo que los clientes. Un par que ya tiene el
+    archivo con el mismo digest no lo recibe de nuevo, así que dos
+    servidores que se tienen como pares no se lo reenvían indefinidamente"""
+    def __init__(self, storage, peers, protocol,
+                 concurrency=DEFAULT_REPLICATION_JOBS):
+        """
+        Inicializa la replicación
+
+        Args:
+            storage: Almacenamiento del servidor
+            peers: Direcciones (host, port) de los pares
+            protocol: Protocolo de recuperación de errores
+            concurrency: Subidas simultáneas a cada par
+        """
+        self.stats = ReplicationStats()
+        self.stop_event = threading.Event()
+        self.links = [PeerLink(address, storage, protocol,
+                               max(1, concurrency), self.stats,
+                               self.stop_event)
+                      for address in peers]
+
+    def start(self):
+        for link in self.links:
+            link.thread.start()
+
+    def enqueue(self, name):
+        """Agenda la replicación de un archivo en todos los pares"""
+        for link in self.links:
+            link.enqueue(name)
+
+    def stop(self):
+        """Detiene la replicación; lo pendiente se descarta"""
+        self.stop_event.set()
+        for link in self.links:
+            with link.condition:
+                link.condition.notify()
+        for link in self.links:
+            link.thread.join()
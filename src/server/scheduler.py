@@ -0,0 +1,112 @@
+import heapq
+import itertools
+import time
+
+# Tiempo máximo que se le pide a un cliente esperar antes de reintentar
+MAX_RETRY_AFTER = 5.0
+# Espera sugerida por cada transferencia delante en la cola (segundos)
+RETRY_AFTER_PER_POSITION = 0.5
+# Un pedido en espera se descarta si el cliente deja de reintentarlo
+PENDING_TIMEOUT = 3 * MAX_RETRY_AFTER
+
+
+class PendingTransfer:
+    """Pedido de UPLOAD o DOWNLOAD que espera un lugar para empezar"""
+    def __init__(self, key, message, address, size):
+        """
+        Inicializa el pedido
+
+        Args:
+            key: Clave de la sesión del cliente
+            message: Mensaje UPLOAD o DOWNLOAD recibido
+            address: Tupla (host, port) del cliente
+            size: Tamaño del archivo a transferir, para el scheduling
+        """
+        self.key = key
+        self.message = message
+        self.address = address
+        self.size = size
+        self.last_seen = time.time()
+
+    def refresh(self, address):
+        """Registra un reintento del cliente"""
+        self.address = address
+        self.last_seen = time.time()
+
+    def is_timeout(self):
+        """Comprueba si el cliente dejó de reintentar el pedido"""
+        return time.time() - self.last_seen > PENDING_TIMEOUT
+
+
+class FifoScheduler:
+    """Cola de espera que atiende los pedidos por orden de llegada"""
+    def __init__(self):
+        self.pending = dict()
+        self.heap = []
+        self.counter = itertools.count()
+
+    def priority(self, transfer, order):
+        """Prioridad del pedido: menor se atiende antes"""
+        return (order,)
+
+    def push(self, transfer):
+        """Encola un pedido"""
+        order = next(self.counter)
+        self.pending[transfer.key] = transfer
+        heapq.heappush(self.heap,
+                       (self.priority(transfer, order), order, transfer))
+
+    def pop(self):
+        """Desencola el próximo pedido a atender, o None si no hay"""
+        while self.heap:
+            _, _, transfer = heapq.heappop(self.heap)
+            if self.pending.get(transfer.key) is transfer:
+                del self.pending[transfer.key]
+                return transfer
+        return None
+
+    def get(self, key):
+        """Devuelve el pedido en espera de la sesión, o None"""
+        return self.pending.get(key)
+
+    def position(self, key):
+        """Posición del pedido en la cola, empezando en 1"""
+        transfer = self.pending.get(key)
+        ranking = sorted(entry for entry in self.heap
+                         if self.pending.get(entry[2].key) is entry[2])
+        for position, entry in enumerate(ranking, 1):
+            if entry[2] is transfer:
+                return position
+        return 0
+
+    def expire(self):
+        """Descarta los pedidos que el cliente abandonó. Devuelve cuántos"""
+        expired = [key for key, transfer in self.pending.items()
+                   if transfer.is_timeout()]
+        for key in expired:
+            del self.pending[key]
+        return len(expired)
+
+    def __len__(self):
+        return len(self.pending)
+
+
+class SmallestFirstScheduler(FifoScheduler):
+    """Cola de espera que atiende primero los archivos más chicos (a igual
+    tamaño, por orden de llegada)"""
+    def priority(self, transfer, order):
+        return (transfer.size, order)
+
+
+SCHEDULERS = {
+    'fifo': FifoScheduler,
+    'smallest': SmallestFirstScheduler,
+}
+
+
+def retry_after(position):
+    """Tiempo que se le sugiere esperar a un cliente en la posición dada de
+    la cola (0 si no pudo encolarse)"""
+    if not position:
+        return MAX_RETRY_AFTER
+    return min(MAX_RETRY_AFTER, RETRY_AFTER_PER_POSITION * position)
@@ -6,7 +6,8 @@ class Client:
     """Clase para manejar la conexión con un cliente"""
     def __init__(self, address,
                  worker, messages_queue,
-                 stop_event, timeout=30):
+                 stop_event, timeout=30, sock=None, transfer_socket=None,
+                 egress_flow=None):
         """
         Inicializa un cliente
         Args:
@@ -15,6 +16,10 @@ class Client:
             messages_queue: Cola para los mensajes recibidos
             stop_event: Evento para detener el worker
             timeout: Tiempo máximo de inactividad antes de desconectar
+            sock: SessionSocket con el que el worker responde al cliente
+            transfer_socket: TransferSocket propio de la transferencia, si
+                el servidor usa un socket conectado por cliente
+            egress_flow: EgressFlow por el que salen las respuestas
         """
         self.address = address
         self.worker = worker
@@ -22,16 +27,37 @@ class Client:
         self.stop_event = stop_event
         self.last_activity = time.time()
         self.timeout = timeout
+        self.sock = sock
+        self.transfer_socket = transfer_socket
+        self.egress_flow = egress_flow
 
     def run(self):
         """Inicia el worker del cliente"""
+        if self.transfer_socket:
+            self.transfer_socket.start()
         self.worker.start()
 
+    def update_address(self, address):
+        """Actualiza la dirección del cliente (p. ej. tras un rebinding de
+        NAT) para que las respuestas le sigan llegando"""
+        self.address = address
+        if self.sock:
+            self.sock.update_address(address)
+        if self.transfer_socket:
+            self.transfer_socket.update_address(address)
+
     def add_message(self, message):
         """Añade un mensaje a la cola"""
         self.messages_queue.put(message)
         self.last_activity = time.time()
 
+    def close(self):
+        """Libera los recursos del cliente una vez terminado su flujo"""
+        if self.transfer_socket:
+            self.transfer_socket.close()
+        if self.egress_flow:
+            self.egress_flow.close()
+
     def is_alive(self):
         """Comprueba si el worker sigue vivo"""
         return self.worker.is_alive()
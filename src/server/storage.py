@@ -0,0 +1,450 @@
+import hashlib
+import os
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from server.file_lock import (
+    create_for_upload, open_for_download, remove_if_abandoned
+)
+from server.packfile import PACKS_DIR, PackStore
+from utils.digest import submit_file_md5
+from utils.logger import logger
+
+# Políticas de durabilidad de las subidas: sin fsync, fsync de cada archivo
+# al completarse, o fsync agrupado de todas las subidas que terminan en el
+# mismo intervalo
+FSYNC_NONE = 'none'
+FSYNC_COMPLETE = 'complete'
+FSYNC_GROUP = 'group'
+FSYNC_POLICIES = [FSYNC_NONE, FSYNC_COMPLETE, FSYNC_GROUP]
+DEFAULT_FSYNC_POLICY = FSYNC_NONE
+DEFAULT_GROUP_COMMIT_INTERVAL = 0.01
+
+# Bytes que una subida puede tener pendientes de escribir antes de que el
+# protocolo espere al writer (contrapresión)
+MAX_PENDING_BYTES = 4 * 1024 * 1024
+# Caracteres hexadecimales del hash del nombre por nivel de subdirectorio
+SHARD_WIDTH = 2
+# Sufijo del archivo en el que se recibe una subida hasta publicarla
+PARTIAL_SUFFIX = ".part"
+# Cada cuánto se vuelve a recorrer un almacenamiento particionado que
+# comparten varios procesos
+SHARDED_RESCAN_INTERVAL = 5
+
+
+class StorageFile:
+    """Archivo que se está recibiendo. Las escrituras se encolan al thread
+    writer del almacenamiento y el protocolo sigue sin esperar al disco.
+    Las subidas se escriben en un temporal oculto que se publica con su
+    nombre final (o se agrega a los packs) recién al completarse"""
+    def __init__(self, storage, file, path, final_path=None, packed=False):
+        """
+        Inicializa el archivo
+
+        Args:
+            storage: Storage al que pertenece
+            file: Archivo abierto para escritura
+            path: Ruta del archivo abierto
+            final_path: Ruta con la que se publica (None para temporales)
+            packed: Si se publica agregándolo a los packs
+        """
+        self.storage = storage
+        self.file = file
+        self.path = path
+        self.final_path = final_path
+        self.packed = packed
+        self.pending_bytes = 0
+        self.error = None
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def write(self, data):
+        """Encola datos para escribir, esperando si hay demasiados
+        pendientes"""
+        if not data:
+            return 0
+        with self.condition:
+            while (self.pending_bytes > MAX_PENDING_BYTES and
+                   not self.error):
+                self.condition.wait()
+            self.raise_error()
+            self.pending_bytes += len(data)
+        self.storage.writer.put((self, data))
+        return len(data)
+
+    def written(self, size, error=None):
+        """Lo llama el writer tras escribir un bloque"""
+        with self.condition:
+            self.pending_bytes -= size
+            self.error = self.error or error
+            self.condition.notify_all()
+
+    def raise_error(self):
+        if self.error:
+            raise OSError(f"Error escribiendo {self.path}: {self.error}")
+
+    def flush(self):
+        """Espera a que el writer haya escrito todo lo encolado"""
+        with self.condition:
+            while self.pending_bytes:
+                self.condition.wait()
+            self.raise_error()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def free_space(self):
+        """Bytes que todavía pueden encolarse sin esperar al writer"""
+        return max(0, MAX_PENDING_BYTES - self.pending_bytes)
+
+    def publish(self):
+        """Publica el archivo con su nombre final según la política de
+        durabilidad. Devuelve False si no se pudo"""
+        return bool(self.storage.publish([self]))
+
+    def link(self):
+        """Da al archivo su nombre final. El lock sigue tomado hasta el
+        cierre, así que todavía no puede descargarse. Devuelve False si el
+        nombre ya existe"""
+        try:
+            # link no reemplaza un archivo existente, a diferencia de rename
+            os.link(self.path, self.final_path)
+        except FileExistsError:
+            logger.error(f"El archivo {self.final_path} ya existe.")
+            return False
+        os.unlink(self.path)
+        self.path = self.final_path
+        return True
+
+    def close(self):
+        """Espera las escrituras pendientes y cierra el archivo"""
+        if self.closed:
+            return
+        self.closed = True
+        with self.condition:
+            while self.pending_bytes:
+                self.condition.wait()
+        self.file.close()
+
+
+class StorageWriter:
+    """Thread que hace las escrituras de todas las subidas del proceso y los
+    fsync agrupados"""
+    def __init__(self, group_interval):
+        self.requests = queue.Queue()
+        self.group_interval = group_interval
+        # fsync pedidos para la próxima tanda: descriptor -> eventos
+        self.pending_syncs = dict[int, list]()
+        self.next_group_commit = None
+        # Detenido el thread, quien escribe lo hace directamente
+        self.stopped = False
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """Termina lo encolado y detiene el thread. Las transferencias que
+        siguen después escriben sin diferir"""
+        with self.lock:
+            self.stopped = True
+            self.requests.put(None)
+        self.thread.join()
+
+    def put(self, request):
+        with self.lock:
+            if not self.stopped:
+                self.requests.put(request)
+                return
+        self.write(*request)
+
+    def request_sync(self, fd, event):
+        """Pide un fsync en la próxima tanda"""
+        with self.lock:
+            if not self.stopped:
+                self.requests.put((fd, event))
+                return
+        os.fsync(fd)
+        event.set()
+
+    def run(self):
+        while True:
+            timeout = None
+            if self.next_group_commit is not None:
+                timeout = max(0, self.next_group_commit - time.monotonic())
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                request = ()
+            if request is None:
+                self.group_commit()
+                return
+            if len(request) == 2 and isinstance(request[0], StorageFile):
+                self.write(*request)
+            elif request:
+                fd, event = request
+                self.pending_syncs.setdefault(fd, []).append(event)
+                if self.next_group_commit is None:
+                    self.next_group_commit = (time.monotonic() +
+                                              self.group_interval)
+            if (self.next_group_commit is not None and
+                    time.monotonic() >= self.next_group_commit):
+                self.group_commit()
+
+    def write(self, storage_file, data):
+        error = None
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(storage_file.fileno(), view):]
+        except OSError as e:
+            error = e
+        storage_file.written(len(data), error)
+
+    def group_commit(self):
+        """Hace un fsync por descriptor pedido y despierta a quienes
+        esperaban"""
+        syncs, self.pending_syncs = self.pending_syncs, {}
+        self.next_group_commit = None
+        for fd, events in syncs.items():
+            try:
+                os.fsync(fd)
+            except OSError as e:
+                logger.error(f"Falló el fsync: {e}")
+            for event in events:
+                event.set()
+        if syncs:
+            logger.debug(f"Commit agrupado de {len(syncs)} descriptores")
+
+
+class Storage:
+    """Almacenamiento de los archivos del servidor. Decide dónde vive cada
+    nombre (directamente en la raíz o particionado en subdirectorios según
+    el hash del nombre, para directorios con millones de archivos), recibe
+    las subidas con escrituras diferidas en un thread propio y las publica
+    con la política de durabilidad configurada. Opcionalmente los archivos
+    chicos se guardan en packs (ver PackStore)"""
+    def __init__(self, root, shard_depth=0, fsync_policy=DEFAULT_FSYNC_POLICY,
+                 group_interval=DEFAULT_GROUP_COMMIT_INTERVAL,
+                 pack_threshold=0):
+        """
+        Inicializa el almacenamiento
+
+        Args:
+            root: Directorio de almacenamiento
+            shard_depth: Niveles de subdirectorios (0: todo en la raíz)
+            fsync_policy: Una de FSYNC_POLICIES
+            group_interval: Segundos que se acumulan los fsync agrupados
+            pack_threshold: Tamaño máximo de las subidas que se guardan en
+                packs (0: ninguna)
+        """
+        self.root = root
+        self.shard_depth = shard_depth
+        self.fsync_policy = fsync_policy
+        self.writer = StorageWriter(group_interval)
+        self.pack_threshold = pack_threshold
+        # Los packs existentes se leen aunque no se agreguen archivos nuevos
+        self.packs = None
+        if pack_threshold or os.path.isdir(os.path.join(root, PACKS_DIR)):
+            self.packs = PackStore(root)
+
+    def start(self):
+        self.writer.start()
+
+    def stop(self):
+        self.writer.stop()
+        if self.packs:
+            self.packs.close()
+
+    def directory(self, name):
+        """Directorio donde vive el archivo"""
+        if not self.shard_depth:
+            return self.root
+        digest = hashlib.md5(name.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, *[
+            digest[level * SHARD_WIDTH:(level + 1) * SHARD_WIDTH]
+            for level in range(self.shard_depth)])
+
+    def path(self, name, create=False):
+        """Ruta del archivo; con create se crea su directorio si falta"""
+        directory = self.directory(name)
+        if create:
+            os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, name)
+
+    def entries(self):
+        """Recorre los archivos del almacenamiento, sin los ocultos.
+        Devuelve (nombre, stat, digest), con el digest solo si se conoce
+        sin leer el archivo"""
+        directories = [(self.root, 0)]
+        while directories:
+            directory, level = directories.pop()
+            with os.scandir(directory) as items:
+                for item in items:
+                    if item.name.startswith('.'):
+                        continue
+                    if level < self.shard_depth:
+                        if item.is_dir():
+                            directories.append((item.path, level + 1))
+                    elif item.is_file():
+                        yield item.name, item.stat(), None
+        if self.packs:
+            for name, entry in self.packs.names():
+                yield name, entry, entry.digest
+
+    def version(self):
+        """Valor que cambia cuando se agregan archivos (salvo en
+        subdirectorios de particiones, ver rescan_interval)"""
+        return (os.stat(self.root).st_mtime_ns,
+                self.packs.index_size() if self.packs else 0)
+
+    def packed(self, name):
+        """Devuelve la entrada del archivo en los packs, o None"""
+        return self.packs.get(name) if self.packs else None
+
+    def stat(self, name):
+        """Tamaño y mtime del archivo (st_size, st_mtime_ns). Lanza
+        FileNotFoundError si no existe"""
+        return self.packed(name) or os.stat(self.path(name))
+
+    def exists(self, name):
+        return bool(self.packed(name)) or os.path.exists(self.path(name))
+
+    def open(self, name):
+        """Abre el archivo para descargarlo. Devuelve None si no existe o
+        si todavía se está subiendo"""
+        if self.packed(name):
+            return self.packs.open(name)
+        return open_for_download(self.path(name))
+
+    def known_digest(self, name):
+        """MD5 del archivo si se conoce sin leerlo (los empaquetados), o
+        None"""
+        entry = self.packed(name)
+        return entry.digest if entry else None
+
+    def digest(self, name):
+        """Future con el MD5 del archivo: inmediato si se conoce y si no
+        calculado en el pool de digests"""
+        digest = self.known_digest(name)
+        if not digest:
+            return submit_file_md5(self.path(name))
+        future = Future()
+        future.set_result(digest)
+        return future
+
+    def replace(self, name, path):
+        """Reemplaza el contenido de un archivo existente por el de path
+        (por ejemplo tras aplicar un delta). Las descargas en curso siguen
+        leyendo la versión anterior"""
+        if not self.packed(name):
+            os.replace(path, self.path(name))
+            return
+        # Un archivo empaquetado sigue en los packs: el registro nuevo
+        # reemplaza al anterior
+        with open(path, "rb") as file:
+            self.packs.append([(name, file.read())], self.sync, replace=True)
+        os.remove(path)
+
+    def rescan_interval(self):
+        """Con particiones el mtime de la raíz no refleja los archivos
+        nuevos: los catálogos compartidos se recorren periódicamente"""
+        return SHARDED_RESCAN_INTERVAL if self.shard_depth else None
+
+    def create_upload(self, name, size=None):
+        """Reclama el nombre para una subida de size bytes y devuelve el
+        archivo donde se recibe. Lanza FileExistsError si el archivo ya
+        existe o si otra subida (de este u otro proceso) lo está
+        recibiendo"""
+        final_path = self.path(name, create=True)
+        if self.exists(name):
+            raise FileExistsError(final_path)
+        directory, base = os.path.split(final_path)
+        partial_path = os.path.join(directory, f".{base}{PARTIAL_SUFFIX}")
+        try:
+            file = create_for_upload(partial_path)
+        except FileExistsError:
+            # Puede ser el resto de un servidor que se detuvo a mitad de
+            # una subida
+            if not remove_if_abandoned(partial_path):
+                raise
+            file = create_for_upload(partial_path)
+        packed = bool(self.packs and size is not None and
+                      size <= self.pack_threshold)
+        return StorageFile(self, file, partial_path, final_path, packed)
+
+    def create_temp(self, directory=None, prefix=".", suffix=""):
+        """Crea un temporal oculto para recibir datos que después se
+        procesan (deltas, bundles)"""
+        fd, path = tempfile.mkstemp(prefix=prefix, suffix=suffix,
+                                    dir=directory or self.root)
+        return StorageFile(self, os.fdopen(fd, "wb"), path)
+
+    def publish(self, files):
+        """Publica archivos recibidos completos: espera sus escrituras, los
+        lleva a disco según la política, les da su nombre final y lleva a
+        disco los directorios. Todo el grupo comparte cada espera. Devuelve
+        los archivos publicados"""
+        written = []
+        for file in files:
+            try:
+                file.flush()
+                written.append(file)
+            except OSError as e:
+                logger.error(str(e))
+        loose = [file for file in written if not file.packed]
+        self.sync([file.fileno() for file in loose])
+        published = [file for file in loose if file.link()]
+        self.sync_directories({os.path.dirname(file.path)
+                               for file in published})
+        packed = [file for file in written if file.packed]
+        if packed:
+            published += self.publish_packed(packed)
+        return published
+
+    def publish_packed(self, files):
+        """Agrega a los packs los archivos recibidos, todos con una sola
+        escritura del índice, y borra sus temporales"""
+        members = []
+        for file in files:
+            with open(file.path, "rb") as received:
+                members.append((os.path.basename(file.final_path),
+                                received.read()))
+        appended = set(self.packs.append(members, self.sync))
+        published = []
+        for file, (name, _) in zip(files, members):
+            if name not in appended:
+                logger.error(f"El archivo {name} ya existe.")
+                continue
+            os.unlink(file.path)
+            file.path = file.final_path
+            published.append(file)
+        return published
+
+    def sync(self, fds):
+        """fsync de los descriptores según la política"""
+        if self.fsync_policy == FSYNC_COMPLETE:
+            for fd in fds:
+                os.fsync(fd)
+        elif self.fsync_policy == FSYNC_GROUP:
+            events = []
+            for fd in fds:
+                events.append(threading.Event())
+                self.writer.request_sync(fd, events[-1])
+            for event in events:
+                event.wait()
+
+    def sync_directories(self, directories):
+        """fsync de los directorios para que las publicaciones sobrevivan a
+        una caída"""
+        if self.fsync_policy == FSYNC_NONE or os.name == 'nt':
+            return
+        fds = [os.open(directory, os.O_RDONLY) for directory in directories]
+        try:
+            self.sync(fds)
+        finally:
+            for fd in fds:
+                os.close(fd)
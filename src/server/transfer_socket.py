@@ -0,0 +1,67 @@
+import socket
+from threading import Event, Thread
+from message.message import TOTAL_BYTES_LENGTH, Message
+from utils.logger import logger
+
+# Cada cuánto el thread receptor revisa si el socket se cerró (segundos)
+RECEIVE_POLL_INTERVAL = 0.2
+
+
+class TransferSocket:
+    """Socket UDP propio de una transferencia, en un puerto efímero y
+    conectado al cliente: el kernel entrega los datagramas del cliente
+    directamente a este socket, sin pasar por el loop principal. El cliente
+    pasa a usarlo al recibir la primera respuesta desde el nuevo puerto"""
+    def __init__(self, host, client_address, on_message):
+        """
+        Crea el socket y lo conecta al cliente
+
+        Args:
+            host: Dirección IP local en la que escuchar
+            client_address: Tupla (host, port) del cliente
+            on_message: Función que recibe cada mensaje del cliente
+        """
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, 0))
+        self.sock.connect(client_address)
+        self.sock.settimeout(RECEIVE_POLL_INTERVAL)
+        self.on_message = on_message
+        self.closed = Event()
+        self.thread = Thread(target=self.receive, daemon=True)
+
+    def start(self):
+        """Inicia el thread que recibe los mensajes del cliente"""
+        self.thread.start()
+
+    def get_port(self):
+        """Devuelve el puerto efímero asignado"""
+        return self.sock.getsockname()[1]
+
+    def update_address(self, address):
+        """Vuelve a conectar el socket si el cliente cambió de dirección"""
+        try:
+            self.sock.connect(address)
+        except OSError as e:
+            logger.error(f"No se pudo reconectar el socket a {address}: {e}")
+
+    def receive(self):
+        """Recibe los mensajes del cliente hasta que se cierre el socket"""
+        while not self.closed.is_set():
+            try:
+                raw_message = self.sock.recv(TOTAL_BYTES_LENGTH)
+            except TimeoutError:
+                continue
+            except OSError:
+                # El cliente ya cerró (ICMP port unreachable) o el socket
+                # se cerró: se sigue hasta que lo indique close()
+                continue
+            try:
+                self.on_message(Message.from_bytes(raw_message))
+            except ValueError as e:
+                logger.debug(f"Mensaje inválido descartado: {e}")
+
+    def close(self):
+        """Detiene el thread receptor y cierra el socket"""
+        self.closed.set()
+        self.thread.join(2 * RECEIVE_POLL_INTERVAL)
+        self.sock.close()
@@ -3,17 +3,21 @@ from datetime import datetime, timedelta
 from message.message import (
     TOTAL_BYTES_LENGTH, DATA_MAX_SIZE, Message, MessageType
 )
-from message.utils import show_info, send_message
+from message.utils import show_info, send_message, get_message_from_queue
 from utils.protocol_utils import (
     end_send_protocol_download_sr,
     read_file,
+    send_tail_loss_probe,
     init_window,
     has_errors,
     send_error_message,
     send_first_ack_download_message,
     send_first_upload_message
 )
+from utils.flow_control import PeerWindow
+from utils.compression import chunk_codec
 from utils.logger import logger
+from utils.rtt import RttEstimator, TailLossProbe
 
 
 def download_sr_server(initial_message: Message, socket, address,
@@ -30,8 +34,13 @@ def download_sr_server(initial_message: Message, socket, address,
             initial_message, socket, address, message_queue, stop_event,
             MessageType.UPLOAD)
     elif initial_message.get_type() == MessageType.ACK_DOWNLOAD:
-        first_message_recv = send_first_ack_download_message(
-            initial_message, socket, address, message_queue, stop_event)
+        if initial_message.get_early_data():
+            # Archivo chico: el bloque 0 viaja en el ACK_DOWNLOAD y el ACK 0
+            # del cliente confirma a la vez el inicio y ese bloque
+            first_message_recv = initial_message
+        else:
+            first_message_recv = send_first_ack_download_message(
+                initial_message, socket, address, message_queue, stop_event)
 
     if has_errors(first_message_recv, initial_message):
         return
@@ -40,9 +49,19 @@ def download_sr_server(initial_message: Message, socket, address,
         initial_message)
     acknowledgements = [False] * package_to_send_size
     sended_messages = [None] * package_to_send_size
+    codec = chunk_codec(initial_message.get_compression())
     received_acknowledgements = 0
     logger.debug(f"Packages to send: {package_to_send_size} and window_base "
                  f"{window_base} and window_top {window_top}")
+    rtt = RttEstimator()
+    tlp = TailLossProbe(rtt)
+    peer_window = PeerWindow(rtt)
+
+    if first_message_recv is initial_message:
+        sended_messages[0] = initial_message
+        send_message(initial_message, socket, address, 1.5)
+        peer_window.packet_sent()
+        tlp.arm()
 
     next_update = datetime.now() + timedelta(seconds=1)
     while received_acknowledgements < package_to_send_size:
@@ -53,24 +72,34 @@ def download_sr_server(initial_message: Message, socket, address,
             return
         # send window
         for i in range(window_base, window_top):
-            if (not sended_messages[i] and not acknowledgements[i]):
+            if (not sended_messages[i] and not acknowledgements[i] and
+                    peer_window.can_send()):
                 logger.debug(f"i : {i} and {acknowledgements[i]}")
-                sended_messages[i] = Message.data(i, read_file(
-                    file, DATA_MAX_SIZE, i))
+                sended_messages[i] = Message.data(i, codec.encode(
+                    read_file(file, DATA_MAX_SIZE, i)))
                 send_message(sended_messages[i], socket, address, 1.5)
+                peer_window.packet_sent()
+                if tlp.deadline is None:
+                    tlp.arm()
             if (sended_messages[i] and sended_messages[i].is_timeout() and
                     not acknowledgements[i]):
                 send_message(sended_messages[i], socket, address, 1.5)
+        send_tail_loss_probe(tlp, sended_messages, acknowledgements,
+                             window_base, window_top, socket, address)
 
-        message = (message_queue.get(False) if not message_queue.empty()
-                   else None)
+        message = get_message_from_queue(message_queue)
         if message:
             if message.get_type() == MessageType.ACK:
                 seqNumber = message.get_seq_number()
                 logger.debug(f"Received ack {seqNumber}")
+                peer_window.update(message)
                 if not acknowledgements[seqNumber]:
                     acknowledgements[seqNumber] = True
                     received_acknowledgements += 1
+                    if sended_messages[seqNumber]:
+                        peer_window.packet_acked()
+                    rtt.on_ack(sended_messages[seqNumber])
+                    tlp.reset()
 
                     # move window
                     while acknowledgements[window_base]:
@@ -80,9 +109,14 @@ def download_sr_server(initial_message: Message, socket, address,
                                 window_top += 1
                         else:
                             break
+            elif (message.get_type() == MessageType.DOWNLOAD and
+                  sended_messages[0] is initial_message and
+                  not acknowledgements[0]):
+                # Se perdió el ACK_DOWNLOAD con el bloque 0
+                send_message(initial_message, socket, address, 1.5)
             elif message.get_type() == MessageType.ERROR:
                 logger.error(f"Error enviando datos -- {message.getErrorCode}")
                 return
     logger.info("El archivo se ha enviado correctamente.")
     end_send_protocol_download_sr(message_queue, socket, address, stop_event,
-                                  md5_digest)
+                                  md5_digest, rtt)
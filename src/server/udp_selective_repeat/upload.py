@@ -1,11 +1,13 @@
 from datetime import datetime, timedelta
-import hashlib
 import os
 import threading
 
-from message.message import TOTAL_BYTES_LENGTH, Message, MessageType
-from message.utils import send_ack, show_info
+from message.message import (
+    TOTAL_BYTES_LENGTH, ErrorCode, Message, MessageType
+)
+from message.utils import send_ack, show_info, get_message_from_queue
 from utils.protocol_utils import (
+    abort_on_invalid_data,
     end_recv_protocol_on_error,
     send_first_ack_message,
     init_window,
@@ -15,14 +17,29 @@ from utils.protocol_utils import (
     end_recv_protocol,
     recv_data_message
 )
+from utils.digest import submit_file_md5
+from utils.compression import chunk_codec
 from utils.logger import logger
 
 
 def upload_sr_server(initial_message: Message, socket, address, message_queue,
-                     file, filename, msg_md5_digest, stop_event):
+                     file, filename, msg_md5_digest, stop_event,
+                     commit=None):
+    """Recibe un archivo con Selective Repeat. Si se indica commit, se
+    llama con el archivo recibido íntegro para completarlo (por ejemplo,
+    aplicar un delta) e indica si la subida terminó bien"""
     start_time = datetime.now()
     logger.debug(f"El mensaje al entrar es : {initial_message}")
 
+    # El bloque 0 adjunto al UPLOAD se decodifica antes de confirmarlo
+    early_data = initial_message.get_early_data()
+    if early_data:
+        try:
+            chunk_codec(initial_message.get_compression()).decode(early_data)
+        except ValueError as e:
+            logger.error(f"Bloque adjunto al UPLOAD inválido: {e}")
+            initial_message = Message.error(ErrorCode.INVALID_REQUEST)
+
     first_message_recv = None
     if initial_message.get_type() == MessageType.ERROR:
         first_message_recv = send_error_message(
@@ -32,11 +49,17 @@ def upload_sr_server(initial_message: Message, socket, address, message_queue,
         first_message_recv, initial_message = send_first_download_message(
             initial_message, socket, address, message_queue, stop_event)
     elif initial_message.get_type() == MessageType.UPLOAD:
-        first_message_recv = send_first_ack_message(Message.ack(
-            initial_message.get_seq_number()), socket, address, message_queue,
-            stop_event)
+        # Si el UPLOAD trae el bloque 0 se confirma con ACK_UPLOAD (0-RTT)
+        ack_message = (Message.ack_upload(initial_message.get_seq_number())
+                       if initial_message.get_early_data()
+                       else Message.ack(initial_message.get_seq_number()))
+        first_message_recv = send_first_ack_message(
+            ack_message, socket, address, message_queue, stop_event)
 
     if has_errors(first_message_recv, initial_message):
+        if file:
+            file.close()
+            os.unlink(filename)
         return
 
     # Inicializo ventana
@@ -45,13 +68,15 @@ def upload_sr_server(initial_message: Message, socket, address, message_queue,
     received_messages = [False] * package_to_receive_size
     received_data = [''] * package_to_receive_size
     received_packages = 0
+    # Compresión negociada en el UPLOAD o elegida en el ACK_DOWNLOAD
+    codec = chunk_codec(initial_message.get_compression())
     logger.debug(f"Window_base {window_base} and window_top {window_top}")
 
-    if first_message_recv.get_type() == MessageType.DATA:
-        window_base, window_top, received_packages = recv_data_message(
-            first_message_recv, socket, address, received_messages,
-            received_data, package_to_receive_size, window_base, window_top,
-            received_packages, file)
+    # El bloque adjunto y la respuesta al ACK inicial se procesan como los
+    # mensajes que siguen
+    pending_messages = [first_message_recv]
+    if early_data:
+        pending_messages.insert(0, Message.data(0, early_data))
 
     next_update = datetime.now() + timedelta(seconds=1)
     timeout = datetime.now() + timedelta(seconds=15)
@@ -63,26 +88,37 @@ def upload_sr_server(initial_message: Message, socket, address, message_queue,
             os.unlink(filename)
             return
 
-        message = (message_queue.get(False) if not message_queue.empty()
-                   else None)
+        message = (pending_messages.pop(0) if pending_messages
+                   else get_message_from_queue(message_queue))
         if message:
             timeout = datetime.now() + timedelta(seconds=15)
             if message.get_type() == MessageType.DATA:
-                window_base, window_top, received_packages = recv_data_message(
-                    message, socket, address, received_messages, received_data,
-                    package_to_receive_size, window_base, window_top,
-                    received_packages, file)
+                try:
+                    window_base, window_top, received_packages = \
+                        recv_data_message(
+                            message, socket, address, received_messages,
+                            received_data, package_to_receive_size,
+                            window_base, window_top, received_packages, file,
+                            codec)
+                except ValueError as e:
+                    abort_on_invalid_data(e, socket, address, message_queue,
+                                          stop_event)
+                    file.close()
+                    os.unlink(filename)
+                    return
             elif message.get_type() == MessageType.END:
                 file.flush()  # Sin esto rompe el md5
 
-                file_read_for_digest: bytes
-                with open(filename, 'rb') as file_read_for_digest:
-                    file_read_for_digest = file_read_for_digest.read()
-                final_md5_digest = hashlib.md5(
-                    file_read_for_digest).hexdigest()
+                final_md5_digest = submit_file_md5(filename).result()
+                integro = final_md5_digest == msg_md5_digest
+                if integro and commit:
+                    integro = commit(filename)
 
-                if final_md5_digest == msg_md5_digest:
+                if integro:
                     logger.debug("archivo recibido integramente")
+                    # Liberar el lock antes del cierre: el archivo ya puede
+                    # descargarse aunque se demore el último ACK
+                    file.close()
                     end_recv_protocol(message_queue, message, socket, address,
                                       stop_event)
                 else:
@@ -98,3 +134,15 @@ def upload_sr_server(initial_message: Message, socket, address, message_queue,
     logger.error(f"Timeout. Archivo temporal borrado. Conexion cerrada para \
                  {threading.get_native_id()}")
     os.unlink(filename)
+
+
+def complete_upload_sr_server(initial_message: Message, socket, address,
+                              message_queue, stop_event):
+    """Cierra una subida cuyo contenido el servidor ya tenía almacenado:
+    confirma el UPLOAD como completo y espera directamente el END"""
+    end_message = send_first_ack_message(
+        Message.ack_upload(initial_message.get_seq_number(), complete=True),
+        socket, address, message_queue, stop_event)
+    if end_message and end_message.get_type() == MessageType.END:
+        end_recv_protocol(message_queue, end_message, socket, address,
+                          stop_event)
@@ -5,7 +5,10 @@ from message.message import DATA_MAX_SIZE, Message, MessageType
 from message.utils import (
     send_message, get_message_from_queue, show_info
 )
+from utils.compression import chunk_codec
+from utils.flow_control import PeerWindow
 from utils.logger import logger
+from utils.rtt import RttEstimator, TailLossProbe
 
 DATA_MAX_SIZE = DATA_MAX_SIZE
 
@@ -44,6 +47,7 @@ def download_saw_server(first_message: Message, sock, client_address,
         return
 
     ack_recibido = False
+    ack_inicial = None
 
     # Esperar el ACK inicial del cliente
     while not ack_recibido:
@@ -55,42 +59,62 @@ def download_saw_server(first_message: Message, sock, client_address,
         response = get_message_from_queue(msg_queue)
         if response and response.get_type() == MessageType.ACK:
             ack_recibido = True
+            ack_inicial = response
 
     # Enviar el archivo en paquetes
     next_update = start_time + timedelta(seconds=1)
+    rtt = RttEstimator()
+    rtt.on_ack(first_message)
+    peer_window = PeerWindow(rtt)
+    peer_window.update(ack_inicial)
     paquete_actual = 1
+    codec = chunk_codec(first_message.get_compression())
+    datos_en_linea = first_message.get_early_data()
+    if datos_en_linea and ack_inicial.get_seq_number() == 1:
+        # El cliente confirmó el primer bloque enviado en el ACK_DOWNLOAD
+        file.seek(min(DATA_MAX_SIZE, first_message.get_file_size()))
+        paquete_actual = 2
     while data := file.read(DATA_MAX_SIZE):
         next_update = show_info(first_message.get_file_size(), paquete_actual *
                                 DATA_MAX_SIZE, start_time, next_update)
         ack_recibido = False
         if stop_event.is_set():
             return
-        paquete = Message.data(paquete_actual, data)
+        paquete = Message.data(paquete_actual, codec.encode(data))
         while not ack_recibido:
             if stop_event.is_set():
                 return
-            if paquete.is_timeout():
+            # El primer envío de cada paquete respeta la ventana del cliente
+            if paquete.is_timeout() and (paquete.transmissions or
+                                         peer_window.can_send()):
                 logger.debug(f"Reenviando paquete {paquete_actual}.")
                 send_message(paquete, sock, client_address)
             response = get_message_from_queue(msg_queue)
             if (response and response.get_type() == MessageType.ACK and
                     response.get_seq_number() == paquete_actual):
                 logger.debug(f"ACK recibido para el paquete {paquete_actual}.")
+                peer_window.update(response)
+                rtt.on_ack(paquete)
                 paquete_actual += 1
                 ack_recibido = True
-                paquete = Message.data(paquete_actual, data)
+            elif response and response.get_type() == MessageType.ERROR:
+                logger.error("El cliente cortó la descarga.")
+                return
 
     # Finalizar la transferencia
     fin_enviado = False
     end_message = Message.end()
+    tlp = TailLossProbe(rtt)
     while not fin_enviado:
         if stop_event.is_set():
             return
         if end_message.is_timeout():
-            send_message(end_message, sock, client_address)
+            if end_message.transmissions:
+                tlp.probe_sent()
+            send_message(end_message, sock, client_address, tlp.timeout())
         response = get_message_from_queue(msg_queue)
         if response and response.get_type() == MessageType.END:
             fin_enviado = True
             finalizar_servidor_download_saw(sock, client_address, msg_queue,
-                                            stop_event, md5_digest)
+                                            stop_event, md5_digest, rtt)
             logger.info("Proceso de descarga finalizado.")
@@ -1,52 +1,58 @@
 from datetime import datetime, timedelta
 from message.message import Message, MessageType
 from message.utils import send_message, get_message_from_queue
+from utils.digest import resolve_digest
+from utils.rtt import RttEstimator, TailLossProbe
 
 
 def finalizar_servidor_download_saw(sock, client_address, msg_queue,
-                                    stop_event, md5_digest):
+                                    stop_event, md5_digest, rtt=None):
     """Finaliza la conexión con el cliente enviando un ACK al recibir
     un mensaje END."""
-    ack_message = Message.ack_end_download_saw(0, md5_digest)
+    ack_message = Message.ack_end_download_saw(0, resolve_digest(md5_digest))
     message = get_message_from_queue(msg_queue)
+    tlp = TailLossProbe(rtt or RttEstimator())
 
-    send_message(ack_message, sock, client_address)
+    send_message(ack_message, sock, client_address, tlp.timeout())
 
     recibi_nuevamente_fin = (not message or
                              message.get_type() == MessageType.END)
-    
-    timeout = datetime.now() + timedelta(seconds=3)
+
+    timeout = datetime.now() + timedelta(seconds=tlp.rtt.close_timeout())
     while recibi_nuevamente_fin and timeout > datetime.now():
         if stop_event.is_set():
             return
         if ack_message.is_timeout():
-            send_message(ack_message, sock, client_address)
+            tlp.probe_sent()
+            send_message(ack_message, sock, client_address, tlp.timeout())
         response = get_message_from_queue(msg_queue)
         recibi_nuevamente_fin = (not response or
                                  response.get_type() == MessageType.END)
-    
+
     return
 
 
 def finalizar_servidor(sock, client_address, msg_queue, stop_event,
-                       success=True):
+                       success=True, rtt=None):
     """Finaliza la conexión con el cliente enviando un ACK al recibir
     un mensaje END."""
     ack_message = Message.ack(0)
     if not success:
         ack_message = Message.ack(1)
     message = get_message_from_queue(msg_queue)
+    tlp = TailLossProbe(rtt or RttEstimator())
 
-    send_message(ack_message, sock, client_address)
+    send_message(ack_message, sock, client_address, tlp.timeout())
 
     recibi_nuevamente_fin = (not message or
                              message.get_type() == MessageType.END)
-    timeout = datetime.now() + timedelta(seconds=3)
+    timeout = datetime.now() + timedelta(seconds=tlp.rtt.close_timeout())
     while recibi_nuevamente_fin and timeout > datetime.now():
         if stop_event.is_set():
             return
         if ack_message.is_timeout():
-            send_message(ack_message, sock, client_address)
+            tlp.probe_sent()
+            send_message(ack_message, sock, client_address, tlp.timeout())
         response = get_message_from_queue(msg_queue)
         recibi_nuevamente_fin = (not response or
                                  response.get_type() == MessageType.END)
@@ -1,19 +1,23 @@
 from datetime import datetime, timedelta
-import hashlib
 import os
 import time
 from server.udp_stop_and_wait.finalizar_servidor import finalizar_servidor
-from message.message import Message, MessageType
+from message.message import ErrorCode, Message, MessageType
 from message.utils import (
     send_ack, send_message, get_message_from_queue, show_info
 )
+from utils.compression import chunk_codec
+from utils.flow_control import advertised_window
+from utils.digest import submit_file_md5
 from utils.logger import logger
+from utils.protocol_utils import abort_on_invalid_data
 
 
 def inicio_upload_server(sock, client_address, mensaje_inicial: Message,
                          msg_queue, stop_event):
     """Inicia el protocolo de subida verificando errores y esperando el ACK
-    inicial."""
+    inicial. Devuelve si hubo error y el mensaje del cliente que cerró el
+    inicio, si todavía tiene que procesarse."""
     logger.info("Iniciando protocolo de subida.")
 
     # Manejo del caso de error: archivo demasiado grande o problema inicial
@@ -23,7 +27,7 @@ def inicio_upload_server(sock, client_address, mensaje_inicial: Message,
         while not error_procesado:
             if stop_event.is_set():
                 logger.error("El proceso de subida fue interrumpido.")
-                return None
+                return None, None
             if mensaje_inicial.is_timeout():
                 logger.debug("Reenviando mensaje de error al cliente.")
                 send_message(mensaje_inicial, sock, client_address)
@@ -33,16 +37,24 @@ def inicio_upload_server(sock, client_address, mensaje_inicial: Message,
                             "un error.")
                 finalizar_servidor(sock, client_address, msg_queue, stop_event)
                 error_procesado = True
-        return True
+        return True, None
 
-    # Esperar el ACK inicial del cliente
+    # Esperar el ACK inicial del cliente. Si el UPLOAD trajo el primer bloque
+    # se confirma con ACK_UPLOAD y el siguiente DATA (o el END) hace de ACK.
+    datos_adelantados = mensaje_inicial.get_early_data()
     ack_recibido = False
-    mensaje_ack = Message.ack(0)
+    pendiente = None
+    if datos_adelantados:
+        mensaje_ack = Message.ack_upload(1)
+        primera_secuencia = 2
+    else:
+        mensaje_ack = Message.ack(0)
+        primera_secuencia = 1
     while not ack_recibido:
         if stop_event.is_set():
             logger.error("El proceso de subida fue interrumpido antes de "
                          "recibir el ACK inicial.")
-            return None
+            return None, None
         if mensaje_ack.is_timeout():
             logger.debug(f"Enviando ACK inicial al cliente {client_address}.")
             send_message(mensaje_ack, sock, client_address)
@@ -50,19 +62,35 @@ def inicio_upload_server(sock, client_address, mensaje_inicial: Message,
         if respuesta and respuesta.get_type() == MessageType.ACK:
             ack_recibido = True
         elif (respuesta and respuesta.get_type() == MessageType.DATA and
-              respuesta.get_seq_number() == 1):
+              respuesta.get_seq_number() == primera_secuencia):
             ack_recibido = True
+            pendiente = respuesta
             logger.info("Primer paquete recibido, lo que indica que el "
                         "cliente recibió el ACK inicial.")
+        elif (respuesta and respuesta.get_type() == MessageType.END and
+              datos_adelantados):
+            # El archivo entero viajó en el UPLOAD
+            ack_recibido = True
 
-    return False
+    return False, pendiente
 
 
 def upload_saw_server(mensaje_inicial, sock, client_address, msg_queue, file,
-                      filename, msg_md5_digest, stop_event):
-    """Protocolo Stop-and-Wait para la subida de archivos al servidor."""
+                      filename, msg_md5_digest, stop_event, commit=None):
+    """Protocolo Stop-and-Wait para la subida de archivos al servidor. Si se
+    indica commit, se llama con el archivo recibido íntegro para completarlo
+    (por ejemplo, aplicar un delta) e indica si la subida terminó bien."""
     inicio = datetime.now()
-    error_detectado = inicio_upload_server(
+    codec = chunk_codec(mensaje_inicial.get_compression())
+    # El bloque adjunto al UPLOAD se decodifica antes de confirmarlo
+    datos_adelantados = mensaje_inicial.get_early_data()
+    if datos_adelantados:
+        try:
+            datos_adelantados = codec.decode(datos_adelantados)
+        except ValueError as e:
+            logger.error(f"Bloque adjunto al UPLOAD inválido: {e}")
+            mensaje_inicial = Message.error(ErrorCode.INVALID_REQUEST)
+    error_detectado, pendiente = inicio_upload_server(
         sock, client_address, mensaje_inicial, msg_queue, stop_event)
 
     if error_detectado:
@@ -75,6 +103,10 @@ def upload_saw_server(mensaje_inicial, sock, client_address, msg_queue, file,
     secuencia_actual = 1
     proxima_actualizacion = inicio + timedelta(seconds=1)
     buffer_datos = []
+    if datos_adelantados:
+        buffer_datos.append(datos_adelantados)
+        bytes_recibidos = len(datos_adelantados)
+        secuencia_actual = 2
     while bytes_recibidos < mensaje_inicial.get_file_size():
         proxima_actualizacion = show_info(
             mensaje_inicial.get_file_size(), bytes_recibidos, inicio,
@@ -94,7 +126,8 @@ def upload_saw_server(mensaje_inicial, sock, client_address, msg_queue, file,
                     os.remove(filename)
                 return
 
-            mensaje = get_message_from_queue(msg_queue)
+            mensaje = pendiente or get_message_from_queue(msg_queue)
+            pendiente = None
 
             # Caso de retransmisión de ACK para un paquete anterior
             if mensaje:
@@ -102,18 +135,26 @@ def upload_saw_server(mensaje_inicial, sock, client_address, msg_queue, file,
                         mensaje.get_seq_number() < secuencia_actual):
                     logger.debug(f"Retransmitiendo ACK para el paquete "
                                  f"{mensaje.get_seq_number()}.")
-                    send_ack(mensaje.get_seq_number(), sock, client_address)
+                    send_ack(mensaje.get_seq_number(), sock, client_address,
+                             advertised_window(len(buffer_datos), file))
 
                 # Caso de recepción del paquete esperado
                 elif (mensaje.get_type() == MessageType.DATA and
                       mensaje.get_seq_number() == secuencia_actual):
                     logger.debug(f"Paquete {mensaje.get_seq_number()} "
                                  f"recibido correctamente.")
+                    try:
+                        datos = codec.decode(mensaje.get_data())
+                    except ValueError as e:
+                        abort_on_invalid_data(e, sock, client_address,
+                                              msg_queue, stop_event)
+                        file.close()
+                        os.remove(filename)
+                        return
                     logger.debug(f"Enviando ACK para el paquete "
                                  f"{mensaje.get_seq_number()}.")
-                    send_ack(mensaje.get_seq_number(), sock, client_address)
-
-                    datos = mensaje.get_data()
+                    send_ack(mensaje.get_seq_number(), sock, client_address,
+                             advertised_window(len(buffer_datos), file))
                     buffer_datos.append(datos)
 
                     # Escribir en el archivo si el buffer
@@ -132,16 +173,33 @@ def upload_saw_server(mensaje_inicial, sock, client_address, msg_queue, file,
     # Sin esto rompe el md5
     if buffer_datos:
         file.write(b"".join(buffer_datos))
+    file.flush()
 
-    file_read_for_digest: bytes
-    with open(filename, 'rb') as file_read_for_digest:
-        file_read_for_digest = file_read_for_digest.read()
-    final_md5_digest = hashlib.md5(file_read_for_digest).hexdigest()
+    final_md5_digest = submit_file_md5(filename).result()
+    integro = final_md5_digest == msg_md5_digest
+    if integro and commit:
+        integro = commit(filename)
 
-    finalizar_servidor(sock, client_address, msg_queue, stop_event,
-                       final_md5_digest == msg_md5_digest)
+    # Liberar el lock antes del cierre: el archivo ya puede descargarse
+    # aunque se demore el último ACK
     if file:
         file.close()
-    if (final_md5_digest != msg_md5_digest):
+    finalizar_servidor(sock, client_address, msg_queue, stop_event, integro)
+    if not integro:
         logger.error("Error en la integridad del archivo. Borrando archivo.")
         os.remove(filename)
+
+
+def complete_upload_saw_server(mensaje_inicial, sock, client_address,
+                               msg_queue, stop_event):
+    """Cierra una subida cuyo contenido el servidor ya tenía almacenado:
+    confirma el UPLOAD como completo y espera directamente el END."""
+    mensaje_ack = Message.ack_upload(1, complete=True)
+    while not stop_event.is_set():
+        if mensaje_ack.is_timeout():
+            logger.debug(f"Enviando ACK_UPLOAD completo a {client_address}.")
+            send_message(mensaje_ack, sock, client_address)
+        respuesta = get_message_from_queue(msg_queue)
+        if respuesta and respuesta.get_type() == MessageType.END:
+            finalizar_servidor(sock, client_address, msg_queue, stop_event)
+            return
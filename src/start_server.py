@@ -1,22 +1,75 @@
 import hashlib
+import io
+import signal
 import socket
 import os
+import time
 import logging
 import argparse
+from multiprocessing import Process
 from threading import Thread, Event
 import queue
 from typing import Any
 from server.server_client import Client
-from message.message import TOTAL_BYTES_LENGTH, ErrorCode, Message, MessageType
-from server.udp_stop_and_wait.upload import upload_saw_server
+from server.egress import EgressScheduler, parse_quota
+from server.transfer_socket import TransferSocket
+from server.delta_upload import rebuild_from_delta
+from server.content_store import (
+    ContentStore, valid_content_key, valid_digest
+)
+from server.bundle import is_storage_name, pack_bundle, unpack_bundle
+from server.byte_range import open_range, resolve_range
+from server.catalog import Catalog
+from server.chunk_cache import DEFAULT_CACHE_SIZE, CachedFile, ChunkCache
+from server.packfile import PackedFile
+from server.replication import DEFAULT_REPLICATION_JOBS, Replicator
+from server.scheduler import SCHEDULERS, PendingTransfer, retry_after
+from server.storage import (
+    DEFAULT_FSYNC_POLICY, DEFAULT_GROUP_COMMIT_INTERVAL, FSYNC_POLICIES,
+    Storage
+)
+from message.session import SessionSocket, session_key
+from message.utils import send_message
+from message.message import (
+    DATA_MAX_SIZE, TOTAL_BYTES_LENGTH, ErrorCode, Message, MessageType
+)
+from server.udp_stop_and_wait.upload import (
+    complete_upload_saw_server, upload_saw_server
+)
 from server.udp_stop_and_wait.download import download_saw_server
-from server.udp_selective_repeat.upload import upload_sr_server
+from server.udp_selective_repeat.upload import (
+    complete_upload_sr_server, upload_sr_server
+)
 from server.udp_selective_repeat.download import download_sr_server
-from utils.misc import CustomHelpFormatter
+from utils.misc import CustomHelpFormatter, parse_address
+from utils.compression import (
+    chunk_codec, choose_compression, is_supported, sample_file
+)
+from utils.delta import file_signature, stream_signature
+from utils.digest import (
+    start_digest_pool, stop_digest_pool, submit_digest
+)
+from utils.prefetch import (
+    DEFAULT_PREFETCH_CHUNKS, PrefetchReader, PrefetchStats
+)
+from utils.rate_limit import parse_rate
 from utils.logger import logger
 
 DEFAULT_PROTOCOL = 'udp_saw'
 MAX_FILE_SIZE = 1024 * 1024 * 100  # 100 MB
+# Archivos de hasta esta cantidad de paquetes viajan con el primer bloque
+# dentro del ACK_DOWNLOAD, sin esperar el ACK del cliente para empezar
+INLINE_DOWNLOAD_MAX_PACKETS = 4
+# Cada cuánto el loop principal libera clientes terminados (segundos)
+SERVER_POLL_INTERVAL = 0.1
+# Tiempo que se descartan los duplicados tardíos de una conexión cerrada
+TOMBSTONE_TIMEOUT = 2
+# Cada cuánto se informa el estado de la cola de salida (segundos)
+EGRESS_REPORT_INTERVAL = 5
+DEFAULT_MAX_TRANSFERS = 16
+DEFAULT_MAX_QUEUED = 64
+DEFAULT_SCHEDULER = 'fifo'
+DEFAULT_HASH_WORKERS = 2
 
 # Enable console colors on Windows
 if os.name == 'nt':
@@ -28,8 +81,38 @@ class ServerData:
     def __init__(self):
         self.sock = None
         self.storage_path = ""
+        # Ubicación, escritura y durabilidad de los archivos almacenados
+        self.storage = None
         self.clients = dict[Any, Client]()
         self.protocol = DEFAULT_PROTOCOL
+        # Clientes cuyo flujo terminó, pendientes de liberar
+        self.finished_clients = queue.Queue()
+        # Conexiones cerradas recientemente (estilo TIME_WAIT) con su
+        # instante de vencimiento
+        self.tombstones = dict[Any, float]()
+        # Control de admisión: máximo de transferencias simultáneas (0 sin
+        # límite) y cola de espera para las que no entran
+        self.max_transfers = DEFAULT_MAX_TRANSFERS
+        self.max_queued = DEFAULT_MAX_QUEUED
+        self.scheduler = SCHEDULERS[DEFAULT_SCHEDULER]()
+        # Reparte el ancho de banda de salida entre las transferencias
+        self.egress = None
+        self.next_egress_report = 0
+        # Si cada transferencia usa su propio socket conectado al cliente
+        self.connected_sockets = False
+        self.host = None
+        # Almacenamiento deduplicado por contenido (None: desactivado)
+        self.content_store = None
+        # Catálogo de archivos con el que se responden LIST y STAT
+        self.catalog = None
+        # Caché de bloques compartido por las descargas (None: deshabilitado)
+        self.chunk_cache = None
+        # Bloques que se leen por adelantado en las descargas (0: ninguno)
+        self.prefetch_depth = DEFAULT_PREFETCH_CHUNKS
+        self.prefetch_stats = PrefetchStats()
+        # Replicación de las subidas en los servidores pares (None: sin
+        # pares)
+        self.replicator = None
 
 
 def recv_message(sock, timeout=None):
@@ -42,6 +125,61 @@ def recv_message(sock, timeout=None):
         return None, None
 
 
+def run_client_flow(server_data, key, flow, args):
+    """Ejecuta el flujo de un cliente y avisa al loop principal al terminar
+    para que libere su estado"""
+    try:
+        flow(*args)
+    finally:
+        server_data.finished_clients.put(key)
+
+
+def forward_to_client(server_data: ServerData, key, message: Message):
+    """Entrega al flujo del cliente un mensaje recibido por su socket
+    propio"""
+    client = server_data.clients.get(key)
+    if client:
+        client.add_message(message)
+
+
+def release_finished_clients(server_data: ServerData):
+    """Libera el estado de los clientes que terminaron y deja un tombstone
+    que absorbe sus duplicados tardíos"""
+    while not server_data.finished_clients.empty():
+        key = server_data.finished_clients.get(False)
+        client = server_data.clients.pop(key, None)
+        if client:
+            client.close()
+        server_data.tombstones[key] = time.time() + TOMBSTONE_TIMEOUT
+
+
+def expire_tombstones(server_data: ServerData):
+    """Elimina los tombstones vencidos"""
+    now = time.time()
+    expired = [key for key, expiration
+               in server_data.tombstones.items() if expiration <= now]
+    for key in expired:
+        del server_data.tombstones[key]
+
+
+def log_egress_stats(server_data: ServerData):
+    """Informa periódicamente el estado de la cola de salida mientras hay
+    actividad"""
+    if time.time() < server_data.next_egress_report:
+        return
+    server_data.next_egress_report = time.time() + EGRESS_REPORT_INTERVAL
+    stats = server_data.egress.stats
+    replicator = server_data.replicator
+    if replicator and replicator.stats.pending:
+        logger.debug(f"Replicación: {replicator.stats}")
+    if stats.depth or server_data.clients:
+        logger.debug(f"Salida: {stats}")
+        if server_data.chunk_cache:
+            logger.debug(f"Caché: {server_data.chunk_cache.stats}")
+        if server_data.prefetch_depth:
+            logger.debug(f"Lectura anticipada: {server_data.prefetch_stats}")
+
+
 def join_worker(worker, client_address, stop_event, file, timeout=1800):
     worker.join(timeout)  # Timeout de 30 minutos
     if worker.is_alive():
@@ -52,26 +190,113 @@ def join_worker(worker, client_address, stop_event, file, timeout=1800):
         file.close()
 
 
+def store_content(content_store, filename, digest):
+    """Incorpora al almacén de contenido un archivo subido y verificado.
+    Un error acá no invalida la subida: el archivo queda sin deduplicar"""
+    try:
+        content_store.store(filename, digest, os.path.getsize(filename))
+    except OSError as e:
+        logger.error(f"No se pudo deduplicar {filename}: {e}")
+
+
 def upload(sock, client_address, message, messages_queue,
-           filename, msg_md5_digest, stop_event, protocol):
+           filename, msg_md5_digest, stop_event, protocol, storage,
+           content_store=None, catalog=None, replicator=None):
     file = None
     initial_message = message
-
-    if os.path.exists(filename):
-        logger.error(f"El archivo {filename} ya existe en el servidor.")
-        initial_message = Message.error(ErrorCode.FILE_ALREADY_EXISTS)
+    # En modo delta se recibe el delta en un temporal y al terminar se
+    # reconstruye el archivo
+    receive_path = filename
+    delta_digest = message.get_delta_digest()
+    # Si el contenido ya está almacenado no se reciben datos
+    deduplicated = False
+
+    def register(stored_path, digest):
+        """Incorpora un archivo guardado al almacén y al catálogo"""
+        name = os.path.basename(stored_path)
+        # Los archivos empaquetados no tienen inodo propio que enlazar
+        if content_store and not storage.packed(name):
+            store_content(content_store, stored_path, digest)
+        if catalog:
+            catalog.update(name, digest)
+        if replicator:
+            replicator.enqueue(name)
+
+    def commit(received_path):
+        """Completa la subida una vez verificado lo recibido"""
+        if message.is_bundle():
+            return unpack_bundle(storage, received_path, register)
+        if delta_digest:
+            if not rebuild_from_delta(storage, os.path.basename(filename),
+                                      received_path, delta_digest,
+                                      MAX_FILE_SIZE):
+                return False
+        elif not file.publish():
+            return False
+        register(filename, delta_digest or msg_md5_digest)
+        return True
+
+    # El digest y el tamaño los elige el cliente y terminan en rutas del
+    # almacén de contenido
+    if (not valid_content_key(msg_md5_digest, message.get_file_size()) or
+            (delta_digest and not valid_digest(delta_digest))):
+        logger.error(f"Pedido de subida de {filename} mal formado.")
+        initial_message = Message.error(ErrorCode.INVALID_REQUEST)
     elif message.get_file_size() > MAX_FILE_SIZE:
         logger.error(f"El tamaño del archivo {filename} excede el "
                      f"límite permitido.")
         initial_message = Message.error(ErrorCode.FILE_TOO_BIG)
+    elif message.is_bundle():
+        # Los archivos se crean al extraer el bundle, uno por uno
+        file = storage.create_temp(prefix=".bundle.")
+        receive_path = file.path
+    elif delta_digest:
+        if not storage.exists(os.path.basename(filename)):
+            logger.error(f"No hay copia de {filename} contra la que aplicar "
+                         f"el delta.")
+            initial_message = Message.error(ErrorCode.FILE_NOT_FOUND)
+        else:
+            logger.info(f"Subida en modo delta de {filename}")
+            directory, name = os.path.split(filename)
+            file = storage.create_temp(directory, prefix=f".{name}.",
+                                       suffix=".delta")
+            receive_path = file.path
     else:
+        # El nombre se reclama de forma atómica: con varios procesos
+        # sirviendo el mismo directorio solo una subida puede recibirlo. Los
+        # datos llegan a un temporal que se publica al verificarse
         try:
-            file = open(filename, "ab")
+            if content_store and content_store.link(
+                    filename, msg_md5_digest, message.get_file_size()):
+                deduplicated = True
+                if catalog:
+                    catalog.update(os.path.basename(filename),
+                                   msg_md5_digest)
+                if replicator:
+                    replicator.enqueue(os.path.basename(filename))
+            else:
+                file = storage.create_upload(os.path.basename(filename),
+                                             message.get_file_size())
+                receive_path = file.path
+        except FileExistsError:
+            logger.error(f"El archivo {filename} ya existe en el servidor.")
+            initial_message = Message.error(ErrorCode.FILE_ALREADY_EXISTS)
         except IOError as e:
             logger.error(f"No se pudo abrir el archivo {filename} para "
                          f"escritura: {e}")
             initial_message = Message.error(ErrorCode.FILE_WRITE_ERROR)
 
+    if deduplicated:
+        complete_handler = (complete_upload_sr_server if protocol == 'udp_sr'
+                            else complete_upload_saw_server)
+        worker_thread = Thread(target=complete_handler,
+                               args=(initial_message, sock, client_address,
+                                     messages_queue, stop_event))
+        worker_thread.start()
+        join_worker(worker_thread, client_address, stop_event, file)
+        logger.info(f"El cliente {client_address} ha terminado la subida ")
+        return
+
     protocol_handler = None
     if protocol == 'udp_saw':
         protocol_handler = upload_saw_server
@@ -81,27 +306,84 @@ def upload(sock, client_address, message, messages_queue,
     if protocol_handler:
         worker_thread = Thread(target=protocol_handler,
                                args=(initial_message, sock, client_address,
-                                     messages_queue, file, filename,
-                                     msg_md5_digest, stop_event))
+                                     messages_queue, file, receive_path,
+                                     msg_md5_digest, stop_event, commit))
         worker_thread.start()
         join_worker(worker_thread, client_address, stop_event, file)
 
     logger.info(f"El cliente {client_address} ha terminado la subida ")
 
 
+def open_signature(storage, name):
+    """Calcula la firma por bloques del archivo para una subida en modo
+    delta y la devuelve como un archivo en memoria, junto con su MD5.
+    Devuelve (None, "") si el archivo no existe"""
+    file = storage.open(name)
+    if not file:
+        return None, ""
+    if isinstance(file, PackedFile):
+        # Los archivos empaquetados son chicos y ya están en memoria
+        with file:
+            signature = stream_signature(file)
+    else:
+        file.close()
+        signature = submit_digest(file_signature,
+                                  storage.path(name)).result()
+    logger.info(f"Firma de {name}: {len(signature)} bytes")
+    return io.BytesIO(signature), hashlib.md5(signature).hexdigest()
+
+
 def download(sock, client_address, messages_queue,
-             filename, stop_event, protocol):
+             name, stop_event, protocol, storage, compression=None,
+             signature=False, bundle_names=None, chunk_cache=None,
+             prefetch_depth=0, prefetch_stats=None, byte_range=None):
     first_message = None
     file = None
+    md5_digest = ""
+    error = ErrorCode.FILE_NOT_FOUND
 
-    if not os.path.exists(filename):
-        logger.error(f"El archivo {filename} no se ha encontrado.")
-        first_message = Message.error(ErrorCode.FILE_NOT_FOUND)
+    if bundle_names:
+        file, md5_digest = pack_bundle(storage, bundle_names)
+    elif signature:
+        file, md5_digest = open_signature(storage, name)
+    else:
+        file = storage.open(name)
+        if isinstance(file, PackedFile):
+            # Porción del mmap del pack: ya se lee de memoria
+            chunk_cache = prefetch_depth = None
+        if file and chunk_cache:
+            # Los bloques se leen del caché compartido con las otras
+            # descargas del mismo archivo
+            file = CachedFile(file, chunk_cache)
+        if file and byte_range:
+            # El digest que se verifica es el del rango
+            file, md5_digest = open_range(storage, name, file, byte_range)
+            if not file:
+                logger.error(f"Rango inválido de {name}: {byte_range}")
+                error = ErrorCode.INVALID_RANGE
+    if not file:
+        if error == ErrorCode.FILE_NOT_FOUND:
+            logger.error(f"El archivo {name} no se ha encontrado.")
+        first_message = Message.error(error)
         messages_queue.put(first_message)
     else:
-        file = open(filename, "rb")
-        file_size = os.path.getsize(filename)
-        first_message = Message.ack_download(file_size)
+        file_size = file.seek(0, os.SEEK_END)
+        file.seek(0)
+        # El cliente propone la compresión; el servidor la descarta si el
+        # archivo no se achica
+        compression = choose_compression(sample_file(file), compression)
+        codec = chunk_codec(compression)
+        inline_data = b''
+        if file_size <= INLINE_DOWNLOAD_MAX_PACKETS * DATA_MAX_SIZE:
+            inline_data = codec.encode(file.read(DATA_MAX_SIZE))
+            file.seek(0)
+        first_message = Message.ack_download(
+            file_size, inline_data,
+            compression if is_supported(compression) else None)
+        if prefetch_depth and not (signature or bundle_names):
+            # Un thread lee del disco por delante del worker, que no se
+            # bloquea leyendo entre ACKs
+            file = PrefetchReader(file, prefetch_stats, prefetch_depth)
 
     recv_protocol = None
     if protocol == 'udp_saw':
@@ -109,12 +391,10 @@ def download(sock, client_address, messages_queue,
     elif protocol == 'udp_sr':
         recv_protocol = download_sr_server
 
-    file_read_for_digest: bytes
-    md5_digest = ""
-    if (os.path.exists(filename)):
-        with open(filename, 'rb') as file_read_for_digest:
-            file_read_for_digest = file_read_for_digest.read()
-        md5_digest = hashlib.md5(file_read_for_digest).hexdigest()
+    # El digest se calcula en el pool mientras empieza la transferencia; se
+    # necesita recién en el END
+    if file and not md5_digest:
+        md5_digest = storage.digest(name)
 
     send_worker = Thread(target=recv_protocol,
                          args=(first_message, sock, client_address,
@@ -143,6 +423,67 @@ def parse_arguments():
                         help="error recovery protocol",
                         default=DEFAULT_PROTOCOL,
                         choices=["udp_saw", "udp_sr"])
+    parser.add_argument("-m", "--max-transfers", metavar="N", type=int,
+                        help="max concurrent transfers (0 = unlimited)",
+                        default=DEFAULT_MAX_TRANSFERS)
+    parser.add_argument("--max-queued", metavar="N", type=int,
+                        help="max transfers waiting for a free slot",
+                        default=DEFAULT_MAX_QUEUED)
+    parser.add_argument("--scheduler", metavar="POLICY", type=str,
+                        help="order in which waiting transfers start",
+                        default=DEFAULT_SCHEDULER,
+                        choices=list(SCHEDULERS))
+    parser.add_argument("--max-rate", metavar="RATE", type=parse_rate,
+                        help="total egress rate in bytes/s, e.g. 10M "
+                             "(0 = unlimited)", default=0)
+    parser.add_argument("--client-rate", metavar="RATE", type=parse_rate,
+                        help="egress rate per client IP in bytes/s "
+                             "(0 = unlimited)", default=0)
+    parser.add_argument("--quota", metavar="NET=RATE", type=parse_quota,
+                        action="append", default=[],
+                        help="egress rate shared by a subnet or IP, e.g. "
+                             "10.0.0.0/8=1M (repeatable)")
+    parser.add_argument("-w", "--workers", metavar="N", type=int,
+                        help="server processes sharing the port "
+                             "(SO_REUSEPORT)", default=1)
+    parser.add_argument("--hash-workers", metavar="N", type=int,
+                        help="processes computing file digests "
+                             "(0 = in the transfer thread)",
+                        default=DEFAULT_HASH_WORKERS)
+    parser.add_argument("--connected-sockets", action="store_true",
+                        help="serve each transfer from its own ephemeral "
+                             "port, connected to the client")
+    parser.add_argument("--dedup", action="store_true",
+                        help="content-addressed storage: identical files "
+                             "share storage and re-uploads send no data")
+    parser.add_argument("--cache-size", metavar="SIZE", type=parse_rate,
+                        help="memory for the chunk cache shared by "
+                             "downloads, e.g. 64M (0 = disabled)",
+                        default=DEFAULT_CACHE_SIZE)
+    parser.add_argument("--prefetch", metavar="CHUNKS", type=int,
+                        help="chunks each download reads ahead of the "
+                             "sender (0 = disabled)",
+                        default=DEFAULT_PREFETCH_CHUNKS)
+    parser.add_argument("--fsync", metavar="POLICY", type=str,
+                        help="when uploads are flushed to disk: never, "
+                             "each on completion, or grouped",
+                        default=DEFAULT_FSYNC_POLICY, choices=FSYNC_POLICIES)
+    parser.add_argument("--group-commit-ms", metavar="MS", type=float,
+                        help="interval of the grouped fsync",
+                        default=DEFAULT_GROUP_COMMIT_INTERVAL * 1000)
+    parser.add_argument("--shard-depth", metavar="N", type=int,
+                        help="levels of hashed subdirectories for stored "
+                             "files (0 = flat)", default=0)
+    parser.add_argument("--pack-threshold", metavar="SIZE", type=parse_rate,
+                        help="store uploads up to SIZE in append-only pack "
+                             "files, e.g. 64K (0 = disabled)", default=0)
+    parser.add_argument("--peer", metavar="HOST:PORT", action="append",
+                        type=parse_address, default=[],
+                        help="replicate every verified upload to this "
+                             "server (repeatable)")
+    parser.add_argument("--replication-jobs", metavar="N", type=int,
+                        help="concurrent uploads to each peer",
+                        default=DEFAULT_REPLICATION_JOBS)
 
     parser.usage = parser.format_usage()
     for a in parser._actions:
@@ -151,71 +492,269 @@ def parse_arguments():
     return parser.parse_args()
 
 
+def start_transfer(server_data: ServerData, key, message: Message,
+                   client_address):
+    """Inicia el flujo de subida o descarga pedido por el cliente"""
+    msg_file_name = message.get_file_name()
+    messages_queue = queue.Queue()
+    stop_event = Event()
+    transfer_socket = None
+    egress_sock = None
+    if server_data.connected_sockets:
+        # El kernel entrega los mensajes del cliente directo a la
+        # transferencia; el cliente se entera del nuevo puerto con la
+        # primera respuesta
+        transfer_socket = TransferSocket(
+            server_data.host, client_address,
+            lambda msg: forward_to_client(server_data, key, msg))
+        egress_sock = transfer_socket.sock
+        logger.debug(f"Transferencia de {client_address} en el puerto "
+                     f"{transfer_socket.get_port()}")
+    egress_flow = server_data.egress.flow(client_address, egress_sock)
+    session_sock = SessionSocket(egress_flow, message.get_session_id(),
+                                 client_address)
+
+    if message.get_type() == MessageType.UPLOAD:
+        logger.info(f"Cliente {client_address} se ha conectado.")
+        if message.is_bundle():
+            logger.info("Solicitud de subida agrupada")
+        else:
+            logger.info(f"Solicitud de subida de archivo: {msg_file_name}")
+        filename = server_data.storage.path(msg_file_name, create=True)
+        flow = upload
+        flow_args = (session_sock, client_address, message, messages_queue,
+                     filename, message.get_file_digest(), stop_event,
+                     server_data.protocol, server_data.storage,
+                     server_data.content_store, server_data.catalog,
+                     server_data.replicator)
+    else:
+        logger.info("\033[32m+----------------------------------------------+")
+        logger.info(f"\033[32m| Cliente {client_address} se ha conectado |")
+        logger.info("\033[32m+----------------------------------------------+")
+        bundle_names = message.get_bundle_names()
+        byte_range = requested_range(message)
+        if bundle_names:
+            logger.info(f"Descarga agrupada de {len(bundle_names)} "
+                        f"archivos")
+        elif byte_range:
+            logger.info(f"Archivo a descargar: {msg_file_name}, rango "
+                        f"{byte_range}")
+        else:
+            logger.info(f"Archivo a descargar: {msg_file_name}")
+        flow = download
+        flow_args = (session_sock, client_address, messages_queue,
+                     msg_file_name, stop_event, server_data.protocol,
+                     server_data.storage, message.get_compression(),
+                     message.is_signature_request(), bundle_names,
+                     server_data.chunk_cache, server_data.prefetch_depth,
+                     server_data.prefetch_stats, byte_range)
+
+    worker = Thread(target=run_client_flow,
+                    args=(server_data, key, flow, flow_args))
+    server_data.clients[key] = Client(
+        client_address, worker, messages_queue, stop_event,
+        sock=session_sock, transfer_socket=transfer_socket,
+        egress_flow=egress_flow)
+    server_data.clients[key].run()
+
+
+def has_free_slot(server_data: ServerData):
+    """Comprueba si se puede iniciar otra transferencia"""
+    return (not server_data.max_transfers or
+            len(server_data.clients) < server_data.max_transfers)
+
+
+def requested_range(message: Message):
+    """Rango pedido en un DOWNLOAD, o None si se pide el archivo entero.
+    Un rango mal formado se toma como uno inválido, que el flujo rechaza"""
+    try:
+        return message.get_byte_range()
+    except ValueError:
+        return 0, -1
+
+
+def requested_size(server_data: ServerData, message: Message):
+    """Tamaño del archivo pedido: el anunciado en el UPLOAD o el del archivo
+    (o del rango pedido) en disco para un DOWNLOAD (0 si no existe)"""
+    if message.get_type() == MessageType.UPLOAD:
+        return message.get_file_size() or 0
+    size = 0
+    for name in message.get_bundle_names() or [message.get_file_name()]:
+        try:
+            size += server_data.storage.stat(name).st_size
+        except OSError:
+            pass
+    byte_range = requested_range(message)
+    if byte_range:
+        resolved = resolve_range(size, *byte_range)
+        size = resolved[1] if resolved else 0
+    return size
+
+
+def send_busy(server_data: ServerData, message: Message, client_address,
+              position):
+    """Avisa al cliente que su pedido espera y cuándo reintentarlo"""
+    busy_message = Message.busy(retry_after(position), position)
+    session_sock = SessionSocket(server_data.egress.control,
+                                 message.get_session_id(), client_address)
+    send_message(busy_message, session_sock, client_address)
+
+
+def admit_transfer(server_data: ServerData, key, message: Message,
+                   client_address):
+    """Control de admisión: inicia la transferencia si hay lugar y nadie
+    espera, y si no la encola y responde BUSY. Si la cola está llena el
+    pedido se rechaza con un BUSY y el cliente reintenta más tarde"""
+    pending = server_data.scheduler.get(key)
+    if pending:
+        # Reintento de un pedido que ya espera en la cola
+        pending.refresh(client_address)
+        send_busy(server_data, message, client_address,
+                  server_data.scheduler.position(key))
+        return
+
+    if has_free_slot(server_data) and not len(server_data.scheduler):
+        start_transfer(server_data, key, message, client_address)
+        return
+
+    if len(server_data.scheduler) >= server_data.max_queued:
+        logger.info(f"Cola de espera llena, rechazando a {client_address}")
+        send_busy(server_data, message, client_address, 0)
+        return
+
+    server_data.scheduler.push(PendingTransfer(
+        key, message, client_address, requested_size(server_data, message)))
+    position = server_data.scheduler.position(key)
+    logger.info(f"Servidor ocupado, {client_address} queda en la posición "
+                f"{position} de la cola")
+    send_busy(server_data, message, client_address, position)
+
+
+def schedule_pending_transfers(server_data: ServerData):
+    """Inicia los pedidos en espera mientras haya lugar, en el orden que
+    decide el scheduler"""
+    while has_free_slot(server_data):
+        pending = server_data.scheduler.pop()
+        if not pending:
+            return
+        start_transfer(server_data, pending.key, pending.message,
+                       pending.address)
+
+
+def is_well_formed_request(message: Message):
+    """Comprueba que el texto de un pedido sea UTF-8 válido: los campos de
+    la cabecera, el nombre consultado o los nombres de un bundle"""
+    try:
+        if message.get_type() in [MessageType.LIST, MessageType.STAT]:
+            message.get_data_as_string()
+        else:
+            message.get_header_fields()
+            message.get_bundle_names()
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def answer_catalog_request(server_data: ServerData, message: Message,
+                           client_address):
+    """Responde un LIST o STAT desde el loop principal: no hace falta
+    handshake ni thread porque los pedidos no tienen estado; si la respuesta
+    se pierde el cliente repite el pedido"""
+    session_sock = SessionSocket(server_data.egress.control,
+                                 message.get_session_id(), client_address)
+    seq_number = message.get_seq_number()
+    name = message.get_data_as_string()
+
+    if message.get_type() == MessageType.LIST:
+        entries, next_cursor = server_data.catalog.list_page(name)
+        send_message(Message.catalog(seq_number, entries, next_cursor),
+                     session_sock, client_address)
+        return
+
+    # Solo nombres del directorio de almacenamiento, sin rutas ni internos
+    entry = None
+    if is_storage_name(name):
+        entry = server_data.catalog.stat(name)
+    if not entry:
+        send_message(Message.error(ErrorCode.FILE_NOT_FOUND), session_sock,
+                     client_address)
+        return
+
+    def reply(digest):
+        """Responde cuando el digest está disponible (en el momento si
+        estaba en caché)"""
+        known = "" if digest.exception() else digest.result()
+        send_message(Message.catalog(seq_number, [
+            (name, entry.size, entry.mtime_ns // 10 ** 9, known)]),
+            session_sock, client_address)
+
+    server_data.catalog.digest(name, entry).add_done_callback(reply)
+
+
 def process_client_message(server_data: ServerData, message: Message,
                            client_address):
     """Dado un mensaje proveniente del cliente ya deserializado, segun su tipo:
-    UPLOAD: Inicia un flujo de subida con el cliente
-    DOWNLOAD: Inicia un flujo de descarga con el cliente
-    ERROR, ACK, DATA, END, ACK_END: Deriva el mensaje al flujo con el cliente
+    UPLOAD: Inicia un flujo de subida con el cliente (o lo encola)
+    DOWNLOAD: Inicia un flujo de descarga con el cliente (o lo encola)
+    ERROR, ACK, DATA, END, ACK_END, ACK_DOWNLOAD: Deriva el mensaje al flujo
+    con el cliente
+    LIST, STAT: Responde desde el catálogo, sin crear un flujo
+    Un pedido con texto que no es UTF-8 se responde con un ERROR
     """
+    if (message.get_type() in [MessageType.UPLOAD, MessageType.DOWNLOAD,
+                               MessageType.LIST, MessageType.STAT] and
+            not is_well_formed_request(message)):
+        logger.error(f"Pedido mal formado de {client_address}")
+        session_sock = SessionSocket(server_data.egress.control,
+                                     message.get_session_id(), client_address)
+        send_message(Message.error(ErrorCode.INVALID_REQUEST), session_sock,
+                     client_address)
+        return
+
+    if message.get_type() in [MessageType.LIST, MessageType.STAT]:
+        answer_catalog_request(server_data, message, client_address)
+        return
+
+    # Los mensajes se demultiplexan por sesión; los clientes sin sesión se
+    # identifican por su dirección de origen
+    key = session_key(message, client_address)
+
+    # Descartar duplicados tardíos de una conexión recién cerrada
+    if key in server_data.tombstones:
+        if server_data.tombstones[key] > time.time():
+            logger.debug(f"Descartando mensaje tardío de {client_address}")
+            return
+        del server_data.tombstones[key]
+
     # Crear o actualizar cliente
     msg_type = message.get_type()
-    if (msg_type in [MessageType.UPLOAD, MessageType.DOWNLOAD] and
-            client_address in server_data.clients):
-        server_data.clients[client_address].add_message(message)
-        return
+    client = server_data.clients.get(key)
+    if client:
+        if client.address != client_address:
+            logger.info(f"El cliente {client.address} cambió de dirección "
+                        f"a {client_address}")
+            client.update_address(client_address)
+        if msg_type in [MessageType.UPLOAD, MessageType.DOWNLOAD]:
+            client.add_message(message)
+            return
 
     # logger.info(f"Mensaje recibido desde {client_address}: {message}")
 
     # Procesar el mensaje según su tipo
-    if msg_type == MessageType.UPLOAD:
-        msg_file_name = message.get_file_name()
-        msg_md5_digest = message.get_file_digest()
-        logger.info(f"Cliente {client_address} se ha conectado.")
-        logger.info(f"Solicitud de subida de archivo: {msg_file_name}")
-        messages_queue = queue.Queue()
-        filename = os.path.join(server_data.storage_path, msg_file_name)
-        stop_event = Event()
-        upload_worker = Thread(
-            target=upload, args=(server_data.sock, client_address, message,
-                                 messages_queue, filename, msg_md5_digest,
-                                 stop_event, server_data.protocol))
-        server_data.clients[client_address] = Client(
-            client_address, upload_worker, messages_queue, stop_event)
-        server_data.clients[client_address].run()
-
-    elif msg_type == MessageType.DOWNLOAD:
-        msg_file_name = message.get_file_name()
-        logger.info("\033[32m+----------------------------------------------+")
-        logger.info(f"\033[32m| Cliente {client_address} se ha conectado |")
-        logger.info("\033[32m+----------------------------------------------+")
-        logger.info(f"Archivo a descargar: {msg_file_name}")
-        messages_queue = queue.Queue()
-        filename = os.path.join(server_data.storage_path, msg_file_name)
-        stop_event = Event()
-        download_worker = Thread(
-            target=download, args=(server_data.sock, client_address,
-                                   messages_queue, filename, stop_event,
-                                   server_data.protocol))
-        server_data.clients[client_address] = Client(
-            client_address, download_worker, messages_queue, stop_event)
-        server_data.clients[client_address].run()
+    if msg_type in [MessageType.UPLOAD, MessageType.DOWNLOAD]:
+        admit_transfer(server_data, key, message, client_address)
 
     elif msg_type in [MessageType.ERROR, MessageType.ACK, MessageType.DATA,
-                      MessageType.END, MessageType.ACK_END]:
-        if (client_address in server_data.clients):
-            server_data.clients[client_address].add_message(message)
+                      MessageType.END, MessageType.ACK_END,
+                      MessageType.ACK_DOWNLOAD]:
+        if client:
+            client.add_message(message)
     else:
         logger.error("Mensaje no reconocido.")
 
 
-def start_server():
-    """Inicia el servidor UDP"""
-    args = parse_arguments()
-    server_data = ServerData()
-
-    server_data.storage_path = os.getcwd() + '/server/files'
-
+def configure_logging(args):
+    """Configura el nivel de logging según la verbosidad pedida"""
     if args.verbose:
         logger.setLevel(logging.DEBUG)
     elif args.quiet:
@@ -223,57 +762,174 @@ def start_server():
     else:
         logger.setLevel(logging.INFO)
 
+
+def create_server_socket(host, port, reuse_port=False):
+    """Crea el socket UDP del servidor. Con reuse_port varios procesos
+    pueden escuchar en el mismo puerto: el kernel reparte los datagramas
+    por hash de la 4-tupla, así que cada cliente queda fijo en un proceso"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    return sock
+
+
+def run_server(args, worker_index=None):
+    """Ejecuta el loop de un proceso del servidor"""
+    configure_logging(args)
+    if worker_index is not None:
+        # Detenerse ordenadamente cuando el proceso principal lo pide
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+    server_data = ServerData()
+
+    server_data.storage_path = os.getcwd() + '/server/files'
+
     if args.protocol is not None:
         server_data.protocol = args.protocol
 
     if args.storage is not None:
         server_data.storage_path = args.storage
 
-    # Crear directorio de almacenamiento si no existe
-    if not os.path.exists(server_data.storage_path):
-        os.makedirs(server_data.storage_path)
-        logger.info(f"Directorio de almacenamiento creado: "
-                    f"{server_data.storage_path}")
+    server_data.connected_sockets = args.connected_sockets
+    server_data.host = args.host
+    server_data.max_transfers = max(0, args.max_transfers)
+    server_data.max_queued = max(0, args.max_queued)
+    server_data.scheduler = SCHEDULERS[args.scheduler]()
+    if args.dedup:
+        server_data.content_store = ContentStore(server_data.storage_path)
+    server_data.storage = Storage(server_data.storage_path,
+                                  max(0, args.shard_depth), args.fsync,
+                                  max(0, args.group_commit_ms) / 1000,
+                                  args.pack_threshold)
+    server_data.storage.start()
+    server_data.catalog = Catalog(server_data.storage,
+                                  shared=worker_index is not None)
+    server_data.prefetch_depth = max(0, args.prefetch)
+    if args.peer:
+        server_data.replicator = Replicator(server_data.storage, args.peer,
+                                            server_data.protocol,
+                                            args.replication_jobs)
+        server_data.replicator.start()
+    # Sin pread (Windows) los bloques se leen directo del archivo
+    if args.cache_size and hasattr(os, "pread"):
+        server_data.chunk_cache = ChunkCache(args.cache_size)
 
     # Crear socket UDP
-    server_data.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    server_address = (args.host, args.port)
-    server_data.sock.bind(server_address)
+    server_data.sock = create_server_socket(
+        args.host, args.port, reuse_port=worker_index is not None)
+    server_data.egress = EgressScheduler(server_data.sock, args.max_rate,
+                                         args.client_rate, args.quota)
+    server_data.egress.start()
+    start_digest_pool(args.hash_workers)
 
     logger.info("\033[32m+-------------------------------------+")
     logger.info(f"\033[32m| Servidor iniciado en {args.host}:{args.port} |")
     logger.info("\033[32m+-------------------------------------+")
+    if worker_index is not None:
+        logger.info(f"Proceso {worker_index + 1} de {args.workers} "
+                    f"(pid {os.getpid()})")
     logger.info(f"Protocolo: {args.protocol}")
-
-    # Diccionario para mantener los clientes conectados
-    clients = dict[Any, Client]()
+    logger.info(f"Transferencias simultáneas: "
+                f"{server_data.max_transfers or 'sin límite'} "
+                f"(scheduler: {args.scheduler})")
 
     try:
         logger.info("Esperando mensajes...")
+        next_maintenance = time.time() + SERVER_POLL_INTERVAL
         while True:
             # Recibir mensaje
-            message, client_address = recv_message(server_data.sock)
+            message, client_address = recv_message(server_data.sock,
+                                                   SERVER_POLL_INTERVAL)
+
+            # Liberar los clientes que terminaron antes de despachar y
+            # ocupar sus lugares con los pedidos en espera
+            release_finished_clients(server_data)
+            schedule_pending_transfers(server_data)
 
             if message:
                 process_client_message(server_data, message, client_address)
 
+            if time.time() < next_maintenance:
+                continue
+            next_maintenance = time.time() + SERVER_POLL_INTERVAL
+
             # Verificar clientes inactivos
-            clients_to_remove = []
-            for addr, client in clients.items():
-                if client.is_timeout():
-                    logger.info(f"Cliente {addr} desconectado por timeout")
-                    clients_to_remove.append(addr)
+            for client in server_data.clients.values():
+                if client.is_timeout() and not client.stop_event.is_set():
+                    logger.info(f"Cliente {client.address} desconectado por "
+                                f"timeout")
+                    client.stop_event.set()
 
-            # Eliminar clientes inactivos
-            for addr in clients_to_remove:
-                del clients[addr]
+            expire_tombstones(server_data)
+            log_egress_stats(server_data)
+            if server_data.scheduler.expire():
+                logger.info("Se descartaron pedidos abandonados de la cola")
 
     except KeyboardInterrupt:
         logger.info("Deteniendo servidor...")
-        logger.info(f"Desconectando {len(clients)} clientes activos")
+        logger.info(f"Desconectando {len(server_data.clients)} clientes "
+                    f"activos")
+        for client in server_data.clients.values():
+            client.stop_event.set()
+        if server_data.replicator:
+            server_data.replicator.stop()
+            logger.info(f"Replicación: {server_data.replicator.stats}")
+        server_data.egress.stop()
+        server_data.storage.stop()
+        stop_digest_pool()
+        logger.info(f"Salida: {server_data.egress.stats}")
+        if server_data.chunk_cache:
+            logger.info(f"Caché: {server_data.chunk_cache.stats}")
+        if server_data.prefetch_depth:
+            logger.info(f"Lectura anticipada: {server_data.prefetch_stats}")
         server_data.sock.close()
         logger.info("Servidor detenido.")
 
 
+def start_server():
+    """Inicia el servidor UDP, en uno o en varios procesos"""
+    args = parse_arguments()
+    configure_logging(args)
+
+    # Crear directorio de almacenamiento si no existe
+    storage_path = args.storage or os.getcwd() + '/server/files'
+    if not os.path.exists(storage_path):
+        os.makedirs(storage_path)
+        logger.info(f"Directorio de almacenamiento creado: {storage_path}")
+    if args.dedup:
+        # Antes de atender pedidos: ningún flujo puede estar enlazando blobs
+        freed = ContentStore(storage_path).collect_garbage()
+        if freed:
+            logger.info(f"Se liberaron {freed} bytes de contenido sin "
+                        f"referencias")
+
+    if args.workers <= 1:
+        run_server(args)
+        return
+
+    if not hasattr(socket, "SO_REUSEPORT"):
+        logger.error("SO_REUSEPORT no está disponible en esta plataforma.")
+        return
+
+    # Cada proceso abre su propio socket en el mismo puerto y atiende a los
+    # clientes que el kernel le asigna; el almacenamiento se coordina con
+    # creación atómica y locks de archivo
+    workers = [Process(target=run_server, args=(args, index))
+               for index in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    # Un SIGTERM al proceso principal detiene también a los procesos hijos
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in workers:
+            worker.join()
+
+
 if __name__ == "__main__":
     start_server()
@@ -1,20 +1,19 @@
 import argparse
-from datetime import datetime, timedelta
-import hashlib
+from datetime import datetime
 import logging
 import os
-import queue
 import socket
 import sys
-from threading import Event, Thread
-from client.udp_stop_and_wait.upload import upload_saw_client
-from client.udp_selective_repeat.upload import upload_sr_client
-from message.message import Message, MessageType
-from message.utils import recv_message
+from client.session_mux import SessionMux
+from client.sync import plan_upload_sync, verify_bundle_uploads
+from client.transfers import UploadJob, run_transfers
+from utils.compression import COMPRESSION_CHOICES, NO_COMPRESSION
 from utils.misc import CustomHelpFormatter
 from utils.logger import logger
+from utils.rate_limit import RateLimitedSocket, parse_rate
 
 DEFAULT_PROTOCOL = 'udp_saw'
+DEFAULT_JOBS = 4
 
 # Enable console colors on Windows
 if os.name == 'nt':
@@ -41,12 +40,28 @@ def parse_arguments():
     parser.add_argument("-s", "--src", metavar="FILEPATH", type=str,
                         required=True, help="source file path")
     parser.add_argument("-n", "--name", metavar="FILENAME", type=str,
-                        required=True, help="file name")
+                        help="file name (required unless --sync)")
 
     parser.add_argument("-r", "--protocol", metavar="protocol", type=str,
                         help="error recovery protocol",
                         default=DEFAULT_PROTOCOL,
                         choices=["udp_saw", "udp_sr"])
+    parser.add_argument("-c", "--compression", metavar="compression",
+                        type=str, help="payload compression",
+                        default=NO_COMPRESSION, choices=COMPRESSION_CHOICES)
+    parser.add_argument("-D", "--delta", action="store_true",
+                        help="send only the changes against the server copy")
+    parser.add_argument("-S", "--sync", action="store_true",
+                        help="upload every new or changed file in FILEPATH")
+    parser.add_argument("-j", "--jobs", metavar="JOBS", type=int,
+                        default=DEFAULT_JOBS,
+                        help="concurrent transfers in sync mode")
+    parser.add_argument("--no-bundle", action="store_true",
+                        help="in sync mode, transfer small files one by one "
+                             "instead of grouped in bundles")
+    parser.add_argument("--rate", metavar="RATE", type=parse_rate,
+                        help="rate cap in bytes/s for the whole client "
+                             "(e.g. 512K, 10M)")
 
     parser.usage = parser.format_usage()
     for a in parser._actions:
@@ -56,7 +71,8 @@ def parse_arguments():
 
 
 def start():
-    """Inicia el cliente para subir un archivo"""
+    """Inicia el cliente para subir un archivo, o todos los archivos nuevos
+    o modificados de un directorio con --sync"""
     parser, args = parse_arguments()
 
     # Configuración del nivel de logging
@@ -67,7 +83,8 @@ def start():
     else:
         logger.setLevel(logging.INFO)
 
-    if not args.host or not args.port or not args.src or not args.name:
+    if (not args.host or not args.port or not args.src or
+            not (args.name or args.sync)):
         parser.print_help(sys.stderr)
         return -1
 
@@ -75,7 +92,6 @@ def start():
     host = args.host
     port = args.port
     path = args.src
-    upload_file_name = args.name
     protocol = args.protocol
 
     # Validar el archivo fuente
@@ -83,81 +99,48 @@ def start():
         logger.error(f"El archivo fuente no existe: {path}")
         return -1
 
-    filename = os.path.join(path, upload_file_name)
-    file = open(filename, "rb")
-
-    file_read_for_digest: bytes
-    with open(filename, 'rb') as file_read_for_digest:
-        file_read_for_digest = file_read_for_digest.read()
-    md5_digest = hashlib.md5(file_read_for_digest).hexdigest()
-
     logger.info("\033[32m+---------------------------------------+")
     logger.info(f"\033[32m| Conectando al servidor {host}:{port} |")
     logger.info("\033[32m+---------------------------------------+")
     logger.info(f"Protocolo seleccionado: {protocol}")
-    logger.info(f"Empiezo proceso de subida para el archivo: "
-                f"{upload_file_name}")
-    logger.info(f"Digest del archivo: {md5_digest}")
 
-    # Crear socket UDP
+    # Crear socket UDP; cada transferencia usa su propia sesión
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if args.rate:
+        sock = RateLimitedSocket(sock, args.rate)
     server_address = (host, port)
+    mux = SessionMux(sock)
+    start_time = datetime.now()
 
-    # Crear cola de mensajes
-    message_queue = queue.Queue()
+    try:
+        if args.sync:
+            jobs = plan_upload_sync(mux, server_address, path, protocol,
+                                    args.compression, not args.no_bundle)
+            if jobs is None:
+                logger.error("No se ha recibido respuesta del servidor.")
+                return -1
+        else:
+            logger.info(f"Empiezo proceso de subida para el archivo: "
+                        f"{args.name}")
+            jobs = [UploadJob(os.path.join(path, args.name), args.name,
+                              protocol, args.compression, args.delta)]
+        failures = run_transfers(mux, server_address, jobs, args.jobs)
+        # Los bundles no informan el resultado de cada archivo: se verifica
+        # con el catálogo
+        if args.sync and verify_bundle_uploads(mux, server_address, jobs):
+            failures += 1
+    except KeyboardInterrupt:
+        logger.info("Se ha interrumpido la transferencia.")
+        return -1
+    finally:
+        sock.close()
 
-    # Enviar mensaje de subida
-    upload_message = Message.upload(
-        os.path.getsize(filename), upload_file_name, md5_digest)
-    start_time = datetime.now()
-    stop_event = Event()
-
-    # Seleccionar protocolo de envío
-    send_protocol = (upload_sr_client if protocol == "udp_sr"
-                     else upload_saw_client)
-
-    send_worker = Thread(target=send_protocol,
-                         args=(upload_message, sock, server_address,
-                               message_queue, file, stop_event))
-    send_worker.start()
-
-    # Manejo de timeout
-    timeout = datetime.now() + timedelta(seconds=15)
-    timeout_exit = True
-    while datetime.now() < timeout:
-        try:
-            message, _ = recv_message(sock)
-            if not send_worker.is_alive():
-                timeout_exit = False
-                break
-            if message:
-                if message.get_type() in [MessageType.ACK, MessageType.ERROR,
-                                          MessageType.END, MessageType.DATA,
-                                          MessageType.ACK_END]:
-                    message_queue.put(message)
-                    timeout = datetime.now() + timedelta(seconds=15)
-                else:
-                    logger.error("Mensaje no reconocido.")
-                    return -1
-        except KeyboardInterrupt:
-            stop_event.set()
-            logger.info("Se ha interrumpido la transferencia.")
-            if file:
-                file.close()
-            sock.close()
-            return -1
-
-    if timeout_exit:
-        stop_event.set()
-        logger.error("No se ha recibido respuesta del servidor.")
-    else:
-        logger.info(f"\033[34mTiempo de transferencia: "
-                    f"{datetime.now() - start_time}\033[0m")
-    if file:
-        file.close()
-    sock.close()
+    if failures:
+        return -1
+    logger.info(f"\033[34mTiempo de transferencia: "
+                f"{datetime.now() - start_time}\033[0m")
     return 0
 
 
 if __name__ == "__main__":
-    start()
+    sys.exit(start())
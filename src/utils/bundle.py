@@ -0,0 +1,75 @@
+import hashlib
+
+# Un bundle agrupa varios archivos chicos en una sola transferencia: un
+# handshake y un cierre para todos. Empieza con un manifiesto de líneas
+# nombre|tamaño|md5 terminado por una línea vacía, seguido de los
+# contenidos en el mismo orden
+MANIFEST_SEPARATOR = b'\n'
+
+# Archivos más grandes se transfieren por separado: el bundle se arma en
+# memoria y ahí no se gana nada con evitar el handshake
+BUNDLE_FILE_MAX_SIZE = 256 * 1024
+BUNDLE_MAX_SIZE = 8 * 1024 * 1024
+BUNDLE_MAX_FILES = 256
+# Espacio para los nombres de una descarga agrupada: viajan en el DOWNLOAD
+BUNDLE_NAMES_MAX_SIZE = 2048
+
+
+def bundle_batches(files, names_max_size=BUNDLE_NAMES_MAX_SIZE):
+    """Reparte los archivos (nombre, tamaño) en grupos que respetan los
+    límites de un bundle. Devuelve la lista de grupos de nombres"""
+    batches = []
+    batch, size, names_size = [], 0, 0
+    for name, file_size in files:
+        name_size = len(name.encode('utf-8')) + len(MANIFEST_SEPARATOR)
+        if batch and (len(batch) >= BUNDLE_MAX_FILES or
+                      size + file_size > BUNDLE_MAX_SIZE or
+                      names_size + name_size > names_max_size):
+            batches.append(batch)
+            batch, size, names_size = [], 0, 0
+        batch.append(name)
+        size += file_size
+        names_size += name_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def write_bundle(members, output):
+    """Escribe el bundle de los archivos (nombre, contenido) en output.
+    Devuelve el MD5 de todo lo escrito"""
+    digest = hashlib.md5()
+    manifest = b''.join(
+        f"{name}|{len(data)}|{hashlib.md5(data).hexdigest()}".encode('utf-8')
+        + MANIFEST_SEPARATOR for name, data in members)
+    parts = [manifest + MANIFEST_SEPARATOR] + [data for _, data in members]
+    for part in parts:
+        output.write(part)
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def read_manifest(file):
+    """Lee el manifiesto de un bundle: lista de (nombre, tamaño, md5).
+    Lanza ValueError si está mal formado"""
+    entries = []
+    while True:
+        line = file.readline()
+        if not line.endswith(MANIFEST_SEPARATOR):
+            raise ValueError("Manifiesto del bundle incompleto")
+        if line == MANIFEST_SEPARATOR:
+            return entries
+        name, size, digest = line[:-1].decode('utf-8').rsplit("|", 2)
+        entries.append((name, int(size), digest))
+
+
+def read_bundle(file):
+    """Recorre un bundle devolviendo (nombre, contenido, md5) por cada
+    archivo. El md5 es None si el contenido no coincide con el del
+    manifiesto. Lanza ValueError si el bundle está mal formado"""
+    for name, size, digest in read_manifest(file):
+        data = file.read(size)
+        if len(data) != size:
+            raise ValueError(f"Bundle truncado en {name}")
+        yield name, data, (digest if hashlib.md5(data).hexdigest() == digest
+                           else None)
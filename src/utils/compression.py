@@ -0,0 +1,169 @@
+import bz2
+import lzma
+import zlib
+from enum import Enum
+from message.message import DATA_MAX_SIZE
+from utils.logger import logger
+
+# Muestra del inicio del archivo con la que se decide si vale la pena
+# comprimir
+SAMPLE_SIZE = 64 * 1024
+# Si la muestra no baja de esta fracción de su tamaño, el archivo se
+# considera incompresible y la transferencia va sin compresión
+INCOMPRESSIBLE_RATIO = 0.9
+# Bloques seguidos que no se achican antes de dejar de intentar comprimir
+MAX_COMPRESSION_MISSES = 8
+
+NO_COMPRESSION = 'none'
+
+LZMA_FILTERS = [{"id": lzma.FILTER_LZMA2, "preset": 1}]
+
+
+class Encoding(Enum):
+    """Codificación de un bloque, en el primer byte del payload del DATA
+    cuando la transferencia negoció compresión"""
+    RAW = 0
+    ZLIB = 1
+    LZMA = 2
+    BZ2 = 3
+    # Bloque de ceros: solo viaja su longitud
+    ZERO = 4
+
+
+ZERO_LENGTH_BYTES = 4
+
+
+def bounded_decompress(new_decompressor):
+    """Envuelve un descompresor incremental para que un bloque no produzca
+    más de DATA_MAX_SIZE bytes: los datos vienen de la red y unos pocos
+    bytes comprimidos pueden expandirse a gigabytes. Un bloque que excede
+    el límite, queda incompleto o trae datos de más es un error de
+    protocolo (ValueError)"""
+    def decompress(data):
+        decompressor = new_decompressor()
+        try:
+            # Un byte de más para distinguir un bloque del tamaño máximo de
+            # uno que lo excede
+            output = decompressor.decompress(data, DATA_MAX_SIZE + 1)
+        except (zlib.error, lzma.LZMAError, OSError) as e:
+            raise ValueError(f"Bloque comprimido inválido: {e}") from e
+        if (len(output) > DATA_MAX_SIZE or not decompressor.eof or
+                decompressor.unused_data or
+                getattr(decompressor, 'unconsumed_tail', b'')):
+            raise ValueError("Bloque comprimido inválido")
+        return output
+    return decompress
+
+
+CODECS = {
+    'zlib': (Encoding.ZLIB, lambda data: zlib.compress(data, 6),
+             bounded_decompress(zlib.decompressobj)),
+    'lzma': (Encoding.LZMA,
+             lambda data: lzma.compress(data, lzma.FORMAT_RAW,
+                                        filters=LZMA_FILTERS),
+             bounded_decompress(
+                 lambda: lzma.LZMADecompressor(lzma.FORMAT_RAW,
+                                               filters=LZMA_FILTERS))),
+    'bz2': (Encoding.BZ2, lambda data: bz2.compress(data, 9),
+            bounded_decompress(bz2.BZ2Decompressor)),
+}
+
+DECOMPRESSORS = {encoding: decompress
+                 for encoding, _, decompress in CODECS.values()}
+
+COMPRESSION_CHOICES = [NO_COMPRESSION] + list(CODECS)
+
+
+def is_supported(compression):
+    """Comprueba si la compresión pedida es una de las conocidas"""
+    return compression in CODECS
+
+
+def choose_compression(sample, requested):
+    """Decide la compresión de una transferencia a partir de una muestra del
+    inicio del archivo: si no se achica lo suficiente no se comprime"""
+    if not is_supported(requested) or not sample:
+        return NO_COMPRESSION
+    _, compress, _ = CODECS[requested]
+    ratio = len(compress(sample)) / len(sample)
+    if ratio > INCOMPRESSIBLE_RATIO:
+        logger.info(f"El archivo no es compresible ({ratio:.2f}), se envía "
+                    f"sin compresión")
+        return NO_COMPRESSION
+    logger.info(f"Compresión {requested} (muestra al {ratio:.0%})")
+    return requested
+
+
+def sample_file(file):
+    """Lee la muestra del inicio del archivo sin mover su posición"""
+    position = file.tell()
+    file.seek(0)
+    sample = file.read(SAMPLE_SIZE)
+    file.seek(position)
+    return sample
+
+
+class IdentityCodec:
+    """Codec de una transferencia sin compresión: los bloques viajan tal
+    cual, sin byte de codificación"""
+    name = NO_COMPRESSION
+
+    def encode(self, chunk):
+        return chunk
+
+    def decode(self, payload):
+        return payload
+
+
+class ChunkCodec:
+    """Codec de una transferencia comprimida. Cada bloque lleva un byte con
+    su codificación: comprimido, crudo si comprimirlo no lo achica, o la
+    marca de bloque de ceros"""
+    def __init__(self, name):
+        """
+        Inicializa el codec
+
+        Args:
+            name: Nombre de la compresión negociada (clave de CODECS)
+        """
+        self.name = name
+        self.encoding, self.compress, _ = CODECS[name]
+        self.misses = 0
+
+    def encode(self, chunk):
+        """Codifica un bloque del archivo para el payload de un DATA"""
+        if chunk == bytes(len(chunk)):
+            return (bytes([Encoding.ZERO.value]) +
+                    len(chunk).to_bytes(ZERO_LENGTH_BYTES, 'big'))
+        if self.misses < MAX_COMPRESSION_MISSES:
+            compressed = self.compress(chunk)
+            if len(compressed) < len(chunk):
+                self.misses = 0
+                return bytes([self.encoding.value]) + compressed
+            self.misses += 1
+            if self.misses == MAX_COMPRESSION_MISSES:
+                logger.debug("Los datos dejaron de ser compresibles, se "
+                             "envían sin comprimir")
+        return bytes([Encoding.RAW.value]) + chunk
+
+    def decode(self, payload):
+        """Recupera el bloque original a partir del payload de un DATA.
+        Lanza ValueError si el payload no es un bloque válido"""
+        if not payload:
+            raise ValueError("Bloque sin codificación")
+        encoding = Encoding(payload[0])
+        if encoding == Encoding.RAW:
+            return payload[1:]
+        if encoding == Encoding.ZERO:
+            length = int.from_bytes(payload[1:], 'big')
+            if length > DATA_MAX_SIZE:
+                raise ValueError(f"Bloque de ceros inválido: {length}")
+            return bytes(length)
+        return DECOMPRESSORS[encoding](payload[1:])
+
+
+def chunk_codec(compression):
+    """Devuelve el codec de la compresión negociada para una transferencia"""
+    if is_supported(compression):
+        return ChunkCodec(compression)
+    return IdentityCodec()
@@ -0,0 +1,258 @@
+import hashlib
+from itertools import accumulate
+from math import isqrt
+
+# Tamaño de bloque de las firmas: crece con la raíz del tamaño del archivo
+# (como rsync) para acotar tanto la firma como la granularidad del delta
+MIN_BLOCK_SIZE = 1024
+MAX_BLOCK_SIZE = 64 * 1024
+
+BLOCK_SIZE_BYTES = 4
+WEAK_CHECKSUM_BYTES = 4
+STRONG_HASH_BYTES = 16
+SIGNATURE_ENTRY_BYTES = WEAK_CHECKSUM_BYTES + STRONG_HASH_BYTES
+
+# Operaciones del delta: copiar bloques de la copia del servidor o insertar
+# bytes literales
+COPY_OP = b'C'
+LITERAL_OP = b'L'
+INDEX_BYTES = 4
+LENGTH_BYTES = 4
+# Literales más largos se parten en varias operaciones
+MAX_LITERAL_SIZE = 1024 * 1024
+
+CHECKSUM_MODULUS = 1 << 16
+CHECKSUM_MASK = CHECKSUM_MODULUS - 1
+# Lecturas del archivo al calcular un delta
+DELTA_READ_SIZE = 1024 * 1024
+
+
+def signature_block_size(file_size):
+    """Elige el tamaño de bloque de la firma de un archivo"""
+    return max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, isqrt(file_size)))
+
+
+def weak_checksum(block):
+    """Checksum débil de rsync: a es la suma de los bytes y b la suma de
+    las sumas parciales, ambas módulo 2^16"""
+    a = sum(block) % CHECKSUM_MODULUS
+    b = sum(accumulate(block)) % CHECKSUM_MODULUS
+    return a, b
+
+
+def strong_hash(block):
+    """Hash fuerte con el que se confirma una coincidencia del débil"""
+    return hashlib.md5(block).digest()
+
+
+def file_signature(filename):
+    """Calcula la firma de un archivo: el tamaño de bloque seguido del
+    checksum débil y el hash fuerte de cada bloque"""
+    with open(filename, 'rb') as file:
+        return stream_signature(file)
+
+
+def stream_signature(file):
+    """Calcula la firma de un archivo ya abierto, desde el principio"""
+    file.seek(0, 2)
+    block_size = signature_block_size(file.tell())
+    file.seek(0)
+    signature = [block_size.to_bytes(BLOCK_SIZE_BYTES, 'big')]
+    while block := file.read(block_size):
+        a, b = weak_checksum(block)
+        signature.append(
+            (a + (b << 16)).to_bytes(WEAK_CHECKSUM_BYTES, 'big') +
+            strong_hash(block))
+    return b"".join(signature)
+
+
+def parse_signature(signature):
+    """Devuelve el tamaño de bloque y un índice checksum débil -> lista de
+    (hash fuerte, número de bloque). Lanza ValueError si la firma está mal
+    formada"""
+    if len(signature) < BLOCK_SIZE_BYTES or (
+            (len(signature) - BLOCK_SIZE_BYTES) % SIGNATURE_ENTRY_BYTES):
+        raise ValueError("Firma mal formada")
+    block_size = int.from_bytes(signature[:BLOCK_SIZE_BYTES], 'big')
+    blocks = {}
+    for index, offset in enumerate(range(BLOCK_SIZE_BYTES, len(signature),
+                                         SIGNATURE_ENTRY_BYTES)):
+        weak = int.from_bytes(
+            signature[offset:offset + WEAK_CHECKSUM_BYTES], 'big')
+        strong = signature[offset + WEAK_CHECKSUM_BYTES:
+                           offset + SIGNATURE_ENTRY_BYTES]
+        blocks.setdefault(weak, []).append((strong, index))
+    return block_size, blocks
+
+
+def copy_op(index, count):
+    """Operación que copia count bloques desde el bloque index"""
+    return (COPY_OP + index.to_bytes(INDEX_BYTES, 'big') +
+            count.to_bytes(INDEX_BYTES, 'big'))
+
+
+def literal_ops(data):
+    """Operaciones que insertan los bytes dados"""
+    return [LITERAL_OP + len(data[i:i + MAX_LITERAL_SIZE]).to_bytes(
+                LENGTH_BYTES, 'big') + data[i:i + MAX_LITERAL_SIZE]
+            for i in range(0, len(data), MAX_LITERAL_SIZE)]
+
+
+def find_block(blocks, weak, data, start, block_size):
+    """Busca un bloque de la firma igual a data[start:start+block_size].
+    El hash fuerte solo se calcula si coincide el checksum débil"""
+    candidates = blocks.get(weak)
+    if not candidates:
+        return None
+    strong = strong_hash(data[start:start + block_size])
+    for candidate, index in candidates:
+        if candidate == strong:
+            return index
+    return None
+
+
+def compute_delta(source, signature, output):
+    """Calcula el delta que transforma la copia firmada en el contenido de
+    source y lo escribe en output a medida que se produce.
+
+    Recorre source con una ventana de un bloque y checksum rodante: si la
+    ventana coincide con un bloque de la firma se emite una copia y se
+    salta el bloque entero; si no, la ventana avanza un byte y ese byte
+    pasa al literal pendiente. En memoria solo quedan el literal pendiente,
+    que se emite al llegar a MAX_LITERAL_SIZE, y lo leído por delante de la
+    ventana. Devuelve cuántos bytes se reutilizan de la copia del servidor y
+    el MD5 del delta"""
+    block_size, blocks = parse_signature(signature)
+    digest = hashlib.md5()
+    data = b""
+    eof = False
+    reused = 0
+    literal_start = 0
+    copy_start = copy_count = 0
+    position = 0
+    a = b = None
+
+    def emit(op):
+        output.write(op)
+        digest.update(op)
+
+    def flush_copy():
+        nonlocal copy_count
+        if copy_count:
+            emit(copy_op(copy_start, copy_count))
+            copy_count = 0
+
+    def flush_literal(end):
+        nonlocal literal_start
+        if literal_start < end:
+            flush_copy()
+            for op in literal_ops(data[literal_start:end]):
+                emit(op)
+            literal_start = end
+
+    emit(block_size.to_bytes(BLOCK_SIZE_BYTES, 'big'))
+    while True:
+        # Para rodar la ventana hace falta el byte que sigue al bloque; lo
+        # ya emitido se descarta al leer más
+        if not eof and len(data) - position <= block_size:
+            chunk = source.read(DELTA_READ_SIZE)
+            eof = not chunk
+            data = data[literal_start:] + chunk
+            position -= literal_start
+            literal_start = 0
+            continue
+        if position + block_size > len(data):
+            break
+        if a is None:
+            a, b = weak_checksum(data[position:position + block_size])
+        index = find_block(blocks, a + (b << 16), data, position, block_size)
+        if index is not None:
+            flush_literal(position)
+            if copy_count and index == copy_start + copy_count:
+                copy_count += 1
+            else:
+                flush_copy()
+                copy_start, copy_count = index, 1
+            position += block_size
+            literal_start = position
+            reused += block_size
+            a = None
+            continue
+        if position + block_size == len(data):
+            # La última ventana completa del archivo
+            break
+        # Rodar la ventana hasta que el checksum débil tenga candidatos, sin
+        # pasar del byte leído ni del tamaño máximo del literal pendiente
+        end = min(len(data) - block_size, literal_start + MAX_LITERAL_SIZE)
+        while position < end:
+            outgoing = data[position]
+            incoming = data[position + block_size]
+            a = (a - outgoing + incoming) & CHECKSUM_MASK
+            b = (b - block_size * outgoing + a) & CHECKSUM_MASK
+            position += 1
+            if a + (b << 16) in blocks:
+                break
+        if position - literal_start >= MAX_LITERAL_SIZE:
+            flush_literal(position)
+
+    # El último bloque de la copia puede ser más corto que block_size
+    tail = data[literal_start:]
+    index = None
+    if 0 < len(tail) < block_size:
+        a, b = weak_checksum(tail)
+        index = find_block(blocks, a + (b << 16), tail, 0, len(tail))
+    if index is not None:
+        if copy_count and index == copy_start + copy_count:
+            copy_count += 1
+        else:
+            flush_copy()
+            copy_start, copy_count = index, 1
+        flush_copy()
+        reused += len(tail)
+    else:
+        flush_literal(len(data))
+        flush_copy()
+    return reused, digest.hexdigest()
+
+
+def apply_delta(basis, delta, output, max_size=None):
+    """Reconstruye el archivo nuevo en output a partir de la copia del
+    servidor (basis) y el delta, ambos archivos abiertos en binario.
+    Devuelve el MD5 del archivo reconstruido. Lanza ValueError si el delta
+    está mal formado, referencia bloques que la copia no tiene o
+    reconstruye más de max_size bytes"""
+    digest = hashlib.md5()
+    size = 0
+
+    def write(data):
+        nonlocal size
+        size += len(data)
+        if max_size is not None and size > max_size:
+            raise ValueError(f"El archivo reconstruido excede los "
+                             f"{max_size} bytes")
+        output.write(data)
+        digest.update(data)
+
+    block_size = int.from_bytes(delta.read(BLOCK_SIZE_BYTES), 'big')
+    if not block_size:
+        raise ValueError("Delta mal formado")
+    while op := delta.read(1):
+        if op == COPY_OP:
+            index = int.from_bytes(delta.read(INDEX_BYTES), 'big')
+            count = int.from_bytes(delta.read(INDEX_BYTES), 'big')
+            basis.seek(index * block_size)
+            for _ in range(count):
+                block = basis.read(block_size)
+                if not block:
+                    raise ValueError(f"El delta referencia el bloque "
+                                     f"{index}, que no existe")
+                write(block)
+        elif op == LITERAL_OP:
+            length = int.from_bytes(delta.read(LENGTH_BYTES), 'big')
+            data = delta.read(length)
+            if len(data) != length:
+                raise ValueError("Delta truncado")
+            write(data)
+        else:
+            raise ValueError(f"Operación de delta desconocida: {op}")
+    return digest.hexdigest()
@@ -0,0 +1,80 @@
+import hashlib
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from utils.logger import logger
+
+# Bloque de lectura al calcular el digest de un archivo
+DIGEST_CHUNK_SIZE = 1024 * 1024
+
+# Pool de procesos del proceso actual (None: se calcula en el thread)
+_executor = None
+
+
+def file_md5(filename):
+    """Calcula el MD5 de un archivo leyéndolo por bloques"""
+    digest = hashlib.md5()
+    with open(filename, 'rb') as file:
+        while chunk := file.read(DIGEST_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def range_md5(filename, offset, length):
+    """Calcula el MD5 de un rango de un archivo leyéndolo por bloques"""
+    digest = hashlib.md5()
+    with open(filename, 'rb') as file:
+        file.seek(offset)
+        while length > 0:
+            chunk = file.read(min(length, DIGEST_CHUNK_SIZE))
+            if not chunk:
+                break
+            digest.update(chunk)
+            length -= len(chunk)
+    return digest.hexdigest()
+
+
+def start_digest_pool(workers):
+    """Crea el pool de procesos que calcula los digests. Con 0 workers los
+    digests se calculan en el thread que los pide"""
+    global _executor
+    if workers <= 0:
+        return
+    # spawn: hacer fork de un proceso con threads puede heredar locks
+    # tomados por otros threads
+    _executor = ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context('spawn'))
+    # Levantar los procesos ahora y no en la primera transferencia
+    _executor.submit(int).result()
+
+
+def stop_digest_pool():
+    """Detiene el pool de procesos, descartando los cálculos pendientes"""
+    global _executor
+    if _executor:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def submit_digest(function, filename, *args) -> Future:
+    """Calcula function(filename, *args) fuera del proceso y devuelve un
+    Future: quien lo pide puede seguir atendiendo la red mientras tanto y
+    el GIL queda libre para los demás threads. Sin pool lo calcula en el
+    thread actual"""
+    if _executor:
+        try:
+            return _executor.submit(function, filename, *args)
+        except RuntimeError as e:  # Pool roto o detenido
+            logger.error(f"No se pudo usar el pool de digests: {e}")
+    future = Future()
+    future.set_result(function(filename, *args))
+    return future
+
+
+def submit_file_md5(filename) -> Future:
+    """Calcula el MD5 de un archivo en el pool"""
+    return submit_digest(file_md5, filename)
+
+
+def resolve_digest(digest):
+    """Devuelve el digest, esperando el resultado si todavía se calcula"""
+    return digest.result() if isinstance(digest, Future) else digest
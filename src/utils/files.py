@@ -0,0 +1,69 @@
+import io
+import os
+import tempfile
+
+
+def create_temp_beside(path, suffix=".part"):
+    """Crea un temporal oculto en el directorio de path, para reemplazarlo
+    después con os.replace. Devuelve (fd, ruta del temporal). El temporal
+    tiene los permisos de un archivo común: mkstemp lo crea solo legible
+    por el dueño"""
+    directory, name = os.path.split(path)
+    fd, temp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=suffix,
+                                     dir=directory or ".")
+    os.fchmod(fd, 0o644)
+    return fd, temp_path
+
+
+class RandomAccessFile(io.RawIOBase):
+    """Archivo de solo lectura de size bytes armado sobre otra fuente (un
+    caché, un mmap, un rango de otro archivo). Mantiene su propia posición;
+    las subclases solo implementan _read_at"""
+    def __init__(self, size):
+        """
+        Inicializa el archivo
+
+        Args:
+            size: Tamaño del contenido
+        """
+        super().__init__()
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def _read_at(self, offset, size):
+        """Devuelve hasta size bytes del contenido desde offset. Se llama
+        solo con rangos dentro del archivo; devolver menos es fin de
+        datos"""
+        raise NotImplementedError
+
+    def read(self, size=-1):
+        remaining = self.size - self.position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return b''
+        data = self._read_at(self.position, size)
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
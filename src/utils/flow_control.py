@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+from message.message import DATA_MAX_SIZE, NO_WINDOW
+
+# Paquetes que un receptor acepta tener pendientes de procesar. Se mantiene
+# por debajo de lo que entra en el buffer por defecto del socket UDP (~200
+# KB): una ventana mayor se pierde en el kernel antes de llegar a la cola
+RECEIVE_BUFFER_PACKETS = 48
+
+
+def advertised_window(buffered_packets, file):
+    """Calcula la ventana a anunciar en los ACK: el buffer de recepción
+    menos los paquetes fuera de orden guardados en memoria. Si el archivo
+    se escribe en diferido (tiene free_space) el buffer se limita a lo que
+    le queda libre al writer: con el disco lento lo pendiente crece y la
+    ventana se achica, frenando al emisor. Un archivo que se escribe en el
+    momento no retiene nada."""
+    packets = RECEIVE_BUFFER_PACKETS
+    if hasattr(file, "free_space"):
+        packets = min(packets, file.free_space() // DATA_MAX_SIZE)
+    return max(0, packets - max(0, buffered_packets))
+
+
+class PeerWindow:
+    """Ventana de recepción anunciada por el otro extremo, vista desde el
+    emisor: limita la cantidad de paquetes en vuelo"""
+    def __init__(self, rtt):
+        """
+        Inicializa la ventana
+
+        Args:
+            rtt: RttEstimator del que se deriva el timer de persistencia
+        """
+        self.rtt = rtt
+        self.window = NO_WINDOW
+        self.in_flight = 0
+        self.persist_deadline = None
+
+    def update(self, message):
+        """Toma la ventana anunciada en un ACK"""
+        self.window = message.get_window()
+
+    def packet_sent(self):
+        """Registra el envío de un paquete nuevo"""
+        self.in_flight += 1
+
+    def packet_acked(self):
+        """Registra la confirmación de un paquete en vuelo"""
+        self.in_flight = max(0, self.in_flight - 1)
+
+    def can_send(self):
+        """Comprueba si se puede enviar un paquete nuevo. Con la ventana
+        cerrada y nada en vuelo se habilita un paquete cada PTO, que sirve
+        de sonda para recibir la actualización de la ventana."""
+        if self.in_flight < self.window:
+            self.persist_deadline = None
+            return True
+        if self.in_flight > 0:
+            return False
+        now = datetime.now()
+        if self.persist_deadline is None:
+            self.persist_deadline = now + timedelta(seconds=self.rtt.pto())
+            return False
+        if now > self.persist_deadline:
+            self.persist_deadline = None
+            return True
+        return False
@@ -6,3 +6,11 @@ class CustomHelpFormatter(argparse.HelpFormatter):
         if action.metavar == '\b':
             return ', '.join(action.option_strings)
         return super()._format_action_invocation(action)
+
+
+def parse_address(value):
+    """Convierte HOST:PORT en una dirección (host, port)"""
+    host, separator, port = value.rpartition(':')
+    if not separator or not host or not port.isdigit():
+        raise argparse.ArgumentTypeError(f"invalid address: {value}")
+    return host, int(port)
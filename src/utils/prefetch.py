@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+from message.message import DATA_MAX_SIZE
+from utils.files import RandomAccessFile
+
+# Bloques leídos por adelantado: una ventana de envío típica, acotada para
+# no retener demasiada memoria por transferencia
+DEFAULT_PREFETCH_CHUNKS = 64
+
+
+class PrefetchStats:
+    """Contadores de lectura anticipada, acumulables entre transferencias"""
+    def __init__(self):
+        self.hits = 0
+        self.stalls = 0
+        self.direct_reads = 0
+        self.stall_time = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, other):
+        """Suma los contadores de otra transferencia"""
+        with self.lock:
+            self.hits += other.hits
+            self.stalls += other.stalls
+            self.direct_reads += other.direct_reads
+            self.stall_time += other.stall_time
+
+    def hit_ratio(self):
+        """Proporción de bloques que ya estaban leídos al pedirlos"""
+        total = self.hits + self.stalls + self.direct_reads
+        return self.hits / total if total else 0
+
+    def __repr__(self):
+        return (f"PrefetchStats(hits={self.hits}, stalls={self.stalls}, "
+                f"direct_reads={self.direct_reads}, "
+                f"hit_ratio={self.hit_ratio():.2f}, "
+                f"stall_time={self.stall_time:.3f}s)")
+
+
+class PrefetchReader(RandomAccessFile):
+    """Archivo de solo lectura que un thread lee por adelantado, bloque a
+    bloque, hasta depth bloques por delante del último pedido. Así el loop
+    que envía y procesa ACKs no se bloquea leyendo el disco. Los pedidos
+    hacia atrás (fuera de lo leído) se leen directo del archivo"""
+    def __init__(self, file, stats=None, depth=DEFAULT_PREFETCH_CHUNKS,
+                 chunk_size=DATA_MAX_SIZE):
+        """
+        Inicializa el lector y arranca el thread de lectura
+
+        Args:
+            file: Archivo abierto; desde ahora solo se accede a través del
+                lector
+            stats: PrefetchStats donde se suman los contadores al cerrar
+            depth: Bloques que se leen por adelantado
+            chunk_size: Tamaño de los bloques que piden los workers
+        """
+        super().__init__(file.seek(0, os.SEEK_END))
+        self.file = file
+        self.shared_stats = stats
+        self.stats = PrefetchStats()
+        self.depth = depth
+        self.chunk_size = chunk_size
+        self.chunk_count = -(-self.size // chunk_size)
+        # Bloques leídos y todavía no pedidos
+        self.chunks = {}
+        # Próximo bloque que lee el thread
+        self.next_index = 0
+        # Bloque que el thread está leyendo en este momento
+        self.reading = None
+        self.stopped = False
+        self.condition = threading.Condition()
+        # El archivo se comparte entre el thread y las lecturas directas
+        self.file_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.prefetch, daemon=True)
+        self.thread.start()
+
+    def read_chunk(self, index):
+        """Lee un bloque del archivo"""
+        with self.file_lock:
+            self.file.seek(index * self.chunk_size)
+            return self.file.read(self.chunk_size)
+
+    def prefetch(self):
+        """Loop del thread: lee el próximo bloque mientras haya lugar"""
+        while True:
+            with self.condition:
+                while not self.stopped and (
+                        len(self.chunks) >= self.depth or
+                        self.next_index >= self.chunk_count):
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                index = self.reading = self.next_index
+                self.next_index += 1
+            try:
+                chunk = self.read_chunk(index)
+            except (OSError, ValueError):
+                # El pedido lo va a leer directo y verá el error
+                chunk = None
+            with self.condition:
+                if chunk is not None:
+                    self.chunks[index] = chunk
+                self.reading = None
+                self.condition.notify_all()
+
+    def pending(self, index):
+        """Indica si el thread todavía va a entregar el bloque"""
+        return not self.stopped and (index >= self.next_index or
+                                     index == self.reading)
+
+    def get_chunk(self, index):
+        """Devuelve el bloque pedido: ya leído, esperando al thread si está
+        por leerlo, o leído directo si quedó atrás"""
+        with self.condition:
+            # Los bloques anteriores ya no se van a pedir
+            for old in [key for key in self.chunks if key < index]:
+                del self.chunks[old]
+            if index >= self.next_index + self.depth:
+                # Salto hacia adelante: el thread sigue desde acá
+                self.next_index = index
+            self.condition.notify_all()
+            if index in self.chunks:
+                self.stats.hits += 1
+                return self.chunks.pop(index)
+            stall_start = time.monotonic()
+            while self.pending(index):
+                self.condition.wait()
+                if index in self.chunks:
+                    self.stats.stalls += 1
+                    self.stats.stall_time += time.monotonic() - stall_start
+                    return self.chunks.pop(index)
+        self.stats.direct_reads += 1
+        return self.read_chunk(index)
+
+    def _read_at(self, offset, size):
+        """Arma el resultado con bloques"""
+        parts = []
+        while size > 0:
+            index, start = divmod(offset, self.chunk_size)
+            part = self.get_chunk(index)[start:start + size]
+            if not part:
+                break
+            parts.append(part)
+            offset += len(part)
+            size -= len(part)
+        return b''.join(parts)
+
+    def close(self):
+        """Detiene el thread, suma las métricas y cierra el archivo"""
+        if self.closed:
+            return
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()
+        if self.shared_stats:
+            self.shared_stats.add(self.stats)
+        self.file.close()
+        super().close()
@@ -1,7 +1,13 @@
-from message.message import DATA_MAX_SIZE, Message, MessageType, ErrorCode
+from datetime import datetime, timedelta
+from message.message import (
+    DATA_MAX_SIZE, Message, MessageType, ErrorCode
+)
 from message.utils import send_ack, send_message, send_message_and_retry, \
-    send_message_and_wait
+    send_message_and_wait, get_message_from_queue
+from utils.digest import resolve_digest
+from utils.flow_control import advertised_window
 from utils.logger import logger
+from utils.rtt import MAX_END_PROBES, RttEstimator, TailLossProbe
 
 
 def read_file(file, chunk_size, offset):
@@ -16,10 +22,24 @@ def init_window(message):
     package_amount = (file_size // DATA_MAX_SIZE) + 1
     window_base = 0
     logger.debug("package_amount: " + str(package_amount))
-    window_top = 1 if package_amount < 2 else package_amount // 4
+    window_top = max(1, package_amount // 4)
     return package_amount, window_base, window_top
 
 
+def send_tail_loss_probe(tlp, sended_messages, acknowledgements, window_base,
+                         window_top, socket, address):
+    """Si venció el PTO sin recibir ACKs, reenvía el paquete pendiente más
+    alto de la ventana para provocar su confirmación sin esperar al RTO"""
+    if not tlp.is_due():
+        return
+    for i in range(window_top - 1, window_base - 1, -1):
+        if sended_messages[i] and not acknowledgements[i]:
+            logger.debug(f"Tail loss probe: reenviando paquete {i}")
+            send_message(sended_messages[i], socket, address, 1.5)
+            tlp.probe_sent()
+            return
+
+
 def send_error_message(message, socket, address, message_queue, stop_event,
                        trigger_retry_message):
     error_response = send_message_and_retry(
@@ -41,61 +61,99 @@ def has_errors(first_message_recv, initial_message):
 
 def recv_data_message(message, socket, address, received_messages,
                       received_data, package_to_receive_size, window_base,
-                      window_top, received_packages, file):
+                      window_top, received_packages, file, codec=None):
+    """Procesa un DATA recibido con Selective Repeat y lo confirma. El bloque
+    se decodifica antes del ACK: lanza ValueError si no se puede, sin
+    confirmarlo"""
     seqNumber = message.get_seq_number()
     if not received_messages[seqNumber]:
+        data = message.get_data()
+        received_data[seqNumber] = codec.decode(data) if codec else data
         received_messages[seqNumber] = True
-        received_data[seqNumber] = message.get_data()
         received_packages += 1
         logger.debug(f"Received packages {received_packages}")
         logger.debug(f"Window_base {window_base} and window_top {window_top}")
 
         # move window
         while received_messages[window_base]:
-            file.write(received_data[window_base])
+            if received_data[window_base] is not None:
+                file.write(received_data[window_base])
+                # Liberar el bloque: solo se retienen los fuera de orden
+                received_data[window_base] = None
             if (window_base + 1) < package_to_receive_size:
                 window_base += 1
                 if (window_top) < package_to_receive_size:
                     window_top += 1
             else:
                 break
-    # send ack
-    send_ack(seqNumber, socket, address)
+    # send ack, anunciando lo que queda libre para recibir
+    window = advertised_window(received_packages - window_base, file)
+    send_ack(seqNumber, socket, address, window)
     return window_base, window_top, received_packages
 
 
-def end_send_protocol(message_queue, socket, address, stop_event):
+def abort_on_invalid_data(error, socket, address, message_queue, stop_event,
+                          rtt=None):
+    """Corta una recepción en la que llegó un bloque que no se puede
+    decodificar: responde con un ERROR y lo repite ante cada mensaje que
+    siga llegando durante el cierre, por si se perdió. Quien la llama borra
+    lo recibido"""
+    logger.error(f"Se corta la transferencia: {error}")
+    error_message = Message.error(ErrorCode.INVALID_REQUEST)
+    send_message(error_message, socket, address)
+    timeout = datetime.now() + timedelta(
+        seconds=(rtt or RttEstimator()).close_timeout())
+    while timeout > datetime.now():
+        if stop_event.is_set():
+            return
+        if get_message_from_queue(message_queue):
+            send_message(error_message, socket, address)
+
+
+def end_send_protocol(message_queue, socket, address, stop_event, rtt=None):
+    """Envía el END de una subida y espera el ACK_END. Devuelve si el
+    servidor confirmó haber recibido el archivo íntegro"""
     end_message = Message.end()
-    send_message(end_message, socket, address)
+    tlp = TailLossProbe(rtt or RttEstimator(), MAX_END_PROBES)
+    send_message(end_message, socket, address, tlp.timeout())
     while True:
         if stop_event.is_set():
-            return
+            return False
         if end_message.is_timeout():
+            if tlp.exhausted():
+                logger.warning("No se ha recibido la confirmacion del fin de "
+                               "conexion.")
+                return False
             # Volver a enviar end_message.
-            send_message(end_message, socket, address)
-        message = (message_queue.get(False) if not message_queue.empty()
-                   else None)
+            tlp.probe_sent()
+            send_message(end_message, socket, address, tlp.timeout())
+        message = get_message_from_queue(message_queue)
         if message and message.get_type() == MessageType.ACK_END:
             send_ack(message.get_seq_number(), socket, address)
             if (message.get_seq_number() == 1):
                 logger.error("El archivo no se ha subido integramente. "
                              "Por favor intente nuevamente")
             logger.debug("Se ha cerrado la conexion correctamente")
-            return
+            return message.get_seq_number() != 1
 
 
 def end_send_protocol_download_sr(message_queue, socket, address, stop_event,
-                                  md5_digest):
-    end_message = Message.end_download(md5_digest)
-    send_message(end_message, socket, address)
+                                  md5_digest, rtt=None):
+    end_message = Message.end_download(resolve_digest(md5_digest))
+    tlp = TailLossProbe(rtt or RttEstimator(), MAX_END_PROBES)
+    send_message(end_message, socket, address, tlp.timeout())
     while True:
         if stop_event.is_set():
             return
         if end_message.is_timeout():
+            if tlp.exhausted():
+                logger.warning("No se ha recibido la confirmacion del fin de "
+                               "conexion.")
+                return
             # Volver a enviar end_message.
-            send_message(end_message, socket, address)
-        message = (message_queue.get(False) if not message_queue.empty()
-                   else None)
+            tlp.probe_sent()
+            send_message(end_message, socket, address, tlp.timeout())
+        message = get_message_from_queue(message_queue)
         if message and message.get_type() == MessageType.ACK_END:
             send_ack(message.get_seq_number(), socket, address)
             if (message.get_seq_number() == 1):
@@ -105,48 +163,70 @@ def end_send_protocol_download_sr(message_queue, socket, address, stop_event,
             return
 
 
-def end_recv_protocol(message_queue, end_message, socket, address, stop_event):
+def end_recv_protocol(message_queue, end_message, socket, address, stop_event,
+                      rtt=None):
     ack_end_message = Message.ack_end(end_message.get_seq_number())
-    send_message(ack_end_message, socket, address)
+    tlp = TailLossProbe(rtt or RttEstimator())
+    send_message(ack_end_message, socket, address, tlp.timeout())
     while True:
         if stop_event.is_set():
             logger.warning("No se ha podido confirmar el mensaje de fin de "
                            "conexion.")
             return
-        message = (message_queue.get(False) if not message_queue.empty()
-                   else None)
+        message = get_message_from_queue(message_queue)
         if message and message.get_type() == MessageType.ACK:
             logger.debug("Se ha cerrado la conexion correctamente")
             return
         elif message and message.get_type() == MessageType.END:
             # Volver a enviar ack_end_message.
-            send_message(ack_end_message, socket, address)
+            send_message(ack_end_message, socket, address, tlp.timeout())
+        elif ack_end_message.is_timeout():
+            if tlp.exhausted():
+                # El otro extremo ya cerró: no tiene sentido seguir esperando
+                logger.debug("Cierre por agotamiento de sondas.")
+                return
+            # Sondear al otro extremo por si se perdió el ACK_END o su ACK.
+            tlp.probe_sent()
+            send_message(ack_end_message, socket, address, tlp.timeout())
 
 
 def end_recv_protocol_on_error(message_queue, end_message, socket, address,
-                               stop_event):
+                               stop_event, rtt=None):
     ack_end_message = Message.ack_end(1)
-    send_message(ack_end_message, socket, address)
+    tlp = TailLossProbe(rtt or RttEstimator())
+    send_message(ack_end_message, socket, address, tlp.timeout())
     while True:
         if stop_event.is_set():
             logger.warning("No se ha podido confirmar el mensaje de fin de"
                            "conexion.")
             return
-        message = (message_queue.get(False) if not message_queue.empty()
-                   else None)
+        message = get_message_from_queue(message_queue)
         if message and message.get_type() == MessageType.ACK:
             logger.debug("Se ha cerrado la conexion correctamente")
             return
         elif message and message.get_type() == MessageType.END:
             # Volver a enviar ack_end_message.
-            send_message(ack_end_message, socket, address)
+            send_message(ack_end_message, socket, address, tlp.timeout())
+        elif ack_end_message.is_timeout():
+            if tlp.exhausted():
+                # El otro extremo ya cerró: no tiene sentido seguir esperando
+                logger.debug("Cierre por agotamiento de sondas.")
+                return
+            # Sondear al otro extremo por si se perdió el ACK_END o su ACK.
+            tlp.probe_sent()
+            send_message(ack_end_message, socket, address, tlp.timeout())
 
 
 def send_first_ack_message(message, socket, address, message_queue,
                            stop_event):
+    # Con un ACK_UPLOAD el archivo pudo viajar entero en el UPLOAD, así que
+    # el cliente puede pasar directamente al END
+    waited_messages = [MessageType.DATA]
+    if message.get_type() == MessageType.ACK_UPLOAD:
+        waited_messages.append(MessageType.END)
     ack_response = send_message_and_retry(
         message, socket, address, message_queue, stop_event,
-        [MessageType.DATA], MessageType.UPLOAD)
+        waited_messages, MessageType.UPLOAD)
     return ack_response
 
 
@@ -157,14 +237,23 @@ def send_first_download_message(message, socket, address, message_queue,
         [MessageType.ACK_DOWNLOAD, MessageType.ERROR])
     if not download_response:
         return None, None
+    if (download_response.get_type() == MessageType.ACK_DOWNLOAD and
+            download_response.get_early_data()):
+        # El bloque 0 vino en la respuesta: su ACK confirma el inicio
+        return (Message.data(0, download_response.get_early_data()),
+                download_response)
     if download_response.get_type() == MessageType.ACK_DOWNLOAD:
+        # Se confirma con un ACK_DOWNLOAD y no con un ACK 0: un ACK 0
+        # reenviado podría llegar después y confirmar un bloque 0 perdido
         return send_message_and_wait(
-            Message.ack(download_response.get_seq_number()), socket, address,
+            Message.ack_download_confirmation(), socket, address,
             message_queue, stop_event, [MessageType.DATA]), download_response
     elif download_response.get_type() == MessageType.ERROR:
         if download_response.get_error_code() == ErrorCode.FILE_NOT_FOUND:
             logger.error("El archivo no se ha encontrado en el servidor")
             return None, None
+        if download_response.get_error_code() == ErrorCode.INVALID_RANGE:
+            logger.error("El rango pedido está fuera del archivo")
         return send_message_and_wait(
             Message.ack(download_response.get_seq_number()), socket, address,
             message_queue, stop_event, [MessageType.ACK]), download_response
@@ -174,10 +263,10 @@ def send_first_upload_message(message, socket, address, message_queue,
                               stop_event):
     upload_response = send_message_and_wait(
         message, socket, address, message_queue, stop_event,
-        [MessageType.ACK, MessageType.ERROR])
+        [MessageType.ACK, MessageType.ACK_UPLOAD, MessageType.ERROR])
     if not upload_response:
         return None
-    if upload_response.get_type() == MessageType.ACK:
+    if upload_response.get_type() in [MessageType.ACK, MessageType.ACK_UPLOAD]:
         return upload_response
     elif upload_response.get_type() == MessageType.ERROR:
         if upload_response.get_error_code() == ErrorCode.FILE_ALREADY_EXISTS:
@@ -194,5 +283,5 @@ def send_first_ack_download_message(message, socket, address, message_queue,
                                     stop_event):
     ack_download_response = send_message_and_retry(
         message, socket, address, message_queue, stop_event,
-        [MessageType.ACK], MessageType.DOWNLOAD)
+        [MessageType.ACK, MessageType.ACK_DOWNLOAD], MessageType.DOWNLOAD)
     return ack_download_response
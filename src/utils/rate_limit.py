@@ -0,0 +1,100 @@
+import threading
+import time
+
+# Ráfaga que admite un token bucket, en segundos de su tasa
+BURST_SECONDS = 0.05
+
+RATE_SUFFIXES = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_rate(text):
+    """Convierte una tasa como '512K' o '10M' (bytes por segundo) a un
+    entero. Lanza ValueError si el formato es inválido"""
+    text = text.strip().upper()
+    suffix = text[-1:] if text[-1:] in RATE_SUFFIXES else ''
+    number = text[:len(text) - len(suffix)]
+    rate = float(number) * RATE_SUFFIXES[suffix]
+    if rate < 0:
+        raise ValueError(f"Tasa inválida: {text}")
+    return int(rate)
+
+
+class TokenBucket:
+    """Limitador de tasa: acumula bytes a la tasa configurada, hasta una
+    ráfaga máxima, y cada envío consume los bytes que ocupa"""
+    def __init__(self, rate, burst=None):
+        """
+        Inicializa el bucket lleno
+
+        Args:
+            rate: Bytes por segundo
+            burst: Bytes que pueden enviarse de corrido (por defecto
+                BURST_SECONDS de la tasa)
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else rate * BURST_SECONDS
+        self.tokens = self.burst
+        self.last_refill = time.monotonic()
+
+    def refill(self):
+        """Suma los bytes acumulados desde la última recarga"""
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def delay(self, size):
+        """Segundos que faltan para poder enviar size bytes (0 si ya se
+        puede). Un envío mayor que la ráfaga espera a tenerla completa"""
+        self.refill()
+        needed = min(size, self.burst)
+        if self.tokens >= needed:
+            return 0
+        return (needed - self.tokens) / self.rate
+
+    def consume(self, size):
+        """Descuenta un envío de size bytes"""
+        self.tokens -= size
+
+
+class RateLimitedSocket:
+    """Socket UDP con un tope de tasa compartido por todo lo que lo usa:
+    cuenta los bytes enviados y recibidos. Los envíos esperan a tener lugar
+    y las recepciones demoran a quien las procesa, lo que frena al otro
+    extremo porque sus ACKs y ventanas dependen de ese ritmo"""
+    def __init__(self, sock, rate):
+        """
+        Inicializa el socket limitado
+
+        Args:
+            sock: Socket UDP subyacente
+            rate: Bytes por segundo entre ambos sentidos
+        """
+        self.sock = sock
+        self.bucket = TokenBucket(rate)
+        self.lock = threading.Lock()
+
+    def throttle(self, size):
+        """Reserva size bytes de la tasa y espera lo que haga falta. La
+        reserva se hace antes de esperar para que los threads que usan el
+        socket a la vez no tomen el mismo lugar"""
+        with self.lock:
+            delay = self.bucket.delay(size)
+            self.bucket.consume(size)
+        if delay:
+            time.sleep(delay)
+
+    def sendto(self, data, address):
+        self.throttle(len(data))
+        return self.sock.sendto(data, address)
+
+    def recvfrom(self, bufsize):
+        data, address = self.sock.recvfrom(bufsize)
+        self.throttle(len(data))
+        return data, address
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def close(self):
+        self.sock.close()
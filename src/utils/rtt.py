@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+
+# Valores iniciales mientras no haya muestras de RTT (en segundos)
+INITIAL_RTT = 0.1
+MIN_PTO = 0.01
+MAX_PTO = 1.0
+MAX_TAIL_PROBES = 6
+# Quien inicia el cierre insiste más, porque el otro extremo puede demorar
+# su respuesta al END mientras verifica el archivo
+MAX_END_PROBES = 10
+# Cota del cierre de conexión: se espera a lo sumo esta cantidad de PTOs
+CLOSE_TIMEOUT_PTOS = 4
+MAX_CLOSE_TIMEOUT = 3.0
+
+
+class RttEstimator:
+    """Estimador de RTT suavizado (RFC 6298) usado para derivar los timeouts
+    de sondeo (probe timeout, PTO) del final de la transferencia."""
+    def __init__(self, initial_rtt=INITIAL_RTT):
+        """
+        Inicializa el estimador
+
+        Args:
+            initial_rtt: RTT asumido hasta recibir la primera muestra
+        """
+        self.initial_rtt = initial_rtt
+        self.srtt = None
+        self.rttvar = None
+
+    def sample(self, rtt):
+        """Incorpora una nueva muestra de RTT en segundos"""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+            return
+        self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+        self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+    def on_ack(self, message):
+        """Toma una muestra a partir del mensaje confirmado. Siguiendo el
+        algoritmo de Karn, se ignoran los mensajes retransmitidos."""
+        if message and message.transmissions == 1 and message.sent_time:
+            self.sample((datetime.now() - message.sent_time).total_seconds())
+
+    def pto(self, attempt=0):
+        """Devuelve el probe timeout, con backoff exponencial según la
+        cantidad de sondas ya enviadas"""
+        srtt = self.srtt if self.srtt is not None else self.initial_rtt
+        base = max(MIN_PTO, 2 * srtt)
+        return min(MAX_PTO, base * (2 ** attempt))
+
+    def close_timeout(self):
+        """Tiempo máximo que un extremo espera confirmaciones tardías
+        durante el cierre de la conexión"""
+        return min(MAX_CLOSE_TIMEOUT, CLOSE_TIMEOUT_PTOS * self.pto())
+
+
+class TailLossProbe:
+    """Temporizador de sondeo de cola: si no llega ningún ACK durante un PTO
+    se reenvía el último paquete pendiente en lugar de esperar al RTO."""
+    def __init__(self, rtt, max_probes=MAX_TAIL_PROBES):
+        """
+        Inicializa el temporizador
+
+        Args:
+            rtt: RttEstimator del que se deriva el PTO
+            max_probes: Cantidad máxima de sondas consecutivas sin respuesta
+        """
+        self.rtt = rtt
+        self.max_probes = max_probes
+        self.probes = 0
+        self.deadline = None
+
+    def arm(self):
+        """Programa la próxima sonda a un PTO de distancia"""
+        self.deadline = datetime.now() + timedelta(
+            seconds=self.rtt.pto(self.probes))
+
+    def reset(self):
+        """Reinicia el backoff al recibir un ACK nuevo"""
+        self.probes = 0
+        self.arm()
+
+    def is_due(self):
+        """Comprueba si corresponde enviar una sonda"""
+        return (self.deadline is not None and
+                self.probes < self.max_probes and
+                datetime.now() > self.deadline)
+
+    def exhausted(self):
+        """Comprueba si ya se enviaron todas las sondas permitidas"""
+        return self.probes >= self.max_probes
+
+    def probe_sent(self):
+        """Registra el envío de una sonda y reprograma la siguiente"""
+        self.probes += 1
+        self.arm()
+
+    def timeout(self):
+        """Timeout a usar para la próxima retransmisión de una sonda"""
+        return self.rtt.pto(self.probes)